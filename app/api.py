@@ -1,14 +1,38 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 import joblib
 import ee
 import threading
 import time
+import atexit
 import os
-import pandas as pd
+import sys
+import numpy as np
 import datetime
 import traceback 
+from typing import List
+
+# Cac module dung chung voi pipeline huan luyen (feature_provider, model_bundle,
+# tree_inference, ...) nam trong src/, cac module rieng cua API (feature_cache,
+# risk_tiles) nam canh file nay trong app/. Ca hai deu import theo ten, nen them
+# CA HAI thu muc vao sys.path: chay `python app/api.py` hay `uvicorn app.api:app`
+# tu thu muc goc deu import duoc. src/ tu chua du (khong import nguoc tu app/).
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(APP_DIR, '..', 'src'))
+for path in (SRC_DIR, APP_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+from feature_provider import (
+    FEATURES_ORDER, STATIC_FEATURES, DYNAMIC_FEATURES, StaleGridError, create_feature_provider
+)
+from feature_cache import TTLCache, SQLiteStaticCache, SingleFlight, snap_to_grid
+from risk_tiles import PrecomputedRiskTiles, OnTheFlyRiskTiles, render_tile, tile_etag, MAX_ZOOM
+
+from tree_inference import CompiledTreeModel
+from model_bundle import load_model_bundle, BundleError
 
 # =============================================================================
 # KHỞI TẠO APP VÀ GEE
@@ -27,35 +51,144 @@ except ee.ee_exception.EEException:
 # =============================================================================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models'))
+BUNDLE_DIR = os.path.join(MODEL_DIR, 'flood_model_bundle')
+# Model cu (pickle joblib), chi dung khi chua co goi model
 MODEL_PATH = os.path.join(MODEL_DIR, 'flood_model.xgb')
 SCALER_PATH = os.path.join(MODEL_DIR, 'scaler.joblib')
 
+# Goi model: cay da bien dich thanh mang numpy (memory-mapped), scaler da gop
+# vao nguong -> khoi dong khong can unpickle, khong import xgboost / sklearn.
+# Lo lon (/predict/batch, du bao, tile) dung booster XGBoost cua goi (xem predict_probabilities)
+bundle = None
+inference_model = None
 try:
-    model = joblib.load(MODEL_PATH)
-    scaler = joblib.load(SCALER_PATH)
-    print("Tai model va scaler thanh cong.")
-except FileNotFoundError:
-    print(f"LOI: Khong tim thay model tai {MODEL_PATH} hoac scaler tai {SCALER_PATH}")
-    model = None
-    scaler = None
-
-# Day la thu tu dac trung ma model da hoc (rat quan trong)
-FEATURES_ORDER = [
-    # Đặc trưng địa hình
-    'elevation', 'slope', 'aspect',
-    # Đặc trưng lớp phủ và đất
-    'land_cover', 'soil_type',
-    # Flags từ land_cover
-    'is_flood_prone', 'is_permanent_water', 'is_urban', 'is_agriculture',
-    # Đặc trưng động
-    'precip_total', 'precip_14_day', 'precip_7_day', 'precip_3_day',
-    'soil_moisture'
-]
-
-# Simple in-memory TTL cache for GEE point queries to reduce latency
-GEE_CACHE = {}
-GEE_CACHE_LOCK = threading.Lock()
-GEE_CACHE_TTL = 300  # seconds
+    # Khoi dong chi doc manifest + kiem tra cac file co mat; sha256 toan goi da ghi
+    # khi tao goi va duoc kiem tra lai trong cac lenh batch (predict_raster, tree_inference)
+    loaded_bundle = load_model_bundle(BUNDLE_DIR, expected_features=FEATURES_ORDER, verify=False)
+    inference_model = loaded_bundle.inference_model
+    bundle = loaded_bundle
+    print(f"Tai goi model thanh cong ({inference_model.n_trees} cay, "
+          f"tao luc {bundle.created_at}).")
+except BundleError as e:
+    print(f"CANH BAO: Khong dung duoc goi model ({e}). Thu model cu (joblib)...")
+    try:
+        model = joblib.load(MODEL_PATH)
+        scaler = joblib.load(SCALER_PATH)
+        inference_model = CompiledTreeModel.from_xgb_model(model, scaler)
+        print(f"Tai va bien dich model cu thanh cong ({inference_model.n_trees} cay). "
+              f"Chay 'python src/model_bundle.py' de tao goi model.")
+    except FileNotFoundError:
+        print(f"LOI: Khong tim thay model tai {MODEL_PATH} hoac scaler tai {SCALER_PATH}")
+
+# =============================================================================
+# CACHE DAC TRUNG 2 TANG
+# =============================================================================
+# Tang tinh: elevation, slope, aspect, land_cover, soil_type (+ flags) khong bao
+# gio thay doi -> luu vinh vien tren dia (SQLite), con nguyen sau khi khoi dong lai.
+CACHE_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'cache'))
+STATIC_CACHE_PATH = os.path.join(CACHE_DIR, 'static_features.sqlite')
+STATIC_CACHE_MAX_ENTRIES = 500000
+
+# Tang dong: cua so mua IMERG ket thuc 3 ngay truoc hom nay (doi theo ngay),
+# SMAP cap nhat 1 lan/ngay -> TTL vai gio la du moi, khong can 300 giay.
+DYNAMIC_CACHE_TTL = 3 * 3600  # seconds
+DYNAMIC_CACHE_MAX_ENTRIES = 20000
+
+static_cache = SQLiteStaticCache(STATIC_CACHE_PATH, max_entries=STATIC_CACHE_MAX_ENTRIES)
+# Ghi cac thoi diem truy cap con dang gom khi tat server
+atexit.register(static_cache.flush)
+dynamic_cache = TTLCache(maxsize=DYNAMIC_CACHE_MAX_ENTRIES, ttl=DYNAMIC_CACHE_TTL)
+
+# Cac request dong thoi cho cung 1 o luoi chi tao 1 truy van GEE
+feature_fetches = SingleFlight()
+
+# Do phan giai lay mau dac trung (m); khoa cache duoc gan vao luoi nay
+SAMPLING_SCALE = 90
+
+# Gioi han cho endpoint /predict/batch
+GEE_BATCH_CHUNK_SIZE = 500   # so diem toi da trong 1 lan reduceRegions().getInfo()
+MAX_BATCH_POINTS = 5000      # so diem toi da trong 1 request
+
+# So ngay du bao cua /forecast
+FORECAST_DAYS = 7
+
+# =============================================================================
+# GIOI HAN TAI GEE (executor rieng + deadline)
+# =============================================================================
+# getInfo() block tu vai tram ms den vai giay -> chay trong threadpool rieng,
+# khong chiem threadpool mac dinh cua FastAPI.
+GEE_MAX_WORKERS = 8          # so truy van GEE chay dong thoi toi da
+GEE_QUEUE_TIMEOUT = 2.0      # giay cho slot trong truoc khi tra 503
+GEE_CALL_TIMEOUT = 20.0      # deadline cho 1 truy van 1 diem (giay) -> 504
+GEE_BATCH_TIMEOUT = 120.0    # deadline cho /predict/batch (giay) -> 504
+
+gee_executor = ThreadPoolExecutor(max_workers=GEE_MAX_WORKERS, thread_name_prefix='gee')
+# Semaphore cua threading (khong gan voi event loop nao); worker tra slot khi xong
+gee_slots = threading.BoundedSemaphore(GEE_MAX_WORKERS)
+GEE_SLOT_POLL_INTERVAL = 0.05  # giay
+gee_pool_stats = {'rejected': 0, 'timed_out': 0}
+
+# =============================================================================
+# NGUON DAC TRUNG (GEE hoac luoi raster cuc bo)
+# =============================================================================
+# FEATURE_PROVIDER=local de chay offline voi cac luoi .npy trong LOCAL_GRID_DIR
+FEATURE_PROVIDER_KIND = os.environ.get('FEATURE_PROVIDER', 'gee')
+LOCAL_GRID_DIR = os.environ.get(
+    'LOCAL_GRID_DIR', os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'feature_grids'))
+)
+
+# Cube mua / do am cuc bo (job 'python src/climate_store.py'): khi da co du ngay,
+# dac trung dong khong can goi GEE. CLIMATE_CUBE_DIR= (rong) de tat.
+CLIMATE_CUBE_DIR = os.environ.get(
+    'CLIMATE_CUBE_DIR', os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'climate_cube'))
+)
+
+feature_provider = create_feature_provider(
+    FEATURE_PROVIDER_KIND, grid_dir=LOCAL_GRID_DIR,
+    scale=SAMPLING_SCALE, batch_chunk_size=GEE_BATCH_CHUNK_SIZE,
+    cube_dir=CLIMATE_CUBE_DIR or None
+)
+print(f"Nguon dac trung: {feature_provider.name}")
+
+# =============================================================================
+# O BAN DO NGUY CO (XYZ)
+# =============================================================================
+# Uu tien raster tinh san (src/predict_raster.py); neu khong co va nguon dac
+# trung la 'local' thi tinh o truc tiep. PNG da ma hoa duoc giu trong LRU.
+RISK_RASTER_DIR = os.environ.get(
+    'RISK_RASTER_DIR', os.path.abspath(os.path.join(BASE_DIR, '..', 'outputs', 'risk_raster'))
+)
+TILE_CACHE_MAX_ENTRIES = 4096         # ~ vai chuc MB PNG
+TILE_CACHE_TTL = DYNAMIC_CACHE_TTL    # o tinh truc tiep phu thuoc mua gan day
+TILE_BROWSER_MAX_AGE = 3600           # Cache-Control cho trinh duyet (giay)
+
+tile_cache = TTLCache(maxsize=TILE_CACHE_MAX_ENTRIES, ttl=TILE_CACHE_TTL)
+tile_renders = SingleFlight()
+_tile_source = {'source': None, 'mtime': None}
+_tile_source_lock = threading.Lock()
+
+
+def get_tile_source():
+    """Tra ve nguon o hien tai; tai lai raster khi raster.json thay doi.
+
+    predict_raster chi ghi raster.json (doi ten nguyen tu) khi ban do da xong
+    va go no khi bat dau tinh lai, nen raster dang tinh do khong bao gio duoc phuc vu.
+    """
+    meta_path = os.path.join(RISK_RASTER_DIR, 'raster.json')
+    with _tile_source_lock:
+        if os.path.exists(meta_path):
+            mtime = os.stat(meta_path).st_mtime_ns
+            if _tile_source['mtime'] != mtime:
+                _tile_source['source'] = PrecomputedRiskTiles(RISK_RASTER_DIR)
+                _tile_source['mtime'] = mtime
+        elif feature_provider.name == 'local' and inference_model is not None:
+            if not isinstance(_tile_source['source'], OnTheFlyRiskTiles):
+                _tile_source['source'] = OnTheFlyRiskTiles(feature_provider, predict_probabilities)
+                _tile_source['mtime'] = None
+        else:
+            _tile_source['source'] = None
+            _tile_source['mtime'] = None
+        return _tile_source['source']
 
 
 # =============================================================================
@@ -65,179 +198,441 @@ class PointData(BaseModel):
     lat: float
     lon: float
 
+class BatchPointData(BaseModel):
+    points: List[PointData]
+
 # =============================================================================
-# CÁC HÀM LOGIC GEE (Lay du lieu qua khu)
+# CÁC HÀM LAY DAC TRUNG (GEE hoac luoi cuc bo, co cache)
 # =============================================================================
-def get_gee_features_at_point(lat, lon):
-    """Get GEE-derived features at a point with simple in-memory caching.
+def _merge_features(static, dynamic):
+    """Ghep 2 phan dac trung thanh 1 dict theo FEATURES_ORDER (ban sao moi)."""
+    data_dict = {}
+    data_dict.update(static)
+    data_dict.update(dynamic)
+    return {col: data_dict.get(col) for col in FEATURES_ORDER}
+
+
+def _store_features(key, data_dict, columns):
+    """Tach dac trung vua lay theo tang va luu vao cache tuong ung."""
+    if STATIC_FEATURES[0] in columns:
+        static_cache.put(key, {col: data_dict.get(col) for col in STATIC_FEATURES})
+    if DYNAMIC_FEATURES[0] in columns:
+        dynamic_cache.put(key, {col: data_dict.get(col) for col in DYNAMIC_FEATURES})
+
+
+def _lookup_cached(key):
+    """Tra ve (static, dynamic, columns can lay) cho 1 o luoi."""
+    static = static_cache.get(key)
+    dynamic = dynamic_cache.get(key)
+    columns = []
+    if static is None:
+        columns += STATIC_FEATURES
+    if dynamic is None:
+        columns += DYNAMIC_FEATURES
+    return static, dynamic, tuple(columns)
+
+
+def get_features_at_point(lat, lon):
+    """Get features at a point from the configured provider.
+
+    Slow providers (GEE) sit behind a two-tier cache keyed by the
+    `SAMPLING_SCALE` pixel the point falls in: static features are stored
+    permanently in SQLite, dynamic features in memory for
+    `DYNAMIC_CACHE_TTL` seconds. Only the missing tier is fetched, at the
+    pixel centre, so every click inside a pixel sees the same values.
+    Concurrent misses for the same pixel share one in-flight fetch. Local
+    providers are queried directly.
+    """
+    if not feature_provider.cacheable:
+        return feature_provider.get_features(lat, lon)
+
+    key, cell_lat, cell_lon = snap_to_grid(lat, lon, SAMPLING_SCALE)
+    static, dynamic, columns = _lookup_cached(key)
+    if columns:
+        def fetch():
+            data_dict = feature_provider.get_features(cell_lat, cell_lon, columns=columns)
+            _store_features(key, data_dict, columns)
+            return data_dict
+
+        fetched = feature_fetches.do((key, columns), fetch)
+        static = static or fetched
+        dynamic = dynamic or fetched
+
+    return _merge_features(static, dynamic)
+
 
-    Caches results for `GEE_CACHE_TTL` seconds keyed by rounded lat/lon to
-    avoid frequent Earth Engine round-trips for nearby clicks.
+def get_features_for_points(points):
+    """Lay dac trung cho nhieu diem cung luc.
+
+    Cac diem duoc gan vao o luoi `SAMPLING_SCALE` m; moi o chi lay phan dac
+    trung con thieu trong cache (tai tam o). Cac o thieu cung nhom dac trung
+    duoc lay chung bang `feature_provider.get_features_batch`
+    (voi GEE: `reduceRegions` theo tung khoi `GEE_BATCH_CHUNK_SIZE` diem, moi
+    khoi 1 lan `getInfo()`).
+
+    Args:
+        points: danh sach cap (lat, lon).
+
+    Returns:
+        list[dict]: dac trung cua tung diem, cung thu tu voi `points`.
     """
-    # Coarse rounding to reuse nearby queries
-    key = f"{round(lat,4)}_{round(lon,4)}"
-    now_ts = time.time()
+    if not feature_provider.cacheable:
+        return feature_provider.get_features_batch(points)
+
+    cells = [snap_to_grid(lat, lon, SAMPLING_SCALE) for lat, lon in points]
+    keys = [key for key, _, _ in cells]
+
+    # Moi o luoi chi tra cache/lay 1 lan, du xuat hien nhieu lan trong request
+    cached = {}
+    for key, cell_lat, cell_lon in cells:
+        if key not in cached:
+            cached[key] = _lookup_cached(key) + ((cell_lat, cell_lon),)
+
+    # Gom cac o theo nhom cot can lay (chi tinh, chi dong, hoac ca hai)
+    groups = {}
+    for key, (_, _, columns, center) in cached.items():
+        if columns:
+            groups.setdefault(columns, []).append((key, center))
+
+    fetched = {}
+    for columns, members in groups.items():
+        rows = feature_provider.get_features_batch([center for _, center in members], columns=columns)
+        for (key, _), data_dict in zip(members, rows):
+            _store_features(key, data_dict, columns)
+            fetched[key] = data_dict
+
+    results = []
+    for key in keys:
+        static, dynamic, _, _ = cached[key]
+        extra = fetched.get(key, {})
+        results.append(_merge_features(static or extra, dynamic or extra))
+    return results
+
+
+async def run_feature_call(fn, *args, timeout=GEE_CALL_TIMEOUT):
+    """Chay ham lay dac trung (blocking) trong gee_executor voi deadline.
+
+    - Cho toi da GEE_QUEUE_TIMEOUT giay de co slot (hang doi); het han -> HTTP 503.
+    - Qua `timeout` giay -> HTTP 504. Slot chi duoc tra khi thread thuc su
+      xong, nen so truy van GEE dang chay khong bao gio vuot GEE_MAX_WORKERS.
+    Nguon cuc bo (khong can cache) nhanh nen duoc goi truc tiep.
+    """
+    if not feature_provider.cacheable:
+        return fn(*args)
+
+    deadline = time.monotonic() + GEE_QUEUE_TIMEOUT
+    while not gee_slots.acquire(blocking=False):
+        if time.monotonic() >= deadline:
+            gee_pool_stats['rejected'] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="May chu dang qua tai (het slot truy van GEE). Vui long thu lai sau.",
+                headers={"Retry-After": "5"}
+            )
+        await asyncio.sleep(GEE_SLOT_POLL_INTERVAL)
+
+    try:
+        future = gee_executor.submit(fn, *args)
+    except BaseException:
+        gee_slots.release()
+        raise
+    future.add_done_callback(lambda _: gee_slots.release())
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+    except asyncio.TimeoutError:
+        gee_pool_stats['timed_out'] += 1
+        raise HTTPException(
+            status_code=504,
+            detail=f"GEE khong phan hoi trong {timeout:.0f} giay."
+        )
+
 
-    with GEE_CACHE_LOCK:
-        entry = GEE_CACHE.get(key)
-        if entry:
-            ts, data = entry
-            if now_ts - ts < GEE_CACHE_TTL:
-                # return a copy to avoid accidental mutation
-                return dict(data)
+# Diem khong co du lieu dac trung nao (ngoai vung phu cua nguon, vd. ngoai bien)
+NO_FEATURE_DATA = "Khong co du lieu dac trung tai diem nay (ngoai vung phu du lieu)."
 
-    point = ee.Geometry.Point(lon, lat)
-    today = ee.Date(datetime.datetime.now(datetime.timezone.utc))
 
-    # --- 1. Static features ---
-    dem = ee.Image("USGS/SRTMGL1_003")
-    slope = ee.Terrain.slope(dem).rename('slope')
-    aspect = ee.Terrain.aspect(dem).rename('aspect')
-    land_cover = ee.ImageCollection("ESA/WorldCover/v100").first().select('Map').rename('land_cover')
-    soil = ee.Image("OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02").select('b0').rename('soil_type')
+def has_feature_data(features):
+    """False neu moi dac trung cua diem deu la Null/NaN (khong du doan duoc)."""
+    return any(
+        value is not None and not (isinstance(value, float) and np.isnan(value))
+        for value in (features.get(col) for col in FEATURES_ORDER)
+    )
 
-    is_flood_prone = land_cover.eq(40).Or(land_cover.eq(50)).Or(land_cover.eq(90)).rename('is_flood_prone')
-    is_permanent_water = land_cover.eq(80).rename('is_permanent_water')
-    is_urban = land_cover.eq(50).rename('is_urban')
-    is_agriculture = land_cover.eq(40).rename('is_agriculture')
 
-    static_features_image = dem.rename('elevation').addBands([
-        slope, aspect, land_cover.toByte(), soil.toByte(),
-        is_flood_prone.toByte(), is_permanent_water.toByte(), is_urban.toByte(), is_agriculture.toByte()
-    ])
+def require_feature_data(features):
+    """HTTP 422 cho diem khong co du lieu dac trung thay vi du doan tu toan so 0."""
+    if not has_feature_data(features):
+        raise HTTPException(status_code=422, detail=NO_FEATURE_DATA)
 
-    # --- 2. Antecedent / dynamic features ---
-    end_date = today.advance(-3, 'day')
 
-    pre_start_date_14 = end_date.advance(-14, 'day')
-    precip_14_day = ee.ImageCollection("NASA/GPM_L3/IMERG_V07").filterDate(pre_start_date_14, end_date).select('precipitation').sum().rename('precip_14_day')
+def features_to_matrix(features_list):
+    """Chuyen danh sach dict dac trung thanh ma tran numpy theo FEATURES_ORDER (Null -> 0)."""
+    X = np.array(
+        [[features.get(col) for col in FEATURES_ORDER] for features in features_list],
+        dtype=np.float64
+    ).reshape(len(features_list), len(FEATURES_ORDER))
+    if np.isnan(X).any():
+        X = np.nan_to_num(X, nan=0.0)
+        print("Canh bao: Nguon dac trung tra ve gia tri Null, dang dien gia tri 0.")
+    return X
 
-    pre_start_date_7 = end_date.advance(-7, 'day')
-    precip_7_day = ee.ImageCollection("NASA/GPM_L3/IMERG_V07").filterDate(pre_start_date_7, end_date).select('precipitation').sum().rename('precip_7_day')
 
-    pre_start_date_3 = end_date.advance(-3, 'day')
-    precip_3_day = ee.ImageCollection("NASA/GPM_L3/IMERG_V07").filterDate(pre_start_date_3, end_date).select('precipitation').sum().rename('precip_3_day')
+def predict_probabilities(X):
+    """Du doan xac suat ngap cho ca ma tran (dac trung goc) trong 1 lan goi.
+
+    Lo nho: CompiledTreeModel; lo tu BOOSTER_MIN_ROWS dong: booster XGBoost cua goi
+    model (nhanh hon nhieu, vd. 1 tile 256x256). Model cu (joblib) chi co CompiledTreeModel.
+    """
+    if bundle is not None:
+        return bundle.predict_proba(X)
+    return inference_model.predict_proba(X)
 
-    pre_start_date_3_sm = end_date.advance(-3, 'day')
-    sm_collection = ee.ImageCollection("NASA/SMAP/SPL3SMP_E/005").filterDate(pre_start_date_3_sm, end_date).select('soil_moisture_am')
 
-    collection_size = sm_collection.size()
-    mean_sm_with_data = sm_collection.mean().unmask(0).rename('soil_moisture')
-    mean_sm_empty = ee.Image(0).rename('soil_moisture')
-    soil_moisture_mean = ee.Image(ee.Algorithms.If(collection_size.gt(0), mean_sm_with_data, mean_sm_empty))
+def build_prediction(features_dict):
+    """Du doan xac suat ngap hien tai cho 1 diem (ket qua cua /predict)."""
+    X = features_to_matrix([features_dict])
+    probability = predict_probabilities(X)[0]
 
-    dynamic_features = precip_14_day.addBands([precip_7_day, precip_3_day, soil_moisture_mean, ee.Image(0).rename('precip_total')])
+    # Trả về cả đặc trưng gốc để hiển thị
+    return {
+        "probability": float(probability),
+        "features": dict(zip(FEATURES_ORDER, X[0].tolist()))
+    }
 
-    # --- 3. Merge and fetch ---
-    all_features_image = static_features_image.addBands(dynamic_features)
-    data_dict = all_features_image.reduceRegion(reducer=ee.Reducer.first(), geometry=point, scale=90).getInfo()
 
-    # Cache and return
-    with GEE_CACHE_LOCK:
-        GEE_CACHE[key] = (now_ts, dict(data_dict))
+def build_forecast(current_features):
+    """Du bao nguy co ngap FORECAST_DAYS ngay toi (ket qua cua /forecast).
 
-    return data_dict
+    Khong dung du bao mua ngoai (GFS): moi ngay dung dac trung hien tai.
+    Cac dong cua tung ngay duoc xep thanh 1 ma tran va du doan trong 1 lan goi.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    base_precip = float(current_features.get('precip_total', 0) or 0)
+
+    dates = []
+    rows = []
+    for day_offset in range(FORECAST_DAYS):
+        dates.append((now + datetime.timedelta(days=day_offset)).date().isoformat())
+
+        # Copy features and set precip_total to base_precip (no change)
+        features = dict(current_features)
+        features['precip_total'] = base_precip
+        rows.append(features)
+
+    probabilities = predict_probabilities(features_to_matrix(rows))
+
+    forecasts = [
+        {
+            'date': date_key,
+            'precipitation_mm_24hr': None,
+            'flood_probability': float(probability)
+        }
+        for date_key, probability in zip(dates, probabilities)
+    ]
+
+    return {
+        'forecast': forecasts,
+        'rain_forecast_used': False,
+        'detail': {
+            'method': 'no_rain_forecast',
+            'note': 'Flood probability computed using current features only; no rainfall forecast used.',
+            'current_features': current_features
+        }
+    }
 
 # =============================================================================
 # ENDPOINT 1: DU DOAN XAC SUAT NGAP (CHO DONG HO)
 # =============================================================================
 @app.post("/predict")
-def predict_flood(point_data: PointData):
-    if not model or not scaler:
+async def predict_flood(point_data: PointData):
+    if inference_model is None:
+        raise HTTPException(status_code=500, detail="Model hoac Scaler chua duoc tai.")
+
+    try:
+        features_dict = await run_feature_call(get_features_at_point, point_data.lat, point_data.lon)
+        require_feature_data(features_dict)
+        return build_prediction(features_dict)
+
+    except HTTPException:
+        raise
+    except StaleGridError as e:
+        raise HTTPException(status_code=503, detail=f"Luoi dac trung cuc bo da cu: {e}")
+    except ee.ee_exception.EEException as e:
+        raise HTTPException(status_code=500, detail=f"Loi GEE: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Loi server: {e}")
+
+# =============================================================================
+# ENDPOINT 1b: DU DOAN XAC SUAT NGAP CHO NHIEU DIEM (BATCH)
+# =============================================================================
+@app.post("/predict/batch")
+async def predict_flood_batch(batch_data: BatchPointData):
+    """Du doan cho nhieu diem: 1 lan reduceRegions (theo khoi) + 1 lan predict_proba."""
+    if inference_model is None:
         raise HTTPException(status_code=500, detail="Model hoac Scaler chua duoc tai.")
+    if not batch_data.points:
+        raise HTTPException(status_code=400, detail="Danh sach diem rong.")
+    if len(batch_data.points) > MAX_BATCH_POINTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Toi da {MAX_BATCH_POINTS} diem moi request (nhan {len(batch_data.points)})."
+        )
 
     try:
-        features_dict = get_gee_features_at_point(point_data.lat, point_data.lon)
-        df = pd.DataFrame([features_dict], columns=FEATURES_ORDER)
-        
-        if df.isnull().values.any():
-            with pd.option_context('future.no_silent_downcasting', True):
-                df = df.fillna(0).infer_objects(copy=False)
-            print("Canh bao: GEE tra ve gia tri Null, dang dien gia tri 0.")
-
-        scaled_features = scaler.transform(df)
-        probability = model.predict_proba(scaled_features)[0][1]
-        
-        # Trả về cả đặc trưng gốc để hiển thị
-        features_dict = {}
-        for col in df.columns:
-            features_dict[col] = float(df[col].iloc[0])
-        
+        points = [(p.lat, p.lon) for p in batch_data.points]
+        features_list = await run_feature_call(get_features_for_points, points, timeout=GEE_BATCH_TIMEOUT)
+        # Chi du doan cho diem co du lieu; diem khong co -> probability null + error
+        known = [i for i, features in enumerate(features_list) if has_feature_data(features)]
+        probabilities = {}
+        records = {}
+        if known:
+            X = features_to_matrix([features_list[i] for i in known])
+            probabilities = dict(zip(known, predict_probabilities(X).tolist()))
+            records = dict(zip(known, (dict(zip(FEATURES_ORDER, row)) for row in X.tolist())))
+
+        predictions = []
+        for i, (lat, lon) in enumerate(points):
+            if i in probabilities:
+                predictions.append({
+                    "lat": lat,
+                    "lon": lon,
+                    "probability": float(probabilities[i]),
+                    "features": records[i]
+                })
+            else:
+                predictions.append({
+                    "lat": lat,
+                    "lon": lon,
+                    "probability": None,
+                    "features": None,
+                    "error": NO_FEATURE_DATA
+                })
+
         return {
-            "probability": float(probability),
-            "features": features_dict
+            "count": len(predictions),
+            "predictions": predictions
         }
 
+    except HTTPException:
+        raise
+    except StaleGridError as e:
+        raise HTTPException(status_code=503, detail=f"Luoi dac trung cuc bo da cu: {e}")
     except ee.ee_exception.EEException as e:
         raise HTTPException(status_code=500, detail=f"Loi GEE: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Loi server: {e}")
 
+# =============================================================================
+# ENDPOINT 2: DU BAO 7 NGAY
+# =============================================================================
 # GFS retrieval code removed — forecasts are not used anymore. Kept removed
 # version out of the repo history; functionality replaced by 'no_rain_forecast'
 
 @app.post("/forecast")
-def get_precipitation_forecast(point_data: PointData):
+async def get_precipitation_forecast(point_data: PointData):
     """
     Endpoint trả về:
     1. Dự báo lượng mưa 7 ngày tới (3h một lần)
     2. Dự báo nguy cơ ngập cho 7 ngày tới (mỗi ngày 1 dự báo)
     """
     try:
-        # New behaviour: do not use external rainfall forecasts (GFS).
-        # Instead, return a 7-day flood probability forecast using current
-        # features only (no assumed additional rainfall).
-        current_features = get_gee_features_at_point(point_data.lat, point_data.lon)
-
-        # Ensure dataframe has required columns in the correct order
-        df_current = pd.DataFrame([current_features], columns=FEATURES_ORDER)
-        if df_current.isnull().values.any():
-            df_current = df_current.fillna(0)
-
-        # Prepare 7-day forecasts: using the same features (no rainfall forecast)
-        forecasts = []
-        now = datetime.datetime.now(datetime.timezone.utc)
-        base_precip = float(current_features.get('precip_total', 0) or 0)
-
-        for day_offset in range(7):
-            date_key = (now + datetime.timedelta(days=day_offset)).date().isoformat()
-
-            # Copy features and set precip_total to base_precip (no change)
-            features = current_features.copy()
-            features['precip_total'] = base_precip
-
-            df = pd.DataFrame([features], columns=FEATURES_ORDER)
-            if df.isnull().values.any():
-                df = df.fillna(0)
+        current_features = await run_feature_call(get_features_at_point, point_data.lat, point_data.lon)
+        require_feature_data(current_features)
+        return build_forecast(current_features)
+    
+    except StaleGridError as e:
+        raise HTTPException(status_code=503, detail=f"Luoi dac trung cuc bo da cu: {e}")
+    except ee.ee_exception.EEException as e:
+        raise HTTPException(status_code=500, detail=f"Loi GEE: {e}")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Loi Python/FastAPI trong /forecast: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Loi server: {e}")
 
-            scaled = scaler.transform(df)
-            probability = float(model.predict_proba(scaled)[0][1])
+# =============================================================================
+# ENDPOINT 3: DU DOAN HIEN TAI + DU BAO 7 NGAY (1 LAN LAY DAC TRUNG)
+# =============================================================================
+@app.post("/predict/full")
+async def predict_with_forecast(point_data: PointData):
+    """Tra ve ket qua cua /predict va /forecast tu cung 1 lan lay dac trung.
 
-            forecasts.append({
-                'date': date_key,
-                'precipitation_mm_24hr': None,
-                'flood_probability': probability
-            })
+    Dashboard chi can goi endpoint nay 1 lan cho moi click.
+    """
+    if inference_model is None:
+        raise HTTPException(status_code=500, detail="Model hoac Scaler chua duoc tai.")
 
+    try:
+        current_features = await run_feature_call(get_features_at_point, point_data.lat, point_data.lon)
+        require_feature_data(current_features)
         return {
-            'forecast': forecasts,
-            'rain_forecast_used': False,
-            'detail': {
-                'method': 'no_rain_forecast',
-                'note': 'Flood probability computed using current features only; no rainfall forecast used.',
-                'current_features': current_features
-            }
+            "prediction": build_prediction(current_features),
+            "forecast": build_forecast(current_features)
         }
-    
+
+    except HTTPException:
+        raise
+    except StaleGridError as e:
+        raise HTTPException(status_code=503, detail=f"Luoi dac trung cuc bo da cu: {e}")
     except ee.ee_exception.EEException as e:
         raise HTTPException(status_code=500, detail=f"Loi GEE: {e}")
-    except HTTPException as e:
-        raise e
     except Exception as e:
-        print(f"Loi Python/FastAPI trong /forecast: {e}")
+        print(f"Loi Python/FastAPI trong /predict/full: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Loi server: {e}")
 
+# =============================================================================
+# ENDPOINT 4: O BAN DO NGUY CO NGAP (XYZ PNG)
+# =============================================================================
+@app.get("/tiles/{z}/{x}/{y}.png")
+async def get_risk_tile(z: int, x: int, y: int, request: Request):
+    """O PNG 256x256 mau theo xac suat ngap, dung lam TileLayer tren ban do."""
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=404, detail="O ban do khong hop le.")
+
+    source = get_tile_source()
+    if source is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Chua co raster nguy co (chay src/predict_raster.py) hoac nguon dac trung local."
+        )
+
+    key = (source.version, z, x, y)
+    cached = tile_cache.get(key)
+    if cached is None:
+        # Ve o ton CPU -> chay ngoai event loop; cac request cung o gop thanh 1 lan ve
+        loop = asyncio.get_running_loop()
+        try:
+            png = await loop.run_in_executor(
+                None, tile_renders.do, key, lambda: render_tile(source, z, x, y)
+            )
+        except StaleGridError as e:
+            raise HTTPException(status_code=503, detail=f"Luoi dac trung cuc bo da cu: {e}")
+        cached = (png, tile_etag(png))
+        tile_cache.put(key, cached)
+
+    png, etag = cached
+    headers = {'ETag': etag, 'Cache-Control': f'public, max-age={TILE_BROWSER_MAX_AGE}'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=png, media_type='image/png', headers=headers)
+
+# =============================================================================
+# ENDPOINT: THONG KE CACHE
+# =============================================================================
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {
+        "feature_provider": feature_provider.name,
+        "static": static_cache.stats(),
+        "dynamic": dynamic_cache.stats(),
+        "single_flight": feature_fetches.stats(),
+        "tiles": tile_cache.stats(),
+        "climate_cube": feature_provider.stats() if hasattr(feature_provider, 'stats') else None,
+        "gee_pool": {"max_workers": GEE_MAX_WORKERS, **gee_pool_stats}
+    }
+
 # =============================================================================
 # ENDPOINT 0: TRANG GOC (Chao mung)
 # =============================================================================
@@ -70,7 +70,19 @@ with col1:
     
     # Tao ban do
     m = folium.Map(location=st.session_state.map_center, zoom_start=10)
-    
+
+    # Lop nguy co ngap: o PNG tu API (/tiles), trinh duyet va API deu cache
+    folium.TileLayer(
+        tiles=f"{API_URL}/tiles/{{z}}/{{x}}/{{y}}.png",
+        attr="Mô hình dự báo ngập lụt",
+        name="Nguy cơ ngập",
+        overlay=True,
+        control=True,
+        opacity=0.6,
+        max_zoom=18,
+    ).add_to(m)
+    folium.LayerControl().add_to(m)
+
     # Them marker
     if st.session_state.last_clicked:
         folium.Marker(
@@ -95,28 +107,21 @@ with col1:
             
             with st.spinner("⏳ Đang lấy dữ liệu và dự đoán..."):
                 try:
-                    # Gọi API dự đoán hiện tại
-                    predict_response = requests.post(
-                        f"{API_URL}/predict", 
-                        json=point_data
-                    )
-                    predict_response.raise_for_status()
-                    predict_data = predict_response.json()
-                    st.session_state.current_prediction = predict_data
-                    
-                    # Gọi API dự báo
-                    forecast_response = requests.post(
-                        f"{API_URL}/forecast", 
+                    # Gọi API dự đoán hiện tại + dự báo 7 ngày (1 lần lấy dữ liệu)
+                    full_response = requests.post(
+                        f"{API_URL}/predict/full", 
                         json=point_data
                     )
-                    forecast_response.raise_for_status()
-                    st.session_state.forecast_data = forecast_response.json()
+                    full_response.raise_for_status()
+                    full_data = full_response.json()
+                    st.session_state.current_prediction = full_data['prediction']
+                    st.session_state.forecast_data = full_data['forecast']
                     
                     # Debug response và status code
                     with st.expander("🔍 Debug: API Response"):
-                        st.write(f"Status Code: {forecast_response.status_code}")
+                        st.write(f"Status Code: {full_response.status_code}")
                         st.write("Response Headers:")
-                        st.json(dict(forecast_response.headers))
+                        st.json(dict(full_response.headers))
                         st.write("Response Data:")
                         st.json(st.session_state.forecast_data)
                     
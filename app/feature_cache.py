@@ -0,0 +1,295 @@
+import os
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# =============================================================================
+# KHOA CACHE THEO LUOI LAY MAU
+# =============================================================================
+# GEE lay mau voi scale (m) trong EPSG:4326 -> kich thuoc pixel theo do
+METERS_PER_DEGREE = 2 * math.pi * 6378137 / 360
+
+
+def snap_to_grid(lat, lon, scale=90):
+    """Gan (lat, lon) vao o luoi `scale` met ma GEE dung khi lay mau.
+
+    Moi diem trong cung 1 pixel cho cung 1 khoa, nen cac click trong cung
+    pixel deu trung cache.
+
+    Returns:
+        tuple: (key, center_lat, center_lon) - khoa cache va tam cua o luoi.
+    """
+    cell = scale / METERS_PER_DEGREE
+    row = math.floor(lat / cell)
+    col = math.floor(lon / cell)
+    key = f"{scale}m_{row}_{col}"
+    return key, (row + 0.5) * cell, (col + 0.5) * cell
+
+
+# =============================================================================
+# TANG DONG: CACHE TRONG BO NHO (LRU + TTL)
+# =============================================================================
+class TTLCache:
+    """Cache LRU trong bo nho, moi phan tu het han sau `ttl` giay.
+
+    Gioi han cung `maxsize` phan tu; khi day se loai phan tu it dung nhat
+    (O(1) voi OrderedDict). Phan tu het han o dau hang doi LRU duoc don dan
+    moi lan ghi. Thread-safe.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if self.timer() >= expires_at:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            now = self.timer()
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            # Don cac phan tu het han o dau LRU (chi phi khau hao O(1))
+            while self._data:
+                oldest_key, (expires_at, _) = next(iter(self._data.items()))
+                if expires_at > now:
+                    break
+                del self._data[oldest_key]
+                self.expirations += 1
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+# =============================================================================
+# GOP CAC TRUY VAN DONG THOI (SINGLE-FLIGHT)
+# =============================================================================
+class SingleFlight:
+    """Gop cac lan goi dong thoi cung khoa thanh 1 lan thuc thi.
+
+    Nguoi goi dau tien chay `fn`; cac nguoi goi cung khoa den trong luc do
+    cho tren cung 1 Future va nhan cung ket qua (hoac cung exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._inflight),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+            }
+
+
+# =============================================================================
+# TANG TINH: CACHE BEN VUNG TREN DIA (SQLITE)
+# =============================================================================
+class SQLiteStaticCache:
+    """Cache ben vung cho dac trung tinh (elevation, slope, ...), khoa theo o luoi.
+
+    Dac trung tinh khong thay doi nen khong co TTL; du lieu con nguyen sau khi
+    khoi dong lai. Gioi han `max_entries` dong, loai theo LRU (cot last_access).
+
+    Lan doc trung cache khong ghi xuong dia: thoi diem truy cap duoc gom trong bo
+    nho va ghi 1 lan (1 transaction) khi du `ACCESS_FLUSH_SIZE` khoa, sau
+    `ACCESS_FLUSH_INTERVAL` giay, truoc khi loai LRU va khi dong. Dong ma moi gia
+    tri deu la None (GEE khong co du lieu tai o do) khong duoc luu.
+    """
+
+    # Khi vuot gioi han, xoa them 1 phan de khong phai xoa sau moi lan ghi
+    EVICT_FRACTION = 0.1
+    # Gom cap nhat last_access: toi da bao nhieu khoa / bao nhieu giay truoc khi ghi
+    ACCESS_FLUSH_SIZE = 256
+    ACCESS_FLUSH_INTERVAL = 30.0
+
+    def __init__(self, db_path, max_entries=500000, timer=time.time):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pending_access = {}
+        self._last_flush = timer()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS static_features ("
+            " cell TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_static_last_access ON static_features(last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM static_features").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM static_features WHERE cell = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = self.timer()
+            self._pending_access[key] = now
+            if (len(self._pending_access) >= self.ACCESS_FLUSH_SIZE
+                    or now - self._last_flush >= self.ACCESS_FLUSH_INTERVAL):
+                self._flush_access()
+                self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def _flush_access(self):
+        """Ghi cac thoi diem truy cap dang gom (goi khi dang giu lock, chua commit)."""
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE static_features SET last_access = ? WHERE cell = ?",
+                [(t, key) for key, t in self._pending_access.items()]
+            )
+            self._pending_access.clear()
+        self._last_flush = self.timer()
+
+    def flush(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+
+    def put(self, key, value):
+        if isinstance(value, dict) and all(v is None for v in value.values()):
+            return
+        with self._lock:
+            self._pending_access.pop(key, None)
+            existed = self._conn.execute(
+                "SELECT 1 FROM static_features WHERE cell = ?", (key,)
+            ).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO static_features (cell, data, last_access) VALUES (?, ?, ?)",
+                (key, json.dumps(value), self.timer())
+            )
+            if not existed:
+                self._size += 1
+            if self._size > self.max_entries:
+                self._flush_access()
+                n_evict = self._size - self.max_entries + int(self.max_entries * self.EVICT_FRACTION)
+                cur = self._conn.execute(
+                    "DELETE FROM static_features WHERE cell IN ("
+                    " SELECT cell FROM static_features ORDER BY last_access ASC LIMIT ?)",
+                    (n_evict,)
+                )
+                self._size -= cur.rowcount
+                self.evictions += cur.rowcount
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM static_features")
+            self._conn.commit()
+            self._pending_access.clear()
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': self._size,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'path': self.db_path,
+            }
@@ -0,0 +1,197 @@
+import os
+import json
+import math
+import zlib
+import struct
+import hashlib
+import datetime
+
+import numpy as np
+
+from feature_provider import FEATURES_ORDER
+
+# =============================================================================
+# THAM SO O BAN DO (XYZ / WEB MERCATOR)
+# =============================================================================
+TILE_SIZE = 256
+MAX_ZOOM = 18
+# Dinh dang raster nguy co (xem src/predict_raster.py)
+NODATA = 255
+PROBABILITY_SCALE = 254
+
+
+def _risk_colormap():
+    """Bang mau 256 x RGBA: xanh (thap) -> vang -> do (cao); NODATA trong suot."""
+    p = np.arange(256) / PROBABILITY_SCALE
+    red = np.clip(2 * p, 0, 1)
+    green = np.clip(2 * (1 - p), 0, 1) * 0.8
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:, 0] = np.round(red * 255)
+    lut[:, 1] = np.round(green * 255)
+    lut[:, 2] = 40
+    lut[:, 3] = 170
+    lut[NODATA] = 0
+    return lut
+
+
+RISK_COLORMAP = _risk_colormap()
+
+
+def tile_pixel_centers(z, x, y, samples):
+    """Lat/lon (do) tam cua `samples` x `samples` diem lay mau trong o XYZ (z, x, y)."""
+    n = TILE_SIZE * (1 << z)
+    offsets = (np.arange(samples) + 0.5) * (TILE_SIZE / samples)
+    lons = (x * TILE_SIZE + offsets) / n * 360.0 - 180.0
+    merc = math.pi * (1 - 2 * (y * TILE_SIZE + offsets) / n)
+    lats = np.degrees(np.arctan(np.sinh(merc)))
+    return lats, lons
+
+
+def tile_bounds(z, x, y):
+    """(lon_min, lat_min, lon_max, lat_max) cua o XYZ."""
+    n = 1 << z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def encode_png(rgba):
+    """Ma hoa anh RGBA uint8 (H, W, 4) thanh PNG (chi dung zlib)."""
+    height, width, _ = rgba.shape
+    # Moi dong bat dau bang byte filter 0 (None)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+EMPTY_TILE_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+# =============================================================================
+# NGUON O: RASTER TINH SAN
+# =============================================================================
+class PrecomputedRiskTiles:
+    """Cat o tu raster nguy co do src/predict_raster.py tao (risk.npy + overviews).
+
+    Chon muc overview gan nhat voi do phan giai cua muc zoom, roi lay mau
+    nearest-neighbour 256 x 256 diem: chi phi moi o khong phu thuoc zoom.
+    """
+
+    samples = TILE_SIZE
+
+    def __init__(self, raster_dir):
+        self.raster_dir = raster_dir
+        meta_path = os.path.join(raster_dir, 'raster.json')
+        with open(meta_path, encoding='utf-8') as f:
+            self.meta = json.load(f)
+        # Phien ban = thoi diem ghi raster.json (doi khi tinh lai ban do)
+        self.version = f"raster-{os.stat(meta_path).st_mtime_ns}"
+        self.lon_min = self.meta['lon_min']
+        self.lat_max = self.meta['lat_max']
+        self.resolution = self.meta['resolution']
+        self.bounds = (
+            self.lon_min, self.lat_max - self.meta['height'] * self.resolution,
+            self.lon_min + self.meta['width'] * self.resolution, self.lat_max,
+        )
+        self.levels = [(1, np.load(os.path.join(raster_dir, 'risk.npy'), mmap_mode='r'))]
+        for level in self.meta.get('overviews', []):
+            self.levels.append(
+                (level['factor'], np.load(os.path.join(raster_dir, level['file']), mmap_mode='r'))
+            )
+
+    def values_at(self, lats, lons, degrees_per_sample):
+        """Gia tri uint8 (NODATA ngoai raster) tai luoi lats x lons."""
+        factor, raster = self.levels[0]
+        for level_factor, level_raster in self.levels:
+            if self.resolution * level_factor <= degrees_per_sample:
+                factor, raster = level_factor, level_raster
+        resolution = self.resolution * factor
+        rows = np.floor((self.lat_max - lats) / resolution).astype(np.int64)
+        cols = np.floor((lons - self.lon_min) / resolution).astype(np.int64)
+        row_ok = (rows >= 0) & (rows < raster.shape[0])
+        col_ok = (cols >= 0) & (cols < raster.shape[1])
+
+        out = np.full((len(lats), len(lons)), NODATA, dtype=np.uint8)
+        if row_ok.any() and col_ok.any():
+            out[np.ix_(row_ok, col_ok)] = raster[np.ix_(rows[row_ok], cols[col_ok])]
+        return out
+
+
+# =============================================================================
+# NGUON O: TINH TRUC TIEP TU LUOI DAC TRUNG LOCAL
+# =============================================================================
+class OnTheFlyRiskTiles:
+    """Tinh o truc tiep: dac trung tu LocalRasterFeatureProvider + model.
+
+    Lay mau `samples` x `samples` diem moi o (phong to len 256 khi ve) va chi
+    du doan 1 lan cho moi pixel luoi dac trung khac nhau trong o.
+    """
+
+    def __init__(self, provider, predict_proba, samples=64):
+        self.provider = provider
+        self.predict_proba = predict_proba
+        self.samples = samples
+        self.bounds = (
+            provider.lon_min, provider.lat_max - provider.height * provider.resolution,
+            provider.lon_min + provider.width * provider.resolution, provider.lat_max,
+        )
+
+    @property
+    def version(self):
+        # Cua so mua thay doi theo ngay
+        today = self.provider.reference_date or datetime.datetime.now(datetime.timezone.utc).date()
+        return f"live-{today.isoformat()}"
+
+    def values_at(self, lats, lons, degrees_per_sample):
+        grid_lats, grid_lons = np.meshgrid(lats, lons, indexing='ij')
+        rows, cols, valid = self.provider.pixel_index(grid_lats.ravel(), grid_lons.ravel())
+        out = np.full(valid.shape, NODATA, dtype=np.uint8)
+        if valid.any():
+            flat = rows[valid] * self.provider.width + cols[valid]
+            unique, inverse = np.unique(flat, return_inverse=True)
+            features = self.provider.features_at_pixels(
+                unique // self.provider.width, unique % self.provider.width
+            )
+            X = np.stack([features[name] for name in FEATURES_ORDER], axis=1)
+            known = np.isfinite(X[:, :5]).all(axis=1)
+            values = np.full(len(unique), NODATA, dtype=np.uint8)
+            if known.any():
+                probabilities = self.predict_proba(np.nan_to_num(X[known], nan=0.0))
+                values[known] = np.round(probabilities * PROBABILITY_SCALE).astype(np.uint8)
+            out[valid] = values[inverse]
+        return out.reshape(len(lats), len(lons))
+
+
+# =============================================================================
+# VE O
+# =============================================================================
+def render_tile(source, z, x, y):
+    """Ve o XYZ thanh PNG; tra ve EMPTY_TILE_PNG neu o nam ngoai vung du lieu."""
+    lon_min, lat_min, lon_max, lat_max = tile_bounds(z, x, y)
+    s_lon_min, s_lat_min, s_lon_max, s_lat_max = source.bounds
+    if lon_max <= s_lon_min or lon_min >= s_lon_max or lat_max <= s_lat_min or lat_min >= s_lat_max:
+        return EMPTY_TILE_PNG
+
+    lats, lons = tile_pixel_centers(z, x, y, source.samples)
+    degrees_per_sample = (lon_max - lon_min) / source.samples
+    values = source.values_at(lats, lons, degrees_per_sample)
+    if (values == NODATA).all():
+        return EMPTY_TILE_PNG
+
+    repeat = TILE_SIZE // source.samples
+    if repeat > 1:
+        values = np.repeat(np.repeat(values, repeat, axis=0), repeat, axis=1)
+    return encode_png(RISK_COLORMAP[values])
+
+
+def tile_etag(png):
+    return '"' + hashlib.md5(png).hexdigest() + '"'
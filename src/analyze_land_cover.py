@@ -5,33 +5,35 @@ import seaborn as sns
 import folium
 from folium import plugins
 from pathlib import Path
-import glob
-from utils import add_landcover_labels, summarize_landcover
-
-def load_data(data_path="../data/raw_exports"):
-    """Load và gộp tất cả file CSV từ thư mục raw_exports"""
-    data_path = Path(data_path)
-    all_files = glob.glob(str(data_path / "*.csv"))
-    
-    dfs = []
-    for file in all_files:
-        df = pd.read_csv(file)
-        # Trích xuất tọa độ từ cột .geo
-        try:
-            df['coordinates'] = df['.geo'].apply(lambda x: eval(x)['coordinates'])
-            df['longitude'] = df['coordinates'].apply(lambda x: x[0])
-            df['latitude'] = df['coordinates'].apply(lambda x: x[1])
-        except:
-            print(f"Lỗi khi xử lý file {file}")
-            continue
-        dfs.append(df)
-    
-    df_combined = pd.concat(dfs, ignore_index=True)
-    return df_combined
-
-def plot_landcover_distribution(df):
+from utils import add_landcover_labels, summarize_landcover, load_summaries
+from dataset import DATASET_DIR, load_dataset
+
+# Cac cot can cho bieu do va ban do (longitude/latitude da tach san tu .geo)
+ANALYSIS_COLUMNS = [
+    'longitude', 'latitude', 'land_cover', 'flood',
+    'elevation', 'slope', 'event_id', 'purpose'
+]
+
+# Cac cach nhom cho bang tong ket (tinh chung 1 lan, cache theo phien ban du lieu)
+SUMMARY_GROUPINGS = [
+    ['land_cover'],
+    ['purpose', 'event_id'],
+    ['land_cover', 'purpose'],
+    ['soil_type'],
+]
+
+def load_data(dataset_dir=DATASET_DIR, columns=ANALYSIS_COLUMNS):
+    """Load bộ dữ liệu đã xử lý (Parquet) do combine_data.py tạo"""
+    try:
+        return load_dataset(columns=columns, dataset_dir=dataset_dir)
+    except FileNotFoundError:
+        print(f"Không tìm thấy dữ liệu tại {dataset_dir}. Vui lòng chạy 'combine_data.py' trước.")
+        raise
+
+def plot_landcover_distribution(df, summary=None):
     """Vẽ biểu đồ phân bố các loại lớp phủ"""
-    summary = summarize_landcover(df)
+    if summary is None:
+        summary = summarize_landcover(df)
     
     plt.figure(figsize=(15, 6))
     sns.barplot(data=summary.reset_index(), 
@@ -47,9 +49,10 @@ def plot_landcover_distribution(df):
     
     return summary
 
-def plot_flood_ratio(df):
+def plot_flood_ratio(df, summary=None):
     """Vẽ biểu đồ tỷ lệ ngập theo loại lớp phủ"""
-    summary = summarize_landcover(df)
+    if summary is None:
+        summary = summarize_landcover(df)
     
     plt.figure(figsize=(15, 6))
     sns.barplot(data=summary.reset_index(), 
@@ -65,31 +68,9 @@ def plot_flood_ratio(df):
     
     return summary
 
-def create_interactive_map(df, sample_size=1000):
-    """Tạo bản đồ tương tác với folium"""
-    # Tạo bản đồ centered ở Việt Nam với basemap đẹp hơn
-    m = folium.Map(
-        location=[16.0, 106.0],
-        zoom_start=5,
-        tiles='CartoDB positron'
-    )
-    
-    # Thêm các basemap layers khác
-    folium.TileLayer('CartoDB dark_matter').add_to(m)
-    folium.TileLayer('OpenStreetMap').add_to(m)
-    folium.TileLayer(
-        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-        attr='Esri',
-        name='Esri Satellite'
-    ).add_to(m)
-    
-    # Color map cho các loại lớp phủ
-    unique_landcover = sorted(df['land_cover'].unique())
-    colors = plt.cm.Set3(np.linspace(0, 1, len(unique_landcover)))
-    color_map = dict(zip(unique_landcover, 
-                        [f'#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}' 
-                         for r, g, b, _ in colors]))
-    
+def add_marker_layers(m, df, color_map, sample_size):
+    """Mỗi điểm mẫu là 1 CircleMarker với popup HTML dựng sẵn (chỉ hợp với vài nghìn điểm)"""
+    unique_landcover = sorted(color_map)
     # Tạo feature groups cho từng loại lớp phủ và ngập/không ngập
     layer_groups = {}
     for lc in unique_landcover:
@@ -149,6 +130,109 @@ def create_interactive_map(df, sample_size=1000):
     # Thêm các layer groups vào map
     for group in layer_groups.values():
         group.add_to(m)
+
+
+# Làm tròn tọa độ 3 chữ số (~110 m, cỡ lưới lấy mẫu 90 m): các điểm trùng ô
+# được gộp (kèm số lượng) -> kích thước file tăng chậm hơn số điểm
+MAP_COORD_DECIMALS = 3
+
+# Hàm JS tạo marker cho từng dòng [lat, lon, số điểm, độ cao TB, độ dốc TB];
+# popup chỉ được dựng khi người dùng click
+CLUSTER_MARKER_CALLBACK = """
+function (row) {
+    // Ô không có độ cao/độ dốc (null / NaN) -> 'N/A' thay vì lỗi toFixed
+    var fmt = function (value, unit) {
+        return (value == null || isNaN(value)) ? 'N/A' : value.toFixed(1) + unit;
+    };
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: %(radius)d, color: '%(stroke)s', weight: %(weight)d,
+        fill: true, fillColor: '%(fill)s', fillOpacity: %(opacity)s
+    });
+    marker.bindPopup(function () {
+        return '<div style="font-family: Arial; padding: 10px;">'
+            + '<h4 style="margin: 0 0 10px 0; color: %(title_color)s;">%(title)s</h4>'
+            + '<table style="width: 100%%;">'
+            + '<tr><td><b>Trạng thái:</b></td><td style="color: %(title_color)s;">%(status)s</td></tr>'
+            + '<tr><td><b>Số điểm:</b></td><td>' + row[2] + '</td></tr>'
+            + '<tr><td><b>Độ cao:</b></td><td>' + fmt(row[3], 'm') + '</td></tr>'
+            + '<tr><td><b>Độ dốc:</b></td><td>' + fmt(row[4], '°') + '</td></tr>'
+            + '</table></div>';
+    }, {maxWidth: 300});
+    return marker;
+}
+"""
+
+def add_clustered_layers(m, df, color_map):
+    """Mỗi nhóm (lớp phủ x ngập) là 1 FastMarkerCluster với dữ liệu dạng mảng gọn"""
+    names = df.groupby('land_cover', observed=True)['land_cover_name'].first()
+    cells = df.assign(
+        lat=df['latitude'].round(MAP_COORD_DECIMALS),
+        lon=df['longitude'].round(MAP_COORD_DECIMALS),
+    ).groupby(['land_cover', 'flood', 'lat', 'lon'], observed=True).agg(
+        n=('flood', 'size'), elevation=('elevation', 'mean'), slope=('slope', 'mean')
+    ).reset_index()
+    cells['elevation'] = cells['elevation'].round(1)
+    cells['slope'] = cells['slope'].round(1)
+
+    for (lc, flood), group in cells.groupby(['land_cover', 'flood'], observed=True):
+        is_flood = flood == 1
+        # Mã lớp phủ không có trong bảng tên -> hiện mã số
+        name = names.get(lc)
+        if pd.isna(name):
+            name = f"Mã {int(lc)}"
+        callback = CLUSTER_MARKER_CALLBACK % {
+            'radius': 6 if is_flood else 4,
+            'stroke': 'red' if is_flood else 'green',
+            'weight': 2 if is_flood else 1,
+            'fill': color_map[lc],
+            'opacity': 0.8 if is_flood else 0.6,
+            'title_color': '#d73027' if is_flood else '#1a9850',
+            'title': name,
+            'status': '⚠️ Ngập' if is_flood else '✓ Không ngập',
+        }
+        plugins.FastMarkerCluster(
+            data=group[['lat', 'lon', 'n', 'elevation', 'slope']].values.tolist(),
+            callback=callback,
+            name=f"{name} ({'Ngập' if is_flood else 'Không ngập'})",
+        ).add_to(m)
+
+def create_interactive_map(df, sample_size=1000, mode='cluster'):
+    """Tạo bản đồ tương tác với folium
+
+    mode='cluster': toàn bộ dữ liệu, mỗi nhóm (lớp phủ x ngập) là 1 lớp dữ liệu
+        gọn + gom cụm phía trình duyệt, popup tạo khi click.
+    mode='markers': cách cũ, lấy mẫu `sample_size` điểm, mỗi điểm 1 marker HTML.
+    """
+    # Tạo bản đồ centered ở Việt Nam với basemap đẹp hơn
+    m = folium.Map(
+        location=[16.0, 106.0],
+        zoom_start=5,
+        tiles='CartoDB positron'
+    )
+    
+    # Thêm các basemap layers khác
+    folium.TileLayer('CartoDB dark_matter').add_to(m)
+    folium.TileLayer('OpenStreetMap').add_to(m)
+    folium.TileLayer(
+        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+        attr='Esri',
+        name='Esri Satellite'
+    ).add_to(m)
+    
+    # Điểm không có tọa độ (.geo thiếu/lỗi) không vẽ được trên bản đồ
+    df = df.dropna(subset=['latitude', 'longitude'])
+
+    # Color map cho các loại lớp phủ
+    unique_landcover = sorted(df['land_cover'].unique())
+    colors = plt.cm.Set3(np.linspace(0, 1, len(unique_landcover)))
+    color_map = dict(zip(unique_landcover, 
+                        [f'#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}' 
+                         for r, g, b, _ in colors]))
+    
+    if mode == 'cluster':
+        add_clustered_layers(m, df, color_map)
+    else:
+        add_marker_layers(m, df, color_map, sample_size)
     
     # Thêm layer control với giao diện cải thiện
     folium.LayerControl(collapsed=False, position='topright').add_to(m)
@@ -193,17 +277,23 @@ def main():
     # Thêm labels
     df = add_landcover_labels(df)
     
+    # Tất cả bảng tổng kết trong 1 lần nhóm (dùng lại cache nếu dữ liệu không đổi)
+    summaries = load_summaries(SUMMARY_GROUPINGS)
+    summary = summarize_landcover(df, summaries[('land_cover',)])
+    
     # Vẽ biểu đồ phân bố
     print("\nĐang tạo biểu đồ phân bố...")
-    summary = plot_landcover_distribution(df)
+    plot_landcover_distribution(df, summary)
     
     # Vẽ biểu đồ tỷ lệ ngập
     print("\nĐang tạo biểu đồ tỷ lệ ngập...")
-    summary = plot_flood_ratio(df)
+    plot_flood_ratio(df, summary)
     
     # In bảng tổng kết
     print("\nBảng tổng kết chi tiết:")
     print(summary.round(2).to_string())
+    print("\nTỷ lệ ngập theo tập dữ liệu và sự kiện:")
+    print(summaries[('purpose', 'event_id')].to_string())
     
     # Tạo bản đồ tương tác
     print("\nĐang tạo bản đồ tương tác...")
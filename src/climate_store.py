@@ -0,0 +1,345 @@
+"""Kho chuoi thoi gian mua (IMERG) va do am dat (SMAP) cuc bo.
+
+Cube ngay x lat x lon tren dia, chia theo khoi `chunk_days` ngay, moi khoi
+1 file .npy (memory-mapped). Moi khoi luu TONG TICH LUY theo thoi gian tinh
+tu dau khoi, nen tong 1 cua so bat ky tai 1 diem chi can 2 lan doc:
+
+    S(t) = base[khoi] + local_khoi[t - dau khoi]   (S(t) = tong cac ngay < t)
+    tong [a, b) = S(b) - S(a)
+
+`base` (tong cua cac khoi truoc) tinh 1 lan khi mo cube. Cube chi noi them
+ngay moi o cuoi va xoa ca khoi cu o dau (rolling), nen doc va ghi dong thoi
+an toan: nguoi doc chi thay so ngay da ghi trong cube.json.
+
+Chuoi luu tru:
+    precipitation        tong mua ngay (mm)
+    soil_moisture        do am dat SMAP (ngay khong co du lieu = 0)
+    soil_moisture_count  1 neu ngay co du lieu SMAP tai pixel, nguoc lai 0
+"""
+import os
+import json
+import argparse
+import datetime
+
+import numpy as np
+
+from rainfall import ANTECEDENT_WINDOWS, MAX_ANTECEDENT_DAYS, daily_precipitation
+
+# =============================================================================
+# KHO CHUOI THOI GIAN MUA (IMERG) VA DO AM DAT (SMAP) CUC BO
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIMATE_CUBE_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'climate_cube'))
+
+CUBE_FORMAT_VERSION = 1
+SERIES = ['precipitation', 'soil_moisture', 'soil_moisture_count']
+DEFAULT_CHUNK_DAYS = 32
+
+# Luoi mac dinh: Viet Nam, 0.1 do (do phan giai goc cua IMERG)
+VIETNAM_BBOX = (102.0, 8.0, 110.0, 23.5)
+DEFAULT_RESOLUTION = 0.1
+# Giu it nhat cua so dai nhat + do tre cua du lieu dong
+DEFAULT_RETAIN_DAYS = 60
+
+# Cua so do am dat (giong nguon GEE: trung binh 3 ngay truoc moc thoi gian)
+SOIL_MOISTURE_WINDOW_DAYS = 3
+
+
+class ClimateCube:
+    """Doc / ghi cube mua + do am dat (xem mo ta o dau module)."""
+
+    def __init__(self, cube_dir):
+        self.cube_dir = cube_dir
+        self.meta_path = os.path.join(cube_dir, 'cube.json')
+        with open(self.meta_path, encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != CUBE_FORMAT_VERSION:
+            raise ValueError(f"Phien ban cube khong ho tro: {self.meta.get('format_version')}")
+        self.lon_min = self.meta['lon_min']
+        self.lat_max = self.meta['lat_max']
+        self.resolution = self.meta['resolution']
+        self.width = self.meta['width']
+        self.height = self.meta['height']
+        self.chunk_days = self.meta['chunk_days']
+        self.start_date = datetime.date.fromisoformat(self.meta['start_date'])
+        self.n_days = self.meta['n_days']
+        self._chunks = {}
+        self._bases = None
+
+    # -------------------------------------------------------------------------
+    # Tao cube / file
+    # -------------------------------------------------------------------------
+    @classmethod
+    def create(cls, cube_dir, start_date, bbox=VIETNAM_BBOX, resolution=DEFAULT_RESOLUTION,
+               chunk_days=DEFAULT_CHUNK_DAYS):
+        """Tao cube rong; ngay dau tien duoc ghi phai la `start_date`."""
+        lon_min, lat_min, lon_max, lat_max = bbox
+        os.makedirs(cube_dir, exist_ok=True)
+        meta = {
+            'format_version': CUBE_FORMAT_VERSION,
+            'lon_min': lon_min,
+            'lat_max': lat_max,
+            'resolution': resolution,
+            'width': int(round((lon_max - lon_min) / resolution)),
+            'height': int(round((lat_max - lat_min) / resolution)),
+            'chunk_days': chunk_days,
+            'start_date': start_date.isoformat(),
+            'n_days': 0,
+        }
+        _write_json(os.path.join(cube_dir, 'cube.json'), meta)
+        return cls(cube_dir)
+
+    @property
+    def end_date(self):
+        """Ngay dau tien CHUA co trong cube (cac ngay < end_date da co)."""
+        return self.start_date + datetime.timedelta(days=self.n_days)
+
+    def _chunk_path(self, series, chunk):
+        chunk_start = self.start_date + datetime.timedelta(days=chunk * self.chunk_days)
+        return os.path.join(self.cube_dir, f"{series}_{chunk_start.isoformat()}.npy")
+
+    def _chunk(self, series, chunk, mode='r'):
+        key = (series, chunk, mode)
+        if key not in self._chunks:
+            path = self._chunk_path(series, chunk)
+            if mode == 'r+' and not os.path.exists(path):
+                np.lib.format.open_memmap(
+                    path, mode='w+', dtype=np.float64,
+                    shape=(self.chunk_days, self.height, self.width)
+                ).flush()
+            self._chunks[key] = np.load(path, mmap_mode=mode)
+        return self._chunks[key]
+
+    def _save_meta(self):
+        self.meta['start_date'] = self.start_date.isoformat()
+        self.meta['n_days'] = self.n_days
+        _write_json(self.meta_path, self.meta)
+
+    # -------------------------------------------------------------------------
+    # Ghi
+    # -------------------------------------------------------------------------
+    def append_day(self, date, precipitation, soil_moisture):
+        """Noi them 1 ngay (phai la ngay ke tiep end_date).
+
+        Args:
+            precipitation: mang (height, width) tong mua ngay (mm).
+            soil_moisture: mang (height, width), NaN = khong co du lieu SMAP.
+        """
+        if date != self.end_date:
+            raise ValueError(f"Ngay tiep theo phai la {self.end_date}, nhan {date}")
+        soil_moisture = np.asarray(soil_moisture, dtype=np.float64)
+        has_sm = ~np.isnan(soil_moisture)
+        values = {
+            'precipitation': np.nan_to_num(np.asarray(precipitation, dtype=np.float64), nan=0.0),
+            'soil_moisture': np.where(has_sm, soil_moisture, 0.0),
+            'soil_moisture_count': has_sm.astype(np.float64),
+        }
+        chunk, offset = divmod(self.n_days, self.chunk_days)
+        for series, daily in values.items():
+            if daily.shape != (self.height, self.width):
+                raise ValueError(f"{series}: kich thuoc {daily.shape} khac luoi "
+                                 f"{(self.height, self.width)}")
+            local = self._chunk(series, chunk, mode='r+')
+            local[offset] = daily if offset == 0 else local[offset - 1] + daily
+            local.flush()
+        self.n_days += 1
+        self._bases = None
+        # Ghi meta sau cung: nguoi doc chi thay ngay moi khi du lieu da nam tren dia
+        self._save_meta()
+
+    def trim(self, retain_days):
+        """Xoa cac khoi cu nhat ma van giu it nhat `retain_days` ngay gan nhat."""
+        removed = 0
+        while self.n_days - self.chunk_days >= retain_days:
+            old_paths = [self._chunk_path(series, 0) for series in SERIES]
+            self.start_date += datetime.timedelta(days=self.chunk_days)
+            self.n_days -= self.chunk_days
+            removed += 1
+            self._chunks.clear()
+            self._bases = None
+            self._save_meta()
+            for path in old_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        return removed
+
+    # -------------------------------------------------------------------------
+    # Doc
+    # -------------------------------------------------------------------------
+    def pixel_index(self, lats, lons):
+        """Chuyen lat/lon thanh (row, col, valid) cho luoi cube."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rows = np.floor((self.lat_max - lats) / self.resolution).astype(np.int64)
+        cols = np.floor((lons - self.lon_min) / self.resolution).astype(np.int64)
+        valid = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        return np.where(valid, rows, 0), np.where(valid, cols, 0), valid
+
+    def _base(self, series, chunk):
+        """Tong cua cac khoi truoc `chunk` (luoi 2D), tinh 1 lan cho moi lan mo."""
+        if self._bases is None:
+            self._bases = {}
+        if series not in self._bases:
+            bases = [np.zeros((self.height, self.width))]
+            for c in range(1, -(-self.n_days // self.chunk_days)):
+                bases.append(bases[-1] + self._chunk(series, c - 1)[self.chunk_days - 1])
+            self._bases[series] = bases
+        return self._bases[series][chunk]
+
+    def _prefix(self, series, t, rows, cols):
+        """S(t) = tong cac ngay co chi so < t tai cac pixel (rows, cols)."""
+        if t <= 0:
+            return np.zeros(len(rows))
+        chunk, offset = divmod(t - 1, self.chunk_days)
+        return (self._base(series, chunk)[rows, cols]
+                + self._chunk(series, chunk)[offset][rows, cols])
+
+    def covers(self, first_date, end_date):
+        """True neu cube co du cac ngay trong [first_date, end_date)."""
+        return self.start_date <= first_date and end_date <= self.end_date
+
+    def window_sum(self, series, rows, cols, first_date, end_date):
+        """Tong `series` cua cac ngay [first_date, end_date) tai cac pixel (O(1) moi diem)."""
+        if not self.covers(first_date, end_date):
+            raise KeyError(f"Cube [{self.start_date}, {self.end_date}) khong bao "
+                           f"[{first_date}, {end_date})")
+        a = (first_date - self.start_date).days
+        b = (end_date - self.start_date).days
+        return self._prefix(series, b, rows, cols) - self._prefix(series, a, rows, cols)
+
+    def dynamic_features(self, rows, cols, end_date):
+        """Dac trung dong (cung dinh nghia voi nguon GEE) cho cua so ket thuc tai end_date."""
+        out = {}
+        for name, days in ANTECEDENT_WINDOWS.items():
+            first = end_date - datetime.timedelta(days=days)
+            out[name] = self.window_sum('precipitation', rows, cols, first, end_date)
+
+        first = end_date - datetime.timedelta(days=SOIL_MOISTURE_WINDOW_DAYS)
+        sm_sum = self.window_sum('soil_moisture', rows, cols, first, end_date)
+        sm_count = self.window_sum('soil_moisture_count', rows, cols, first, end_date)
+        # Khong co ngay SMAP nao trong cua so -> 0 (giong ee.Algorithms.If cua GEE)
+        out['soil_moisture'] = np.where(sm_count > 0.5, sm_sum / np.maximum(sm_count, 1.0), 0.0)
+
+        # Khong co du bao mua (giong nguon GEE)
+        out['precip_total'] = np.zeros(len(rows))
+        return out
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# =============================================================================
+# NAP DU LIEU HANG NGAY
+# =============================================================================
+class EarthEngineDailySource:
+    """Lay 1 ngay IMERG (tong ngay) + SMAP (soil_moisture_am) tren luoi cube qua computePixels."""
+
+    # Gia tri thay cho pixel bi mask (SMAP khong phu) truoc khi tai ve
+    NODATA = -9999.0
+
+    def __init__(self, cube):
+        self.grid = {
+            'dimensions': {'width': cube.width, 'height': cube.height},
+            'affineTransform': {
+                'scaleX': cube.resolution, 'shearX': 0, 'translateX': cube.lon_min,
+                'shearY': 0, 'scaleY': -cube.resolution, 'translateY': cube.lat_max,
+            },
+            'crsCode': 'EPSG:4326',
+        }
+
+    def __call__(self, date):
+        """Tra ve (precipitation, soil_moisture) hoac None neu IMERG chua co ngay nay."""
+        import ee
+        day = ee.Date(date.isoformat())
+        next_day = day.advance(1, 'day')
+        imerg = ee.ImageCollection("NASA/GPM_L3/IMERG_V07").filterDate(day, next_day)
+        smap = ee.ImageCollection("NASA/SMAP/SPL3SMP_E/005") \
+                 .filterDate(day, next_day).select('soil_moisture_am')
+
+        n_imerg, n_smap = ee.List([imerg.size(), smap.size()]).getInfo()
+        if n_imerg == 0:
+            return None
+
+        precipitation = ee.Image(daily_precipitation(day, 1).get(0)).rename('precipitation')
+        soil_moisture = smap.mean().unmask(self.NODATA) if n_smap else ee.Image.constant(self.NODATA)
+        image = precipitation.addBands(soil_moisture.rename('soil_moisture')).float()
+        pixels = ee.data.computePixels({
+            'expression': image,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': self.grid,
+        })
+        sm = pixels['soil_moisture'].astype(np.float64)
+        sm[sm == self.NODATA] = np.nan
+        return pixels['precipitation'].astype(np.float64), sm
+
+
+def ingest(cube, fetch_day, until_date, retain_days=DEFAULT_RETAIN_DAYS):
+    """Noi cac ngay tu cube.end_date den truoc until_date, roi xoa khoi cu.
+
+    Dung o ngay dau tien `fetch_day` tra ve None (du lieu chua co) - lan chay
+    sau se tiep tuc tu ngay do.
+
+    Returns:
+        int: so ngay da noi.
+    """
+    added = 0
+    while cube.end_date < until_date:
+        date = cube.end_date
+        daily = fetch_day(date)
+        if daily is None:
+            print(f"Chua co du lieu ngay {date}, dung lai.")
+            break
+        cube.append_day(date, *daily)
+        added += 1
+        print(f"Da nap ngay {date}")
+    removed = cube.trim(retain_days)
+    if removed:
+        print(f"Da xoa {removed} khoi cu, cube bat dau tu {cube.start_date}")
+    return added
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cap nhat cube mua IMERG / do am SMAP cuc bo.")
+    parser.add_argument('--cube-dir', default=CLIMATE_CUBE_DIR)
+    parser.add_argument('--retain-days', type=int, default=DEFAULT_RETAIN_DAYS,
+                        help="So ngay gan nhat can giu")
+    parser.add_argument('--until', type=datetime.date.fromisoformat,
+                        help="Nap den truoc ngay nay (mac dinh: hom nay UTC)")
+    parser.add_argument('--bbox', type=float, nargs=4, default=VIETNAM_BBOX,
+                        metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'),
+                        help="Vung cua cube (chi dung khi tao moi)")
+    parser.add_argument('--resolution', type=float, default=DEFAULT_RESOLUTION,
+                        help="Do phan giai (do, chi dung khi tao moi)")
+    return parser.parse_args()
+
+
+def main():
+    import ee
+    args = parse_args()
+    until = args.until or datetime.datetime.now(datetime.timezone.utc).date()
+    if args.retain_days < MAX_ANTECEDENT_DAYS + SOIL_MOISTURE_WINDOW_DAYS:
+        raise SystemExit(f"--retain-days phai >= {MAX_ANTECEDENT_DAYS + SOIL_MOISTURE_WINDOW_DAYS}")
+
+    try:
+        ee.Initialize(opt_url='https://earthengine-highvolume.googleapis.com')
+    except ee.ee_exception.EEException:
+        raise SystemExit("Vui long xac thuc GEE (ee.Authenticate()) truoc khi chay.")
+
+    if os.path.exists(os.path.join(args.cube_dir, 'cube.json')):
+        cube = ClimateCube(args.cube_dir)
+    else:
+        start = until - datetime.timedelta(days=args.retain_days)
+        print(f"Tao cube moi tai {args.cube_dir}, bat dau tu {start}")
+        cube = ClimateCube.create(args.cube_dir, start, bbox=tuple(args.bbox),
+                                  resolution=args.resolution)
+
+    added = ingest(cube, EarthEngineDailySource(cube), until, retain_days=args.retain_days)
+    print(f"HOAN TAT! Da nap {added} ngay. Cube: [{cube.start_date}, {cube.end_date}) tai {args.cube_dir}")
+
+
+if __name__ == "__main__":
+    main()
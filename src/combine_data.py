@@ -1,78 +1,263 @@
 import pandas as pd
 import os
+import sys
 import glob
+import json
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 # import joblib -> ĐÃ XÓA (Khong chuan hoa o day)
 # from sklearn.preprocessing import StandardScaler -> ĐÃ XÓA
 
-# Dinh nghia cac duong dan
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-RAW_DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'raw_exports'))
-PROCESSED_DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'processed'))
-# MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models')) # XOA
+from dataset import (
+    RAW_DATA_DIR, PROCESSED_DATA_DIR, DATASET_DIR, PARTITION_COLUMNS,
+    READ_DTYPES, DROP_COLUMNS, COORD_COLUMNS, SCHEMA_VERSION, MANIFEST_PATH,
+    apply_schema, parse_geo_points
+)
 
 # Tao thu muc neu chua ton tai
 os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
 # os.makedirs(MODEL_DIR, exist_ok=True) # XOA
 
-def main():
-    print(f"Bat dau qua trinh tong hop du lieu tu: {RAW_DATA_DIR}")
-    
-    csv_files = glob.glob(os.path.join(RAW_DATA_DIR, '*.csv'))
-    
-    if not csv_files:
-        print(f"Loi: Khong tim thay file CSV nao trong {RAW_DATA_DIR}.")
-        print("Vui long kiem tra lai: Ban da tai cac file CSV tu GEE ve dung thu muc chua?")
-        return
-
-    print(f"Tim thay {len(csv_files)} file CSV. Dang doc...")
-    
-    all_dataframes = []
-    for f in csv_files:
-        try:
-            df = pd.read_csv(f)
-            if df.empty:
-                print(f"Canh bao: File {os.path.basename(f)} bi rong (empty). Bo qua.")
+# So tien trinh doc CSV song song
+MAX_WORKERS = os.cpu_count()
+
+# Manifest (MANIFEST_PATH): moi file tho da xu ly (kich thuoc, mtime, sha256, so dong,
+# schema, phan vung da ghi) -> lan chay sau chi doc file moi / thay doi
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    """Doc manifest; manifest khong hop le hoac khac SCHEMA_VERSION -> coi nhu rong."""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('schema_version') != SCHEMA_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def remove_partitions(entry, dataset_dir=DATASET_DIR):
+    """Xoa cac file Parquet do 1 file tho da ghi (va thu muc phan vung neu rong)."""
+    stem = os.path.splitext(entry['file'])[0]
+    for part in entry.get('partitions', []):
+        part_dir = os.path.join(dataset_dir, part)
+        part_file = os.path.join(part_dir, f"{stem}.parquet")
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        # Xoa thu muc event_id / purpose neu da rong
+        for directory in (part_dir, os.path.dirname(part_dir)):
+            if os.path.isdir(directory) and not os.listdir(directory):
+                os.rmdir(directory)
+
+
+def plan_changes(csv_files, manifest):
+    """So sanh file tho voi manifest.
+
+    Kich thuoc + mtime giong -> bo qua khong can doc. Khac -> so sha256 (re hon
+    nhieu so voi parse CSV); noi dung giong thi chi cap nhat mtime.
+
+    Returns:
+        (to_process, unchanged, removed): danh sach duong dan, dict ten -> entry,
+        danh sach entry cua file da bi xoa.
+    """
+    known = dict(manifest['files']) if manifest else {}
+    to_process = []
+    unchanged = {}
+    for path in csv_files:
+        name = os.path.basename(path)
+        entry = known.pop(name, None)
+        stat = os.stat(path)
+        if entry is not None:
+            if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                unchanged[name] = entry
+                continue
+            if entry['size'] == stat.st_size and entry['sha256'] == file_sha256(path):
+                unchanged[name] = {**entry, 'mtime_ns': stat.st_mtime_ns}
                 continue
-            all_dataframes.append(df)
-        except pd.errors.EmptyDataError:
-            print(f"Loi khi doc file {os.path.basename(f)}: File rong (No columns to parse from file)")
-        except Exception as e:
-            print(f"Loi khi doc file {os.path.basename(f)}: {e}")
+        to_process.append(path)
+    return to_process, unchanged, list(known.values())
 
-    if not all_dataframes:
-        print("Loi: Khong co du lieu hop le de tong hop. Dung chuong trinh.")
-        return
 
-    final_df = pd.concat(all_dataframes, ignore_index=True)
-    print(f"Tong hop thanh cong. Tong so diem mau truoc khi don dep: {len(final_df)}")
+def read_raw_file(path):
+    """Doc 1 file tho: CSV tu Drive hoac CSV / Parquet tu prepare_data.py --direct."""
+    if path.endswith('.parquet'):
+        if os.path.getsize(path) == 0:
+            raise pd.errors.EmptyDataError("No columns to parse from file")
+        df = pd.read_parquet(path, engine='pyarrow')
+        dtypes = {col: dtype for col, dtype in READ_DTYPES.items() if col in df.columns}
+        return df.astype(dtypes)
+    return pd.read_csv(path, dtype=READ_DTYPES)
+
+
+def process_file(csv_path, dataset_dir=DATASET_DIR):
+    """Doc 1 file tho (CSV / Parquet), don dep, ep kieu va ghi vao phan vung cua no.
+
+    Chay trong tien trinh con: moi file doc lap nen chi phi tang tuyen tinh
+    theo so su kien va chia deu cho cac CPU.
+
+    Returns:
+        dict: ten file, so dong truoc/sau don dep, phan bo nhan, cac phan vung da ghi.
+    """
+    name = os.path.basename(csv_path)
+    try:
+        df = read_raw_file(csv_path)
+    except pd.errors.EmptyDataError:
+        return {'file': name, 'error': "File rong (No columns to parse from file)"}
+    except Exception as e:
+        return {'file': name, 'error': str(e)}
+
+    if df.empty:
+        return {'file': name, 'error': "File bi rong (empty). Bo qua."}
 
+    stat = os.stat(csv_path)
+    rows_raw = len(df)
     # Buoc 1: Don dep du lieu
-    # Loai bo cac cot khong can thiet
+    # Giu lai toa do tu .geo truoc khi bo cot
+    if '.geo' in df.columns:
+        df[COORD_COLUMNS] = parse_geo_points(df['.geo'])
     # .geo va system:index la metadata cua GEE
-    cols_to_drop = [col for col in final_df.columns if col.startswith('.geo') or col == 'system:index']
-    final_df = final_df.drop(columns=cols_to_drop)
-    
+    df = df.drop(columns=[col for col in DROP_COLUMNS if col in df.columns])
     # Kiem tra va loai bo NaN (rat quan trong)
     # NaN co the xay ra do SMAP (soil moisture) bi loi
-    final_df = final_df.dropna()
-    print(f"Tong so diem mau sau khi don dep (loai bo NaN): {len(final_df)}")
+    # Toa do thieu (.geo rong / loi) khong lam mat dong: chi xet NaN o cac cot con lai
+    df = apply_schema(df.dropna(subset=[col for col in df.columns if col not in COORD_COLUMNS]))
 
-    # Buoc 2: Hien thi phan bo du lieu
-    if 'flood' in final_df.columns:
+    # Buoc 2: Ghi theo phan vung purpose/event_id (1 file nguon -> 1 file moi phan vung)
+    partitions = []
+    stem = os.path.splitext(name)[0]
+    for (purpose, event_id), part in df.groupby(PARTITION_COLUMNS, observed=True):
+        part_dir = os.path.join(dataset_dir, f"purpose={purpose}", f"event_id={event_id}")
+        os.makedirs(part_dir, exist_ok=True)
+        part.drop(columns=PARTITION_COLUMNS).to_parquet(
+            os.path.join(part_dir, f"{stem}.parquet"), engine='pyarrow', index=False
+        )
+        partitions.append(os.path.relpath(part_dir, dataset_dir))
+
+    flood_counts = df['flood'].value_counts().to_dict() if 'flood' in df.columns else {}
+    return {
+        'file': name,
+        'path': os.path.abspath(csv_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(csv_path),
+        'rows_raw': rows_raw,
+        'rows': len(df),
+        'schema': {col: str(dtype) for col, dtype in df.dtypes.items()},
+        'flood_counts': {str(label): int(count) for label, count in flood_counts.items()},
+        'partitions': partitions,
+    }
+
+
+def main():
+    # --full: bo qua manifest, tao lai toan bo bo du lieu
+    full_rebuild = '--full' in sys.argv[1:]
+    print(f"Bat dau qua trinh tong hop du lieu tu: {RAW_DATA_DIR}")
+
+    csv_files = sorted(
+        glob.glob(os.path.join(RAW_DATA_DIR, '*.csv'))
+        + glob.glob(os.path.join(RAW_DATA_DIR, '*.parquet'))
+    )
+
+    if not csv_files:
+        print(f"Loi: Khong tim thay file CSV / Parquet nao trong {RAW_DATA_DIR}.")
+        print("Vui long kiem tra lai: Ban da tai cac file CSV tu GEE ve dung thu muc chua?")
+        sys.exit(1)
+
+    # Ten phan vung lay tu ten file (bo duoi) -> khong the co ca X.csv va X.parquet
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in csv_files]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if duplicates:
+        print(f"Loi: Co ca file CSV va Parquet cho: {', '.join(duplicates)}. Hay xoa 1 trong 2.")
+        sys.exit(1)
+
+    manifest = None if full_rebuild else load_manifest()
+    if manifest is None or not os.path.isdir(DATASET_DIR):
+        # Khong co manifest hop le -> tao lai bo du lieu tu dau
+        manifest = None
+        if os.path.isdir(DATASET_DIR):
+            shutil.rmtree(DATASET_DIR)
+        os.makedirs(DATASET_DIR)
+
+    to_process, files, removed = plan_changes(csv_files, manifest)
+    print(f"Tim thay {len(csv_files)} file tho: {len(to_process)} moi/thay doi, "
+          f"{len(files)} khong doi, {len(removed)} da bi xoa.")
+
+    # File da xoa hoac se ghi lai -> xoa phan vung cu cua chung truoc
+    for entry in removed:
+        remove_partitions(entry)
+    if manifest:
+        for path in to_process:
+            old_entry = manifest['files'].get(os.path.basename(path))
+            if old_entry is not None:
+                remove_partitions(old_entry)
+
+    failed = []
+    if to_process:
+        print("Dang doc song song cac file moi/thay doi...")
+        with ProcessPoolExecutor(max_workers=min(MAX_WORKERS, len(to_process))) as pool:
+            results = list(pool.map(process_file, to_process))
+        for result in results:
+            if 'error' in result:
+                # Khong ghi vao manifest -> lan chay sau se thu lai
+                print(f"Loi khi doc file {result['file']}: {result['error']}")
+                failed.append(result['file'])
+                continue
+            files[result['file']] = result
+
+    save_manifest({'schema_version': SCHEMA_VERSION, 'files': dict(sorted(files.items()))})
+
+    # Thong ke toan bo bo du lieu lay tu manifest (khong can doc lai du lieu)
+    total_raw = sum(entry['rows_raw'] for entry in files.values())
+    total_rows = sum(entry['rows'] for entry in files.values())
+    flood_counts = {}
+    for entry in files.values():
+        for label, count in entry['flood_counts'].items():
+            flood_counts[label] = flood_counts.get(label, 0) + count
+
+    if total_rows == 0:
+        print("Loi: Khong co du lieu hop le de tong hop. Dung chuong trinh.")
+        sys.exit(1)
+
+    print(f"Tong hop thanh cong. Tong so diem mau truoc khi don dep: {total_raw}")
+    print(f"Tong so diem mau sau khi don dep (loai bo NaN): {total_rows}")
+
+    # Hien thi phan bo du lieu
+    if flood_counts:
         print("\nPhan bo du lieu (0=Khong ngap, 1=Ngap):")
-        print(final_df['flood'].value_counts())
+        for label in sorted(flood_counts):
+            print(f"{label}    {flood_counts[label]}")
     else:
         print("Canh bao: Khong tim thay cot 'flood'.")
-        
-    # Buoc 3: Luu file DU LIEU THO (chua chuan hoa)
-    output_path = os.path.join(PROCESSED_DATA_DIR, 'combined_data_raw.csv')
-    final_df.to_csv(output_path, index=False)
-    
+
     print(f"\n==================================================================")
-    print(f"HOAN TAT! Da luu du lieu THO thanh cong vao: {output_path}")
+    print(f"HOAN TAT! Da luu du lieu THO (Parquet, chia theo purpose/event_id) vao: {DATASET_DIR}")
+    print(f"Manifest: {MANIFEST_PATH}")
     print(f"BUOC TIEP THEO: Chay 'python src/train_model.py' de huan luyen mo hinh.")
     print(f"==================================================================")
 
+    if failed:
+        # Bo du lieu thieu cac file nay -> bao that bai (src/pipeline.py khong ghi nhan)
+        print(f"Loi: {len(failed)} file khong doc duoc: {', '.join(failed)}")
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,135 @@
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# ĐỊNH NGHĨA ĐƯỜNG DẪN
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'raw_exports'))
+PROCESSED_DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'processed'))
+# Bo du lieu Parquet chia thu muc: purpose=<...>/event_id=<...>/<file nguon>.parquet
+DATASET_DIR = os.path.join(PROCESSED_DATA_DIR, 'combined_data')
+# Manifest do combine_data.py ghi, thay doi moi khi bo du lieu thay doi
+MANIFEST_PATH = os.path.join(PROCESSED_DATA_DIR, 'combined_data_manifest.json')
+
+# =============================================================================
+# LUOC DO DU LIEU (SCHEMA)
+# =============================================================================
+# Tang khi doi schema ben duoi (hoac cach don dep trong combine_data.py)
+# -> combine_data.py tu tao lai toan bo bo du lieu
+SCHEMA_VERSION = 3
+
+# Cot phan vung: nam trong ten thu muc, khong ghi lai trong file
+PARTITION_COLUMNS = ['purpose', 'event_id']
+
+# Dac trung lien tuc -> float32 (du do chinh xac cho GEE, nua bo nho)
+FLOAT_COLUMNS = [
+    'elevation', 'slope', 'aspect',
+    'precip_total', 'precip_14_day', 'precip_7_day', 'precip_3_day',
+    'soil_moisture',
+]
+# Nhan, flags va ma phan loai (0-255) -> uint8
+UINT8_COLUMNS = [
+    'flood', 'is_flood_prone', 'is_permanent_water', 'is_urban', 'is_agriculture',
+    'land_cover', 'soil_type',
+]
+# Toa do diem lay mau, tach tu cot .geo (GeoJSON) cua GEE -> float64
+COORD_COLUMNS = ['longitude', 'latitude']
+# Chuoi lap lai -> category
+CATEGORY_COLUMNS = ['purpose', 'event_id', 'detail']
+DATE_COLUMNS = ['apex_date']
+
+# Cot metadata cua GEE, khong dung cho huan luyen
+DROP_COLUMNS = ['system:index', '.geo']
+
+# Kieu khi doc CSV: cot uint8 doc tam bang float32 vi co the chua NaN
+READ_DTYPES = {
+    **{col: 'float32' for col in FLOAT_COLUMNS + UINT8_COLUMNS},
+    **{col: 'category' for col in CATEGORY_COLUMNS},
+}
+
+
+def apply_schema(df):
+    """Ep kieu DataFrame (da loai NaN) theo schema; cot la giu nguyen."""
+    for col in UINT8_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.uint8)
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.float32)
+    for col in COORD_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.float64)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+# Lay 2 so dau tien trong mang "coordinates" cua GeoJSON Point
+_GEO_POINT_PATTERN = (
+    r'"coordinates"\s*:\s*\[\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)'
+)
+
+
+def parse_geo_points(geo):
+    """Tach (longitude, latitude) tu cot .geo (chuoi GeoJSON Point) cua GEE.
+
+    Dung regex vector hoa cua pandas thay cho eval()/json tung dong; dong khong
+    hop le cho NaN.
+
+    Returns:
+        pd.DataFrame voi 2 cot float64 'longitude', 'latitude' (cung index).
+    """
+    coords = geo.astype(str).str.extract(_GEO_POINT_PATTERN)
+    coords.columns = COORD_COLUMNS
+    return coords.astype(np.float64)
+
+
+# =============================================================================
+# DOC BO DU LIEU DA XU LY
+# =============================================================================
+def dataset_version(manifest_path=MANIFEST_PATH):
+    """Ma phien ban bo du lieu (sha256 cua manifest), None neu chua co manifest."""
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def load_dataset(columns=None, purposes=None, event_ids=None, dataset_dir=DATASET_DIR):
+    """Doc bo du lieu Parquet, chi cac cot va phan vung can thiet.
+
+    Args:
+        columns: danh sach cot can doc (None = tat ca). Co the gom cot phan vung.
+        purposes: chi doc cac purpose nay (vd. ['training', 'validation']).
+        event_ids: chi doc cac su kien nay.
+        dataset_dir: thu muc bo du lieu.
+
+    Returns:
+        pd.DataFrame, cot phan vung o dang category.
+
+    Raises:
+        FileNotFoundError: neu chua chay combine_data.py.
+    """
+    if not os.path.isdir(dataset_dir):
+        raise FileNotFoundError(dataset_dir)
+
+    filters = []
+    if purposes is not None:
+        filters.append(('purpose', 'in', list(purposes)))
+    if event_ids is not None:
+        filters.append(('event_id', 'in', list(event_ids)))
+
+    return pd.read_parquet(
+        dataset_dir,
+        engine='pyarrow',
+        columns=list(columns) if columns is not None else None,
+        filters=filters or None,
+    )
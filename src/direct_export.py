@@ -0,0 +1,210 @@
+"""Xuat truc tiep FeatureCollection ve may (khong qua Google Drive).
+
+Chia FeatureCollection thanh cac trang (offset, limit) tren danh sach
+system:index da sap xep (moi trang = 1 filter theo khoa, khong dung
+toList(offset)), tai song song qua EE data API va ghi lan luot (dung thu tu) vao data/raw_exports/<ten>.csv
+hoac .parquet - cung dinh dang voi file CSV xuat tu Drive (system:index,
+cac thuoc tinh theo thu tu ABC, .geo) nen combine_data.py doc duoc ngay.
+
+Nguon trang (pager) duoc truyen vao, nen co the thay EarthEngineFeaturePager
+bang 1 pager doc tu server gia lap de kiem thu.
+"""
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# =============================================================================
+# XUAT TRUC TIEP FEATURECOLLECTION VE MAY (KHONG QUA GOOGLE DRIVE)
+# =============================================================================
+EXPORT_FORMATS = ('csv', 'parquet')
+DEFAULT_PAGE_SIZE = 1000      # so feature moi lan goi (getInfo gioi han ~5000)
+DEFAULT_WORKERS = 8           # so trang tai dong thoi
+PAGE_ATTEMPTS = 3             # so lan thu moi trang (loi mang / 429 cua EE)
+PAGE_BACKOFF = 5.0            # giay, nhan doi sau moi lan loi
+
+
+class FeaturePager(ABC):
+    """Giao dien nguon du lieu: tong so feature va 1 trang feature GeoJSON."""
+
+    @abstractmethod
+    def count(self):
+        """Tong so feature cua collection."""
+
+    @abstractmethod
+    def page(self, offset, limit):
+        """Tra ve list feature GeoJSON ({'id', 'properties', 'geometry'})."""
+
+    def columns(self):
+        """Ten cac thuoc tinh cua collection (None = lay theo trang dau tien)."""
+        return None
+
+
+class EarthEngineFeaturePager(FeaturePager):
+    """Doc tung trang cua ee.FeatureCollection theo khoa system:index.
+
+    Lay toan bo system:index 1 lan (sap xep -> thu tu trang on dinh), moi trang
+    chi loc cac feature co khoa trong trang do. Khong dung toList(limit, offset):
+    server phai tinh lai moi dong truoc `offset` cho tung trang (O(n^2) ca lan xuat).
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._keys = None
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = sorted(self.collection.aggregate_array('system:index').getInfo())
+        return self._keys
+
+    def count(self):
+        return len(self.keys())
+
+    def page(self, offset, limit):
+        import ee
+        keys = self.keys()[offset:offset + limit]
+        chunk = self.collection.filter(ee.Filter.inList('system:index', keys))
+        order = {key: i for i, key in enumerate(keys)}
+        return sorted(chunk.getInfo()['features'], key=lambda feature: order[feature['id']])
+
+    def columns(self):
+        # Hop cac thuoc tinh cua MOI feature (thuoc tinh null bi bo khoi tung feature)
+        import ee
+        names = self.collection.map(
+            lambda feature: ee.Feature(None, {'names': feature.propertyNames()})
+        ).aggregate_array('names').flatten().distinct().getInfo()
+        return [name for name in names if name not in ('system:index', '.geo')]
+
+
+def features_to_frame(features):
+    """Chuyen list feature GeoJSON thanh DataFrame theo bo cuc CSV cua GEE."""
+    rows = []
+    for feature in features:
+        row = {'system:index': feature.get('id')}
+        row.update(feature.get('properties') or {})
+        geometry = feature.get('geometry')
+        row['.geo'] = json.dumps(geometry, separators=(',', ':')) if geometry else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _fetch_page(pager, offset, limit, attempts=PAGE_ATTEMPTS, backoff=PAGE_BACKOFF,
+                sleep=time.sleep):
+    for attempt in range(1, attempts + 1):
+        try:
+            return pager.page(offset, limit)
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            print(f"!!! Loi khi tai trang offset={offset} ({e}), thu lai sau {delay:.0f}s")
+            sleep(delay)
+
+
+class _PageWriter:
+    """Ghi cac trang vao 1 file; cot co dinh theo `properties` (mac dinh: trang dau tien).
+
+    Trang co thuoc tinh ngoai tap cot do se bi tu choi (ValueError) thay vi bi
+    cat bo am tham.
+    """
+
+    def __init__(self, path, fmt, properties=None):
+        self.path = path
+        self.fmt = fmt
+        self.columns = None
+        self.numeric = None
+        self._parquet = None
+        self.rows = 0
+        if properties is not None:
+            self.columns = ['system:index'] + sorted(properties) + ['.geo']
+
+    def write(self, frame):
+        if self.columns is None:
+            props = sorted(c for c in frame.columns if c not in ('system:index', '.geo'))
+            self.columns = ['system:index'] + props + ['.geo']
+        extra = sorted(set(frame.columns) - set(self.columns))
+        if extra:
+            raise ValueError(f"Trang co thuoc tinh ngoai tap cot cua file: {extra}")
+        # Thuoc tinh null bi EE bo khoi feature -> cot thieu thanh NaN (combine_data loai bo)
+        frame = frame.reindex(columns=self.columns)
+        if self.numeric is None:
+            # Cot chi co NaN o trang dau (float64 sau reindex) van duoc coi la so
+            self.numeric = [c for c in self.columns[1:-1] if pd.api.types.is_numeric_dtype(frame[c])]
+        if self.fmt == 'csv':
+            frame.to_csv(self.path, mode='a', header=self.rows == 0, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            # Kieu on dinh giua cac trang: so -> float64, con lai -> chuoi
+            frame[self.numeric] = frame[self.numeric].apply(pd.to_numeric, errors='coerce').astype('float64')
+            others = [c for c in self.columns if c not in self.numeric]
+            frame[others] = frame[others].astype('string')
+            if self._parquet is None:
+                schema = pa.Schema.from_pandas(frame, preserve_index=False)
+                self._parquet = pq.ParquetWriter(self.path, schema)
+            self._parquet.write_table(
+                pa.Table.from_pandas(frame, schema=self._parquet.schema, preserve_index=False)
+            )
+        self.rows += len(frame)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def export_collection(pager, out_path, fmt='csv', page_size=DEFAULT_PAGE_SIZE,
+                      max_workers=DEFAULT_WORKERS):
+    """Tai toan bo FeatureCollection qua `pager` va ghi vao `out_path`.
+
+    Cac trang duoc tai song song (toi da `max_workers` trang dang cho ghi, nen bo
+    nho bi chan tren) va ghi theo dung thu tu vao file tam; chi doi ten thanh
+    `out_path` khi da ghi xong, de combine_data.py khong doc phai file do dang.
+
+    Returns:
+        int: so dong da ghi.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Dinh dang khong ho tro: {fmt}")
+    total = pager.count()
+    offsets = list(range(0, total, page_size))
+    print(f"Dang tai {total} feature ({len(offsets)} trang) -> {out_path}")
+
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = out_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    writer = _PageWriter(tmp_path, fmt, pager.columns() if total else None)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = []
+            next_offset = iter(offsets)
+            # Giu toi da max_workers trang dang tai; ghi trang som nhat khi xong
+            for offset in next_offset:
+                pending.append(pool.submit(_fetch_page, pager, offset, page_size))
+                if len(pending) >= max_workers:
+                    break
+            while pending:
+                features = pending.pop(0).result()
+                offset = next(next_offset, None)
+                if offset is not None:
+                    pending.append(pool.submit(_fetch_page, pager, offset, page_size))
+                if features:
+                    writer.write(features_to_frame(features))
+    except BaseException:
+        writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    writer.close()
+
+    if writer.rows == 0:
+        # Giong Drive: collection rong van tao file (combine_data bo qua file rong)
+        open(tmp_path, 'w').close()
+    os.replace(tmp_path, out_path)
+    return writer.rows
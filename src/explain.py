@@ -0,0 +1,193 @@
+"""Gia tri SHAP tren mau phan tang (song song, luu lai tren dia).
+
+- Chi giai thich 1 mau phan tang theo nhan (toi da SHAP_SAMPLE_SIZE dong),
+  nen chi phi co dinh, khong tang theo kich thuoc tap training.
+- Gia tri SHAP tinh bang TreeSHAP cua chinh XGBoost (pred_contribs, cung ket
+  qua voi shap.TreeExplainer mac dinh), chia thanh cac khoi SHAP_CHUNK_ROWS
+  dong tren nhieu tien trinh.
+- Ket qua luu vao outputs/shap/ (file .npy + shap_meta.json) kem chi so dong;
+  chay lai voi cung model + du lieu thi doc lai, khong tinh lai.
+"""
+import os
+import json
+import shutil
+import hashlib
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xgboost as xgb
+
+# =============================================================================
+# GIA TRI SHAP TREN MAU PHAN TANG (SONG SONG, LUU LAI TREN DIA)
+# =============================================================================
+SHAP_SAMPLE_SIZE = 2000       # so dong toi da duoc giai thich
+SHAP_CHUNK_ROWS = 250         # so dong moi khoi gui cho 1 tien trinh
+RANDOM_STATE = 42
+# Tang khi doi cach lay mau / tinh gia tri: ket qua cu tren dia khong con dung
+SHAP_FORMAT_VERSION = 1
+
+VALUES_FILE = 'shap_values.npy'   # (n, so dac trung) gia tri SHAP (log-odds)
+DATA_FILE = 'shap_data.npy'       # (n, so dac trung) dac trung da chuan hoa cua cac dong
+ROW_IDS_FILE = 'row_ids.npy'      # (n,) chi so dong trong tap training
+META_FILE = 'shap_meta.json'
+
+
+def stratified_sample(y, sample_size=SHAP_SAMPLE_SIZE, random_state=RANDOM_STATE):
+    """Vi tri (da sap xep) cua toi da `sample_size` dong, giu ty le cac nhan cua `y`."""
+    y = np.asarray(y)
+    if len(y) <= sample_size:
+        return np.arange(len(y))
+    rng = np.random.RandomState(random_state)
+    labels, counts = np.unique(y, return_counts=True)
+    # Phan bo theo ty le (phan du cho nhan co phan le lon nhat); moi nhan it nhat 1 dong
+    exact = counts * sample_size / len(y)
+    quotas = np.floor(exact).astype(int)
+    quotas[np.argsort(quotas - exact)[:sample_size - quotas.sum()]] += 1
+    quotas = np.maximum(1, quotas)
+    picked = [
+        rng.choice(np.flatnonzero(y == label), size=min(quota, count), replace=False)
+        for label, quota, count in zip(labels, quotas, counts)
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def _iteration_range(booster):
+    """Giong XGBClassifier.predict: chi dung so cay tot nhat neu co early stopping."""
+    best = booster.attr('best_iteration')
+    return (0, int(best) + 1) if best is not None else (0, 0)
+
+
+# -----------------------------------------------------------------------------
+# Tien trinh con
+# -----------------------------------------------------------------------------
+_worker = {}
+
+
+def _init_worker(raw_model, iteration_range):
+    booster = xgb.Booster(model_file=bytearray(raw_model))
+    booster.set_param({'nthread': 1})
+    _worker.update(booster=booster, iteration_range=iteration_range)
+
+
+def _contributions(chunk):
+    return _worker['booster'].predict(
+        xgb.DMatrix(chunk), pred_contribs=True, iteration_range=_worker['iteration_range']
+    )
+
+
+# -----------------------------------------------------------------------------
+# Ham chinh
+# -----------------------------------------------------------------------------
+def shap_key(raw_model, iteration_range, features, X_sample, y, row_ids, sample_size):
+    """Khoa cua ket qua: model, dac trung, nhan, mau va tham so lay mau."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'version': SHAP_FORMAT_VERSION,
+        'iteration_range': list(iteration_range),
+        'features': list(features),
+        'sample_size': sample_size,
+        'random_state': RANDOM_STATE,
+    }, sort_keys=True).encode())
+    digest.update(bytes(raw_model))
+    for array in (np.asarray(y), row_ids, X_sample):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def load_shap_values(out_dir, key=None):
+    """Doc ket qua da luu: dict (values, data, row_ids, base_value, features) hoac None."""
+    meta_path = os.path.join(out_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if key is not None and meta.get('key') != key:
+        return None
+    return {
+        'values': np.load(os.path.join(out_dir, VALUES_FILE)),
+        'data': np.load(os.path.join(out_dir, DATA_FILE)),
+        'row_ids': np.load(os.path.join(out_dir, ROW_IDS_FILE)),
+        'base_value': meta['base_value'],
+        'features': meta['features'],
+    }
+
+
+def _save_shap_values(out_dir, result, key):
+    tmp_dir = out_dir + '.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, VALUES_FILE), result['values'])
+    np.save(os.path.join(tmp_dir, DATA_FILE), result['data'])
+    np.save(os.path.join(tmp_dir, ROW_IDS_FILE), result['row_ids'])
+    with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'key': key,
+            'features': result['features'],
+            'base_value': result['base_value'],
+            'n_rows': int(len(result['row_ids'])),
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }, f, indent=2)
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+
+
+def compute_shap_values(booster, X, y, features, out_dir, row_ids=None,
+                        sample_size=SHAP_SAMPLE_SIZE, chunk_rows=SHAP_CHUNK_ROWS, n_workers=None):
+    """Gia tri SHAP cua 1 mau phan tang cua (X, y); doc lai tu `out_dir` neu khong doi.
+
+    Args:
+        booster: xgb.Booster (hoac XGBClassifier) da huan luyen.
+        X: ma tran dac trung da chuan hoa (nhu khi huan luyen).
+        y: nhan, dung de lay mau phan tang.
+        features: ten cac cot cua X.
+        out_dir: thu muc luu ket qua.
+        row_ids: chi so cua tung dong cua X (mac dinh 0..n-1).
+        n_workers: so tien trinh (None = so CPU).
+
+    Returns:
+        dict: values (n, so dac trung), data (n, so dac trung), row_ids (n,),
+        base_value, features.
+    """
+    if isinstance(booster, xgb.XGBModel):
+        booster = booster.get_booster()
+    X = np.asarray(X)
+    positions = stratified_sample(y, sample_size)
+    row_ids = np.arange(len(X)) if row_ids is None else np.asarray(row_ids)
+    X_sample = np.ascontiguousarray(X[positions], dtype=np.float32)
+    sample_ids = row_ids[positions]
+
+    raw_model = booster.save_raw(raw_format='ubj')
+    iteration_range = _iteration_range(booster)
+    key = shap_key(raw_model, iteration_range, features, X_sample, y, sample_ids, sample_size)
+
+    cached = load_shap_values(out_dir, key)
+    if cached is not None:
+        print(f"Dung lai gia tri SHAP da luu ({len(cached['row_ids'])} dong) tai: {out_dir}")
+        return cached
+
+    chunks = [X_sample[i:i + chunk_rows] for i in range(0, len(X_sample), chunk_rows)]
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, len(chunks)))
+    print(f"Tinh SHAP cho {len(X_sample)}/{len(X)} dong ({len(chunks)} khoi, {n_workers} tien trinh)...")
+    if n_workers == 1:
+        _init_worker(raw_model, iteration_range)
+        parts = [_contributions(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(bytes(raw_model), iteration_range)) as pool:
+            parts = list(pool.map(_contributions, chunks))
+
+    # Cot cuoi cua pred_contribs la bias (gia tri ky vong cua model)
+    contribs = np.concatenate(parts) if parts else np.zeros((0, len(features) + 1), dtype=np.float32)
+    result = {
+        'values': contribs[:, :-1],
+        'data': X_sample,
+        'row_ids': sample_ids,
+        'base_value': float(contribs[0, -1]) if len(contribs) else 0.0,
+        'features': list(features),
+    }
+    _save_shap_values(out_dir, result, key)
+    print(f"Da luu gia tri SHAP vao: {out_dir}")
+    return result
@@ -0,0 +1,235 @@
+"""Lap lich cac task xuat du lieu (export) cua GEE.
+
+Giu toi da `max_in_flight` task chay dong thoi (gioi han hang doi cua EE),
+hoi trang thai dinh ky, chay lai task loi voi thoi gian cho tang dan, va
+luu tien do vao file JSON de lan chay sau tiep tuc (khong khoi tao lai
+task da xong hoac dang chay).
+
+Backend (noi khoi tao / hoi trang thai task) duoc truyen vao, nen co the
+thay EarthEngineTaskBackend bang 1 backend gia de kiem thu.
+"""
+import os
+import json
+import time
+import traceback
+from abc import ABC, abstractmethod
+
+# =============================================================================
+# LAP LICH CAC TASK XUAT DU LIEU (EXPORT) CUA GEE
+# =============================================================================
+# Trang thai task cua ee.batch
+EE_DONE_STATES = {'COMPLETED'}
+EE_FAILED_STATES = {'FAILED', 'CANCELLED'}
+
+# Trang thai cua tung job trong file tien do
+PENDING = 'PENDING'        # chua khoi tao / cho chay lai
+SUBMITTED = 'SUBMITTED'    # da khoi tao task, dang cho ket qua
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'          # het so lan thu
+SKIPPED = 'SKIPPED'        # khong tao duoc task (vd. thieu anh S1)
+FINAL_STATES = {COMPLETED, FAILED, SKIPPED}
+
+
+class SkipJob(Exception):
+    """Backend bao job khong can / khong the chay (khong thu lai)."""
+
+
+class TaskBackend(ABC):
+    """Giao dien backend: khoi tao task va hoi trang thai nhieu task 1 lan."""
+
+    @abstractmethod
+    def start(self, job_id):
+        """Khoi tao task cho job; tra ve task_id. Raise SkipJob neu bo qua job."""
+
+    @abstractmethod
+    def status(self, task_ids):
+        """Tra ve dict task_id -> (state, error_message) theo trang thai ee.batch."""
+
+
+class EarthEngineTaskBackend(TaskBackend):
+    """Backend that: `build_task(job_id)` tra ve ee.batch.Task (hoac None de bo qua)."""
+
+    def __init__(self, build_task):
+        self.build_task = build_task
+
+    def start(self, job_id):
+        task = self.build_task(job_id)
+        if task is None:
+            raise SkipJob(f"Khong tao duoc task cho {job_id}")
+        task.start()
+        return task.id
+
+    def status(self, task_ids):
+        import ee
+        statuses = ee.data.getTaskStatus(list(task_ids))
+        return {
+            s['id']: (s.get('state', 'UNKNOWN'), s.get('error_message'))
+            for s in statuses
+        }
+
+
+class ExportScheduler:
+    """Chay 1 danh sach job qua backend voi gioi han so task dong thoi.
+
+    Args:
+        backend: TaskBackend.
+        state_path: file JSON luu tien do (None = khong luu).
+        max_in_flight: so task chay dong thoi toi da.
+        max_attempts: so lan thu toi da moi job (ke ca lan dau).
+        poll_interval: chu ky hoi trang thai (giay).
+        backoff_base, backoff_max: cho truoc lan thu lai thu k = min(base * 2^(k-1), max).
+        unknown_timeout: task_id khong con trong ket qua hoi trang thai (UNKNOWN) lien tuc
+            qua so giay nay thi coi nhu loi (vd. task da bi xoa khoi lich su cua EE).
+        retry_failed: dat lai cac job FAILED trong file tien do ve PENDING (so lan thu = 0).
+        retry_skipped: dat lai cac job SKIPPED (vd. luc truoc chua co anh S1) ve PENDING.
+        clock, sleep: co the thay the khi kiem thu.
+    """
+
+    def __init__(self, backend, state_path=None, max_in_flight=10, max_attempts=3,
+                 poll_interval=30.0, backoff_base=60.0, backoff_max=900.0,
+                 unknown_timeout=1800.0, retry_failed=False, retry_skipped=False,
+                 clock=time.time, sleep=time.sleep):
+        self.backend = backend
+        self.state_path = state_path
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.unknown_timeout = unknown_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.jobs = self._load_state()
+        retry_states = {state for state, retry in ((FAILED, retry_failed), (SKIPPED, retry_skipped))
+                        if retry}
+        for job_id, job in self.jobs.items():
+            if job['state'] in retry_states:
+                print(f"==> {job_id}: dat lai job {job['state']} de thu lai")
+                job.update(state=PENDING, attempts=0, next_attempt_at=0.0)
+
+    # -------------------------------------------------------------------------
+    # File tien do
+    # -------------------------------------------------------------------------
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f).get('jobs', {})
+        return {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'jobs': self.jobs}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    # -------------------------------------------------------------------------
+    # Chuyen trang thai
+    # -------------------------------------------------------------------------
+    def _backoff(self, attempts):
+        return min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+
+    def _fail(self, job_id, error):
+        job = self.jobs[job_id]
+        job['error'] = error
+        job['task_id'] = None
+        job['unknown_since'] = None
+        if job['attempts'] >= self.max_attempts:
+            job['state'] = FAILED
+            print(f"!!! {job_id}: THAT BAI sau {job['attempts']} lan thu: {error}")
+        else:
+            delay = self._backoff(job['attempts'])
+            job['state'] = PENDING
+            job['next_attempt_at'] = self.clock() + delay
+            print(f"!!! {job_id}: loi ({error}), thu lai sau {delay:.0f}s")
+
+    def _start(self, job_id):
+        job = self.jobs[job_id]
+        job['attempts'] += 1
+        try:
+            job['task_id'] = self.backend.start(job_id)
+            job['state'] = SUBMITTED
+            job['error'] = None
+            print(f"==> DA KHOI TAO TASK cho {job_id} (lan {job['attempts']}): {job['task_id']}")
+        except SkipJob as e:
+            job['state'] = SKIPPED
+            job['error'] = str(e)
+            print(f"!!! Bo qua {job_id}: {e}")
+        except Exception as e:
+            # Vd. hang doi EE day -> thu lai sau
+            traceback.print_exc()
+            self._fail(job_id, str(e))
+
+    def _poll(self, in_flight):
+        try:
+            statuses = self.backend.status([self.jobs[j]['task_id'] for j in in_flight])
+        except Exception as e:
+            print(f"!!! Loi khi hoi trang thai task: {e}")
+            return
+        for job_id in in_flight:
+            job = self.jobs[job_id]
+            state, error = statuses.get(job['task_id'], ('UNKNOWN', None))
+            job['task_state'] = state
+            if state == 'UNKNOWN':
+                # EE khong biet task_id nay: cho 1 thoi gian roi coi nhu loi
+                now = self.clock()
+                if job.get('unknown_since') is None:
+                    job['unknown_since'] = now
+                if now - job['unknown_since'] >= self.unknown_timeout:
+                    self._fail(job_id, f"task {job['task_id']} khong con trong EE "
+                                       f"sau {self.unknown_timeout:.0f}s")
+                continue
+            job['unknown_since'] = None
+            if state in EE_DONE_STATES:
+                job['state'] = COMPLETED
+                print(f"==> {job_id}: HOAN THANH")
+            elif state in EE_FAILED_STATES:
+                self._fail(job_id, error or state)
+
+    # -------------------------------------------------------------------------
+    # Vong lap chinh
+    # -------------------------------------------------------------------------
+    def run(self, job_ids):
+        """Chay cac job den khi tat ca o trang thai cuoi; tra ve dict job_id -> trang thai."""
+        for job_id in job_ids:
+            self.jobs.setdefault(job_id, {
+                'state': PENDING, 'task_id': None, 'attempts': 0,
+                'next_attempt_at': 0.0, 'error': None,
+            })
+        job_ids = list(job_ids)
+
+        while True:
+            in_flight = [j for j in job_ids if self.jobs[j]['state'] == SUBMITTED]
+            if in_flight:
+                self._poll(in_flight)
+
+            # Lap day cac slot trong bang job dang cho (da het thoi gian backoff)
+            now = self.clock()
+            n_running = sum(1 for j in job_ids if self.jobs[j]['state'] == SUBMITTED)
+            for job_id in job_ids:
+                if n_running >= self.max_in_flight:
+                    break
+                job = self.jobs[job_id]
+                if job['state'] == PENDING and job['next_attempt_at'] <= now:
+                    self._start(job_id)
+                    if job['state'] == SUBMITTED:
+                        n_running += 1
+            self._save_state()
+
+            remaining = [j for j in job_ids if self.jobs[j]['state'] not in FINAL_STATES]
+            if not remaining:
+                break
+
+            # Ngu den lan hoi tiep theo (hoac den luc job backoff som nhat duoc chay)
+            wait = self.poll_interval if n_running else float('inf')
+            waiting = [self.jobs[j]['next_attempt_at'] for j in remaining
+                       if self.jobs[j]['state'] == PENDING]
+            if waiting and n_running < self.max_in_flight:
+                wait = min(wait, max(min(waiting) - self.clock(), 0.0))
+            self.sleep(wait)
+
+        return {j: self.jobs[j]['state'] for j in job_ids}
@@ -0,0 +1,454 @@
+import os
+import json
+import datetime
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from rainfall import precipitation_windows, antecedent_windows, ANTECEDENT_WINDOWS, MAX_ANTECEDENT_DAYS
+from climate_store import ClimateCube, SOIL_MOISTURE_WINDOW_DAYS
+
+# =============================================================================
+# THU TU DAC TRUNG
+# =============================================================================
+# Day la thu tu dac trung ma model da hoc (rat quan trong)
+FEATURES_ORDER = [
+    # Đặc trưng địa hình
+    'elevation', 'slope', 'aspect',
+    # Đặc trưng lớp phủ và đất
+    'land_cover', 'soil_type',
+    # Flags từ land_cover
+    'is_flood_prone', 'is_permanent_water', 'is_urban', 'is_agriculture',
+    # Đặc trưng động
+    'precip_total', 'precip_14_day', 'precip_7_day', 'precip_3_day',
+    'soil_moisture'
+]
+
+# Nhom dac trung tinh (khong doi theo thoi gian) va dong (thay doi theo mua/do am)
+STATIC_FEATURES = FEATURES_ORDER[:9]
+DYNAMIC_FEATURES = FEATURES_ORDER[9:]
+
+STATIC_LAYERS = ['elevation', 'slope', 'aspect', 'land_cover', 'soil_type']
+DAILY_LAYERS = ['precipitation', 'soil_moisture']
+
+# Do tre cua du lieu dong: cua so mua ket thuc 3 ngay truoc hom nay
+DYNAMIC_END_LAG_DAYS = 3
+
+
+def land_cover_flags(land_cover):
+    """Tinh cac flags tu ma land_cover (cung quy tac voi GEE).
+
+    Nhan so hoac numpy array, tra ve dict cac flag dang uint8.
+    """
+    lc = np.asarray(land_cover)
+    return {
+        'is_flood_prone': ((lc == 40) | (lc == 50) | (lc == 90)).astype(np.uint8),
+        'is_permanent_water': (lc == 80).astype(np.uint8),
+        'is_urban': (lc == 50).astype(np.uint8),
+        'is_agriculture': (lc == 40).astype(np.uint8),
+    }
+
+
+# =============================================================================
+# GIAO DIEN CHUNG
+# =============================================================================
+class FeatureProvider(ABC):
+    """Nguon dac trung cho API.
+
+    Moi implementation tra ve dict co dung cac khoa trong FEATURES_ORDER
+    (gia tri None neu khong co du lieu tai diem do). Tham so `columns` cho
+    phep chi lay mot phan dac trung (vd. chi DYNAMIC_FEATURES khi phan tinh
+    da co trong cache).
+    """
+
+    name = 'base'
+    # API chi dat cache truoc cac nguon cham (vd. GEE)
+    cacheable = False
+
+    @abstractmethod
+    def get_features(self, lat, lon, columns=None):
+        """Tra ve dict ten dac trung -> gia tri tai (lat, lon)."""
+
+    def get_features_batch(self, points, columns=None):
+        """Mac dinh: goi get_features cho tung diem. Ghi de neu co cach nhanh hon."""
+        return [self.get_features(lat, lon, columns=columns) for lat, lon in points]
+
+
+# =============================================================================
+# NGUON 1: GOOGLE EARTH ENGINE
+# =============================================================================
+class GEEFeatureProvider(FeatureProvider):
+    """Lay dac trung truc tiep tu Earth Engine (reduceRegion / reduceRegions).
+
+    `ee` chi duoc import khi truy van, nen nguon local chay duoc khi khong cai earthengine-api.
+    """
+
+    name = 'gee'
+    cacheable = True
+
+    def __init__(self, scale=90, batch_chunk_size=500):
+        self.scale = scale
+        self.batch_chunk_size = batch_chunk_size
+
+    def build_features_image(self, columns=None):
+        """Tao anh (ee.Image) gom tat ca dac trung theo dung ten band cua FEATURES_ORDER.
+
+        Dung chung cho truy van 1 diem (reduceRegion) va truy van nhieu diem
+        (reduceRegions) de hai duong di tra ve cung mot bo dac trung.
+        """
+        import ee
+        today = ee.Date(datetime.datetime.now(datetime.timezone.utc))
+
+        # --- 1. Static features ---
+        dem = ee.Image("USGS/SRTMGL1_003")
+        slope = ee.Terrain.slope(dem).rename('slope')
+        aspect = ee.Terrain.aspect(dem).rename('aspect')
+        land_cover = ee.ImageCollection("ESA/WorldCover/v100").first().select('Map').rename('land_cover')
+        soil = ee.Image("OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02").select('b0').rename('soil_type')
+
+        is_flood_prone = land_cover.eq(40).Or(land_cover.eq(50)).Or(land_cover.eq(90)).rename('is_flood_prone')
+        is_permanent_water = land_cover.eq(80).rename('is_permanent_water')
+        is_urban = land_cover.eq(50).rename('is_urban')
+        is_agriculture = land_cover.eq(40).rename('is_agriculture')
+
+        static_features_image = dem.rename('elevation').addBands([
+            slope, aspect, land_cover.toByte(), soil.toByte(),
+            is_flood_prone.toByte(), is_permanent_water.toByte(), is_urban.toByte(), is_agriculture.toByte()
+        ])
+
+        # --- 2. Antecedent / dynamic features ---
+        end_date = today.advance(-DYNAMIC_END_LAG_DAYS, 'day')
+
+        # 1 chuoi mua theo ngay (14 ngay truoc end_date), cac cua so lay tu tong tich luy
+        precipitation = precipitation_windows(
+            end_date.advance(-MAX_ANTECEDENT_DAYS, 'day'), MAX_ANTECEDENT_DAYS,
+            antecedent_windows(MAX_ANTECEDENT_DAYS),
+        )
+
+        pre_start_date_3_sm = end_date.advance(-3, 'day')
+        sm_collection = ee.ImageCollection("NASA/SMAP/SPL3SMP_E/005").filterDate(pre_start_date_3_sm, end_date).select('soil_moisture_am')
+
+        collection_size = sm_collection.size()
+        mean_sm_with_data = sm_collection.mean().unmask(0).rename('soil_moisture')
+        mean_sm_empty = ee.Image(0).rename('soil_moisture')
+        soil_moisture_mean = ee.Image(ee.Algorithms.If(collection_size.gt(0), mean_sm_with_data, mean_sm_empty))
+
+        dynamic_features = precipitation.addBands([soil_moisture_mean, ee.Image(0).rename('precip_total')])
+
+        # --- 3. Merge ---
+        # select() de GEE chi tinh cac band can thiet (tinh toan lazy phia server)
+        all_features_image = static_features_image.addBands(dynamic_features)
+        return all_features_image.select(list(columns or FEATURES_ORDER))
+
+    def get_features(self, lat, lon, columns=None):
+        import ee
+        columns = list(columns or FEATURES_ORDER)
+        point = ee.Geometry.Point(lon, lat)
+        data_dict = self.build_features_image(columns).reduceRegion(
+            reducer=ee.Reducer.first(), geometry=point, scale=self.scale
+        ).getInfo()
+        return {col: data_dict.get(col) for col in columns}
+
+    def get_features_batch(self, points, columns=None):
+        """Gom cac diem thanh FeatureCollection, moi khoi `batch_chunk_size` diem chi 1 lan getInfo()."""
+        import ee
+        columns = list(columns or FEATURES_ORDER)
+        results = [None] * len(points)
+        all_features_image = self.build_features_image(columns)
+
+        for start in range(0, len(points), self.batch_chunk_size):
+            chunk = range(start, min(start + self.batch_chunk_size, len(points)))
+            collection = ee.FeatureCollection([
+                ee.Feature(ee.Geometry.Point(points[i][1], points[i][0]), {'point_idx': i})
+                for i in chunk
+            ])
+            reduced = all_features_image.reduceRegions(
+                collection=collection,
+                reducer=ee.Reducer.first(),
+                scale=self.scale
+            ).getInfo()
+
+            for feature in reduced.get('features', []):
+                props = feature.get('properties', {})
+                # Band bi mask (khong co du lieu) se khong xuat hien trong properties
+                results[int(props['point_idx'])] = {col: props.get(col) for col in columns}
+
+        # Diem khong duoc GEE tra ve (ngoai vung du lieu) -> toan bo la None
+        return [r if r is not None else {col: None for col in columns} for r in results]
+
+
+# =============================================================================
+# NGUON 2: LUOI RASTER CUC BO (MEMORY-MAPPED)
+# =============================================================================
+# Cau truc thu muc luoi cuc bo (tat ca cung 1 luoi lat/lon deu):
+#
+# grid.json            : {"lon_min", "lat_max", "resolution", "width", "height",
+#                         "start_date"}  (start_date = ngay cua lop daily thu 0)
+# elevation.npy ...    : cac lop tinh, shape (height, width)
+# precipitation.npy    : tong 'precipitation' IMERG theo ngay (cung don vi voi
+#                        phep sum() tren GEE), shape (days, height, width)
+# soil_moisture.npy    : soil_moisture_am SMAP theo ngay, NaN = khong co du lieu,
+#                        shape (days, height, width)
+#
+# Hang 0 la bien phia bac (lat_max), cot 0 la bien phia tay (lon_min).
+
+
+def save_local_grid(grid_dir, lon_min, lat_max, resolution, start_date, layers):
+    """Ghi mot luoi cuc bo ra dia (dung cho du lieu that hoac luoi tong hop de kiem thu).
+
+    Args:
+        grid_dir: thu muc dich.
+        lon_min, lat_max: toa do goc tren-trai cua luoi.
+        resolution: kich thuoc pixel (do).
+        start_date: ngay (YYYY-MM-DD) cua lop daily dau tien.
+        layers: dict ten lop -> numpy array (STATIC_LAYERS 2D, DAILY_LAYERS 3D).
+    """
+    os.makedirs(grid_dir, exist_ok=True)
+    height, width = np.asarray(layers['elevation']).shape
+
+    for name in STATIC_LAYERS + DAILY_LAYERS:
+        if name not in layers:
+            raise ValueError(f"Thieu lop '{name}' trong luoi cuc bo")
+        array = np.asarray(layers[name], dtype=np.float32)
+        if array.shape[-2:] != (height, width):
+            raise ValueError(f"Lop '{name}' co shape {array.shape}, can (..., {height}, {width})")
+        np.save(os.path.join(grid_dir, f"{name}.npy"), array)
+
+    meta = {
+        'lon_min': float(lon_min),
+        'lat_max': float(lat_max),
+        'resolution': float(resolution),
+        'width': int(width),
+        'height': int(height),
+        'start_date': str(start_date),
+    }
+    with open(os.path.join(grid_dir, 'grid.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+class StaleGridError(LookupError):
+    """Luoi cuc bo khong co du cac ngay cua cua so dac trung dong (luoi cu / qua ngan)."""
+
+
+class LocalRasterFeatureProvider(FeatureProvider):
+    """Doc dac trung tu cac luoi .npy memory-mapped; tra cuu diem bang chi so mang.
+
+    Khong goi mang, khong can GEE: phu hop cho production tai cho va chay API offline.
+    """
+
+    name = 'local'
+    cacheable = False
+
+    def __init__(self, grid_dir, reference_date=None):
+        """
+        Args:
+            grid_dir: thu muc chua grid.json va cac file .npy.
+            reference_date: ngay "hom nay" (datetime.date) de tinh cua so mua;
+                None = ngay UTC hien tai tai thoi diem truy van.
+        """
+        self.grid_dir = grid_dir
+        self.reference_date = reference_date
+
+        with open(os.path.join(grid_dir, 'grid.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.lon_min = meta['lon_min']
+        self.lat_max = meta['lat_max']
+        self.resolution = meta['resolution']
+        self.width = meta['width']
+        self.height = meta['height']
+        self.start_date = datetime.date.fromisoformat(meta['start_date'])
+
+        self.layers = {
+            name: np.load(os.path.join(grid_dir, f"{name}.npy"), mmap_mode='r')
+            for name in STATIC_LAYERS + DAILY_LAYERS
+        }
+
+    def _window(self, days):
+        """Tra ve (start, end) chi so ngay cho cua so `days` ngay ket thuc o end_date.
+
+        Giong ClimateCube.covers(): cua so phai nam tron trong cac ngay cua luoi,
+        neu khong raise StaleGridError (khong tra ve tong mot phan / 0 nhu mua kho).
+        """
+        today = self.reference_date or datetime.datetime.now(datetime.timezone.utc).date()
+        end_idx = (today - self.start_date).days - DYNAMIC_END_LAG_DAYS
+        n_days = self.layers['precipitation'].shape[0]
+        start = end_idx - days
+        if start < 0 or end_idx > n_days:
+            raise StaleGridError(
+                f"Luoi cuc bo co cac ngay [{self.start_date}, "
+                f"{self.start_date + datetime.timedelta(days=n_days)}) khong bao cua so "
+                f"[{self.start_date + datetime.timedelta(days=start)}, "
+                f"{self.start_date + datetime.timedelta(days=end_idx)}): can cap nhat luoi dac trung"
+            )
+        return start, end_idx
+
+    def check_coverage(self):
+        """Raise StaleGridError neu luoi khong du ngay cho moi cua so dac trung dong."""
+        for days in list(ANTECEDENT_WINDOWS.values()) + [SOIL_MOISTURE_WINDOW_DAYS]:
+            self._window(days)
+
+    def pixel_index(self, lats, lons):
+        """Chuyen lat/lon thanh (row, col, valid) cho luoi."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rows = np.floor((self.lat_max - lats) / self.resolution).astype(np.int64)
+        cols = np.floor((lons - self.lon_min) / self.resolution).astype(np.int64)
+        valid = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        return np.where(valid, rows, 0), np.where(valid, cols, 0), valid
+
+    def features_at_pixels(self, rows, cols):
+        """Tinh tat ca dac trung (dict ten -> array) cho cac pixel (rows, cols)."""
+        return self._features((rows, cols))
+
+    def features_in_window(self, row_start, row_stop, col_start, col_stop):
+        """Tinh tat ca dac trung (dict ten -> array 2D) cho 1 cua so chu nhat cua luoi.
+
+        Doc bang slice lien tuc tren memmap (nhanh hon nhieu so voi chi so tung pixel),
+        dung cho viec tinh ban do theo tung o (tile).
+        """
+        return self._features((slice(row_start, row_stop), slice(col_start, col_stop)))
+
+    def _features(self, index):
+        out = {name: np.asarray(self.layers[name][index], dtype=np.float64)
+               for name in STATIC_LAYERS}
+        flags = land_cover_flags(out['land_cover'])
+        for name, values in flags.items():
+            out[name] = values.astype(np.float64)
+
+        precip = self.layers['precipitation']
+        for name, days in ANTECEDENT_WINDOWS.items():
+            start, end = self._window(days)
+            out[name] = np.asarray(precip[(slice(start, end),) + index], dtype=np.float64).sum(axis=0)
+
+        start, end = self._window(SOIL_MOISTURE_WINDOW_DAYS)
+        sm = np.asarray(self.layers['soil_moisture'][(slice(start, end),) + index], dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            counts = np.sum(~np.isnan(sm), axis=0)
+            sm_mean = np.where(counts > 0, np.nansum(sm, axis=0) / np.maximum(counts, 1), 0.0)
+        out['soil_moisture'] = sm_mean
+
+        # Khong co du bao mua (giong nguon GEE)
+        out['precip_total'] = np.zeros_like(out['elevation'])
+        return out
+
+    def get_features(self, lat, lon, columns=None):
+        return self.get_features_batch([(lat, lon)], columns=columns)[0]
+
+    def get_features_batch(self, points, columns=None):
+        columns = list(columns or FEATURES_ORDER)
+        if not points:
+            return []
+        lats, lons = zip(*points)
+        rows, cols, valid = self.pixel_index(lats, lons)
+        values = self.features_at_pixels(rows, cols)
+
+        results = []
+        for i, ok in enumerate(valid):
+            if ok:
+                results.append({col: float(values[col][i]) for col in columns})
+            else:
+                results.append({col: None for col in columns})
+        return results
+
+
+# =============================================================================
+# NGUON 3: DAC TRUNG DONG TU CUBE MUA / DO AM CUC BO
+# =============================================================================
+class ClimateCubeFeatureProvider(FeatureProvider):
+    """Dac trung dong tu ClimateCube (src/climate_store.py), phan con lai tu nguon goc.
+
+    Khi cube da co du cac ngay cua cua so, truy van chi dong khong goi GEE.
+    Cube chua co / thieu ngay / diem nam ngoai cube -> dung nguon goc.
+    Cube duoc mo lai khi cube.json thay doi (job nap du lieu vua chay).
+    """
+
+    def __init__(self, base, cube_dir, reference_date=None):
+        self.base = base
+        self.cube_dir = cube_dir
+        self.reference_date = reference_date
+        self.name = f"{base.name}+cube"
+        self.cacheable = base.cacheable
+        self._cube = None
+        self._cube_mtime = None
+        self.local_points = 0
+        self.fallback_points = 0
+
+    def _load_cube(self):
+        meta_path = os.path.join(self.cube_dir, 'cube.json')
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            self._cube, self._cube_mtime = None, None
+            return None
+        if mtime != self._cube_mtime:
+            self._cube, self._cube_mtime = ClimateCube(self.cube_dir), mtime
+        return self._cube
+
+    def _end_date(self):
+        today = self.reference_date or datetime.datetime.now(datetime.timezone.utc).date()
+        return today - datetime.timedelta(days=DYNAMIC_END_LAG_DAYS)
+
+    def get_features(self, lat, lon, columns=None):
+        return self.get_features_batch([(lat, lon)], columns=columns)[0]
+
+    def get_features_batch(self, points, columns=None):
+        columns = list(columns or FEATURES_ORDER)
+        dynamic = [col for col in columns if col in DYNAMIC_FEATURES]
+        cube = self._load_cube() if dynamic and points else None
+        end_date = self._end_date()
+        first_date = end_date - datetime.timedelta(
+            days=max(MAX_ANTECEDENT_DAYS, SOIL_MOISTURE_WINDOW_DAYS)
+        )
+        if cube is None or not cube.covers(first_date, end_date):
+            self.fallback_points += len(points)
+            return self.base.get_features_batch(points, columns=columns)
+
+        lats, lons = zip(*points)
+        rows, cols, valid = cube.pixel_index(lats, lons)
+        values = cube.dynamic_features(rows, cols, end_date)
+
+        # Diem trong cube: chi lay phan tinh tu nguon goc; ngoai cube: lay tat ca
+        rest = [col for col in columns if col not in dynamic]
+        inside = [i for i, ok in enumerate(valid) if ok]
+        outside = [i for i, ok in enumerate(valid) if not ok]
+        results = [None] * len(points)
+        if inside:
+            base_rows = (self.base.get_features_batch([points[i] for i in inside], columns=rest)
+                         if rest else [{} for _ in inside])
+            for i, data_dict in zip(inside, base_rows):
+                row = {col: float(values[col][i]) for col in dynamic}
+                row.update({col: data_dict.get(col) for col in rest})
+                results[i] = {col: row[col] for col in columns}
+        if outside:
+            base_rows = self.base.get_features_batch([points[i] for i in outside], columns=columns)
+            for i, data_dict in zip(outside, base_rows):
+                results[i] = data_dict
+        self.local_points += len(inside)
+        self.fallback_points += len(outside)
+        return results
+
+    def stats(self):
+        cube = self._cube
+        return {
+            'cube_dir': self.cube_dir,
+            'days': [cube.start_date.isoformat(), cube.end_date.isoformat()] if cube else None,
+            'local_points': self.local_points,
+            'fallback_points': self.fallback_points,
+        }
+
+
+def create_feature_provider(kind, grid_dir=None, scale=90, batch_chunk_size=500, cube_dir=None):
+    """Tao FeatureProvider theo ten ('gee' hoac 'local').
+
+    Voi 'gee', neu co `cube_dir` thi dac trung dong lay tu cube cuc bo khi co the.
+    """
+    if kind == 'gee':
+        provider = GEEFeatureProvider(scale=scale, batch_chunk_size=batch_chunk_size)
+        if cube_dir:
+            provider = ClimateCubeFeatureProvider(provider, cube_dir)
+        return provider
+    if kind == 'local':
+        if not grid_dir:
+            raise ValueError("Can 'grid_dir' cho nguon dac trung 'local'")
+        return LocalRasterFeatureProvider(grid_dir)
+    raise ValueError(f"Nguon dac trung khong hop le: {kind}")
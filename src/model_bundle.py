@@ -0,0 +1,344 @@
+"""Dinh dang goi model (model bundle): model, scaler, dac trung va manifest.
+
+Thay cho viec pickle ca XGBClassifier bang joblib (cham, phu thuoc dung
+phien ban xgboost/sklearn, kho kiem tra), model duoc luu thanh 1 thu muc:
+
+flood_model_bundle/
+├── manifest.json       : phien ban dinh dang, FEATURES_ORDER, best_iteration,
+│                         phien ban thu vien, metadata huan luyen, sha256 tung file
+├── build.json          : thoi diem tao (tach khoi manifest de noi dung goi
+│                         khong doi khi luu lai cung 1 model)
+├── booster.ubj         : booster XGBoost goc (UBJSON, doc duoc o moi phien ban moi hon)
+├── scaler.json         : mean / scale cua StandardScaler
+└── compiled/           : CompiledTreeModel (scaler da gop vao nguong), cac file .npy
+
+API chi can manifest + compiled/ (memory-mapped): khong import xgboost hay
+sklearn, khong unpickle. booster.ubj dung khi can XGBoost that (SHAP, huan
+luyen tiep) va chi duoc doc khi truy cap.
+"""
+import os
+import json
+import hashlib
+import datetime
+import threading
+from importlib import metadata as importlib_metadata
+
+import numpy as np
+
+from tree_inference import CompiledTreeModel
+
+# =============================================================================
+# DINH DANG GOI MODEL (MODEL BUNDLE)
+# =============================================================================
+BUNDLE_FORMAT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+BUILD_FILE = 'build.json'
+BOOSTER_FILE = 'booster.ubj'
+SCALER_FILE = 'scaler.json'
+COMPILED_DIR = 'compiled'
+
+# Tu so dong nay tro len, booster XGBoost (da luong, C++) nhanh hon CompiledTreeModel;
+# lo nho hon (vd. 1 diem) thi CompiledTreeModel nhanh hon vi khong ton chi phi goi
+# ham. Do lai bang `python src/tree_inference.py`.
+BOOSTER_MIN_ROWS = 32
+
+# Thu vien can de doc goi: booster.ubj (xgboost) va compiled/*.npy (numpy).
+# scikit-learn chi dung khi huan luyen (scaler da luu thanh JSON) nen khong kiem tra.
+CHECKED_LIBRARIES = ('xgboost', 'numpy')
+
+
+class BundleError(Exception):
+    """Goi model khong ton tai, hong, hoac khong tuong thich."""
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _bundle_files(bundle_dir):
+    """Liet ke cac file trong goi (duong dan tuong doi), tru manifest va build.json."""
+    files = []
+    for root, _, names in os.walk(bundle_dir):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), bundle_dir).replace(os.sep, '/')
+            if rel not in (MANIFEST_FILE, BUILD_FILE):
+                files.append(rel)
+    return sorted(files)
+
+
+def library_mismatches(manifest):
+    """Cac thu vien khac phien ban CHINH (major) so voi luc tao goi.
+
+    Returns:
+        list (ten, phien ban trong manifest, phien ban dang cai); thu vien
+        chua cai hoac khong ghi trong manifest thi bo qua.
+    """
+    mismatches = []
+    for name in CHECKED_LIBRARIES:
+        built = manifest.get('libraries', {}).get(name)
+        try:
+            installed = importlib_metadata.version(name)
+        except importlib_metadata.PackageNotFoundError:
+            continue
+        if built and built.split('.')[0] != installed.split('.')[0]:
+            mismatches.append((name, built, installed))
+    return mismatches
+
+
+def _json_safe(value):
+    """Chuyen gia tri ve kieu JSON chuan: NaN / inf -> None, so numpy -> so Python,
+    kieu khac (vd. ham, class) -> chuoi. Manifest phai doc duoc bang moi trinh doc JSON."""
+    if isinstance(value, dict):
+        return {str(key): _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return value if np.isfinite(value) else None
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    return str(value)
+
+
+def save_model_bundle(bundle_dir, model, scaler, features, metadata=None):
+    """Luu XGBClassifier + StandardScaler thanh goi model.
+
+    Args:
+        bundle_dir: thu muc dich (ghi de neu da co).
+        model: XGBClassifier da huan luyen.
+        scaler: StandardScaler da fit tren `features`.
+        features: danh sach ten dac trung theo dung thu tu model da hoc.
+        metadata: dict thong tin huan luyen (tham so, diem danh gia, ...).
+    """
+    import xgboost
+    import sklearn
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    booster = model.get_booster()
+    best_iteration = getattr(model, 'best_iteration', None)
+
+    # 1. Booster goc (UBJSON)
+    booster.save_model(os.path.join(bundle_dir, BOOSTER_FILE))
+
+    # 2. Tham so scaler
+    scaler_params = {
+        'mean': np.asarray(scaler.mean_, dtype=np.float64).tolist(),
+        'scale': np.asarray(scaler.scale_, dtype=np.float64).tolist(),
+    }
+    with open(os.path.join(bundle_dir, SCALER_FILE), 'w', encoding='utf-8') as f:
+        json.dump(scaler_params, f, indent=2)
+
+    # 3. Model da bien dich cho suy luan nhanh
+    compiled = CompiledTreeModel.from_xgb_model(model, scaler)
+    compiled.save(os.path.join(bundle_dir, COMPILED_DIR))
+
+    # 4. Manifest
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'features': list(features),
+        'n_features': len(features),
+        'objective': 'binary:logistic',
+        'best_iteration': None if best_iteration is None else int(best_iteration),
+        'n_trees': compiled.n_trees,
+        'libraries': {
+            'xgboost': xgboost.__version__,
+            'scikit-learn': sklearn.__version__,
+            'numpy': np.__version__,
+        },
+        'metadata': _json_safe(metadata or {}),
+        'files': {
+            rel: _sha256(os.path.join(bundle_dir, rel)) for rel in _bundle_files(bundle_dir)
+        },
+    }
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False, allow_nan=False)
+    with open(os.path.join(bundle_dir, BUILD_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat()}, f, indent=2)
+
+    return manifest
+
+
+class ModelBundle:
+    """Goi model da doc; cac thanh phan nang (booster) chi duoc doc khi can."""
+
+    def __init__(self, bundle_dir, manifest, mmap_mode='r'):
+        self.bundle_dir = bundle_dir
+        self.manifest = manifest
+        self.mmap_mode = mmap_mode
+        self._inference_model = None
+        self._booster = None
+        self._booster_lock = threading.Lock()
+        self._has_xgboost = None
+        self._scaler_params = None
+
+    @property
+    def features(self):
+        return self.manifest['features']
+
+    @property
+    def metadata(self):
+        return self.manifest.get('metadata', {})
+
+    @property
+    def created_at(self):
+        """Thoi diem tao goi (ISO 8601), None neu khong co."""
+        path = os.path.join(self.bundle_dir, BUILD_FILE)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f).get('created_at')
+        # Goi cu: created_at nam trong manifest
+        return self.manifest.get('created_at')
+
+    @property
+    def inference_model(self):
+        """CompiledTreeModel (memory-mapped), dung cho du doan."""
+        if self._inference_model is None:
+            self._inference_model = CompiledTreeModel.load(
+                os.path.join(self.bundle_dir, COMPILED_DIR), mmap_mode=self.mmap_mode
+            )
+            if self._inference_model.n_features != len(self.features):
+                raise BundleError(
+                    f"compiled/ co {self._inference_model.n_features} dac trung, "
+                    f"manifest co {len(self.features)}"
+                )
+        return self._inference_model
+
+    @property
+    def scaler_params(self):
+        """dict {'mean': [...], 'scale': [...]} cua StandardScaler."""
+        if self._scaler_params is None:
+            with open(os.path.join(self.bundle_dir, SCALER_FILE), encoding='utf-8') as f:
+                self._scaler_params = json.load(f)
+        return self._scaler_params
+
+    @property
+    def booster(self):
+        """xgboost.Booster goc (chi import xgboost khi truy cap)."""
+        with self._booster_lock:
+            if self._booster is None:
+                import xgboost
+                booster = xgboost.Booster()
+                booster.load_model(os.path.join(self.bundle_dir, BOOSTER_FILE))
+                self._booster = booster
+        return self._booster
+
+    @property
+    def has_xgboost(self):
+        """True neu import duoc xgboost (dung duoc booster goc)."""
+        if self._has_xgboost is None:
+            try:
+                import xgboost  # noqa: F401
+                self._has_xgboost = True
+            except ImportError:
+                self._has_xgboost = False
+        return self._has_xgboost
+
+    def transform(self, X):
+        """Chuan hoa X nhu StandardScaler.transform (dung cho booster goc)."""
+        params = self.scaler_params
+        return (np.asarray(X, dtype=np.float64) - np.asarray(params['mean'])) / np.asarray(params['scale'])
+
+    def predict_proba_booster(self, X):
+        """Xac suat lop 1 bang booster XGBoost goc (X la dac trung GOC, chua chuan hoa).
+
+        Nhanh hon CompiledTreeModel voi lo rat lon (vd. tinh ban do), nhung can xgboost.
+        """
+        return self.booster.inplace_predict(
+            self.transform(X), iteration_range=(0, self.manifest['n_trees'])
+        )
+
+    def predict_proba(self, X, booster_min_rows=BOOSTER_MIN_ROWS):
+        """Xac suat lop 1 (X la dac trung GOC), chon bo suy luan theo kich thuoc lo.
+
+        Lo < `booster_min_rows` dong (hoac khong co xgboost): CompiledTreeModel;
+        lo lon hon: booster XGBoost. Hai ket qua lech nhau < 1e-5.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) >= booster_min_rows and self.has_xgboost:
+            return self.predict_proba_booster(X)
+        return self.inference_model.predict_proba(X)
+
+
+def load_model_bundle(bundle_dir, expected_features=None, verify=True, mmap_mode='r'):
+    """Doc goi model va kiem tra tinh tuong thich.
+
+    Args:
+        bundle_dir: thu muc goi model.
+        expected_features: neu co, phai trung khop (ca thu tu) voi manifest.
+        verify: kiem tra sha256 cua tung file so voi manifest (doc toan bo goi).
+            False: chi kiem tra cac file co ton tai - dung khi goi da duoc kiem tra
+            luc tao (API khoi dong nhanh, khong hash lai moi lan).
+        mmap_mode: che do memory-map cho cac mang cua compiled/ (None = doc het vao RAM).
+
+    Raises:
+        BundleError: neu goi khong ton tai, hong hoac khong tuong thich.
+    """
+    manifest_path = os.path.join(bundle_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise BundleError(f"Khong tim thay {manifest_path}")
+
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    version = manifest.get('format_version')
+    if version != BUNDLE_FORMAT_VERSION:
+        raise BundleError(
+            f"Phien ban dinh dang goi model {version} khong duoc ho tro (can {BUNDLE_FORMAT_VERSION})"
+        )
+
+    if expected_features is not None and list(expected_features) != manifest['features']:
+        raise BundleError(
+            f"Dac trung khong khop.\n- Can: {list(expected_features)}\n- Goi model: {manifest['features']}"
+        )
+
+    for rel, checksum in manifest.get('files', {}).items():
+        path = os.path.join(bundle_dir, rel)
+        if not os.path.exists(path):
+            raise BundleError(f"Thieu file {rel} trong goi model")
+        if verify and _sha256(path) != checksum:
+            raise BundleError(f"File {rel} bi thay doi (sha256 khong khop manifest)")
+
+    for name, built, installed in library_mismatches(manifest):
+        print(f"CANH BAO: goi model tao voi {name} {built}, dang cai {installed} "
+              f"(khac phien ban chinh) - nen tao lai goi model.")
+
+    return ModelBundle(bundle_dir, manifest, mmap_mode=mmap_mode)
+
+
+# =============================================================================
+# CHUYEN MODEL CU (JOBLIB) SANG GOI MODEL
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models'))
+LEGACY_MODEL_PATH = os.path.join(MODEL_DIR, 'flood_model.xgb')
+LEGACY_SCALER_PATH = os.path.join(MODEL_DIR, 'scaler.joblib')
+BUNDLE_DIR = os.path.join(MODEL_DIR, 'flood_model_bundle')
+
+
+def main():
+    """Chuyen flood_model.xgb + scaler.joblib (pickle) thanh goi model."""
+    import joblib
+
+    print(f"Dang doc model cu: {LEGACY_MODEL_PATH}")
+    model = joblib.load(LEGACY_MODEL_PATH)
+    scaler = joblib.load(LEGACY_SCALER_PATH)
+    features = [str(name) for name in scaler.feature_names_in_]
+
+    manifest = save_model_bundle(
+        BUNDLE_DIR, model, scaler, features,
+        metadata={'source': 'converted from joblib pickle', 'params': model.get_params()}
+    )
+    bundle = load_model_bundle(BUNDLE_DIR, expected_features=features)
+    print(f"Da luu goi model vao: {BUNDLE_DIR}")
+    print(f"- {manifest['n_trees']} cay, {len(bundle.features)} dac trung, "
+          f"best_iteration={manifest['best_iteration']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""Chay pipeline theo noi dung: chi chay lai buoc co dau vao thay doi.
+
+Moi buoc khai bao lenh chay, ma nguon lien quan, tham so, dau vao va dau ra.
+Khoa cua buoc = sha256(ten buoc, ma nguon, tham so, noi dung dau vao), trong
+do ma nguon co the la ca file hoac chi mot so ham / hang so trong file (doc
+bang ast, khong import). Dau vao cua buoc sau la dau ra cua buoc truoc, nen
+thay doi lan truyen theo noi dung: sua ham ve SHAP chi doi khoa buoc 'shap',
+con huan luyen lai ra dung goi model cu thi cac buoc sau van duoc bo qua.
+
+Buoc co cache=True duoc sao luu dau ra theo khoa vao data/cache/pipeline/,
+nen quay lai tham so / ma nguon cu chi can chep lai ket qua, khong chay lai.
+
+Cach dung (tu thu muc goc):
+    python -m src.pipeline                 # chay moi buoc da cu
+    python -m src.pipeline shap --dry-run  # xem buoc nao se chay de co 'shap'
+    python -m src.pipeline --force tune    # chay lai 'tune' du khoa khong doi
+"""
+import os
+import sys
+import ast
+import json
+import shutil
+import hashlib
+import argparse
+import datetime
+import subprocess
+
+# =============================================================================
+# CHAY PIPELINE THEO NOI DUNG (CHI CHAY LAI BUOC CO DAU VAO THAY DOI)
+# =============================================================================
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(SRC_DIR, '..'))
+
+# Duong dan (trung voi hang so trong prepare_data / dataset / train_model)
+RAW_EXPORT_DIR = os.path.join(ROOT_DIR, 'data', 'raw_exports')
+DATASET_DIR = os.path.join(ROOT_DIR, 'data', 'processed', 'combined_data')
+MANIFEST_PATH = os.path.join(ROOT_DIR, 'data', 'processed', 'combined_data_manifest.json')
+BUNDLE_DIR = os.path.join(ROOT_DIR, 'models', 'flood_model_bundle')
+BEST_PARAMS_PATH = os.path.join(ROOT_DIR, 'outputs', 'best_params.json')
+REPORT_PATH = os.path.join(ROOT_DIR, 'outputs', 'model_evaluation_report.txt')
+SHAP_PLOT_PATH = os.path.join(ROOT_DIR, 'outputs', 'shap_summary_plot.png')
+# File thay doi moi lan luu du noi dung khong doi (model_bundle.BUILD_FILE: thoi
+# diem tao goi) -> khong bam, de huan luyen lai ra cung model thi 'shap' duoc bo qua
+VOLATILE_PATHS = [os.path.join(BUNDLE_DIR, 'build.json')]
+
+PIPELINE_CACHE_DIR = os.path.join(ROOT_DIR, 'data', 'cache', 'pipeline')
+STATE_PATH = os.path.join(PIPELINE_CACHE_DIR, 'state.json')
+OBJECTS_DIR = os.path.join(PIPELINE_CACHE_DIR, 'objects')
+# Dau ra cu duoc doi ten tam thoi trong luc buoc dang chay
+PREVIOUS_SUFFIX = '.pipeline-prev'
+
+# Tang khi doi cach tinh khoa -> moi buoc deu cu
+KEY_VERSION = 1
+
+# Ham / hang so dung chung cua train_model.py (doc du lieu + chuan hoa)
+TRAIN_DATA_CODE = [
+    'STATIC_FEATURES', 'DYNAMIC_FEATURES', 'FEATURES', 'TARGET',
+    'load_splits', 'scale_splits',
+]
+
+
+class Stage:
+    """1 buoc cua pipeline.
+
+    Args:
+        name: ten buoc.
+        script: file trong src/ duoc chay bang python hien tai.
+        args: tham so dong lenh (la 1 phan cua khoa).
+        code: list file trong src/, hoac (file, [ten ham / hang so]) de chi bam cac
+            dinh nghia do.
+        inputs / outputs: list duong dan file hoac thu muc.
+        cache: sao luu dau ra theo khoa (chi nen dung cho dau ra nho).
+        adopt: lan dau (chua co trang thai) ma dau ra da ton tai thi nhan luon,
+            khong chay (dung cho buoc ton nhieu gio goi GEE).
+        stale_args: tham so them khi chay lai vi khoa thay doi.
+        incremental: lenh tu cap nhat dau ra cu (chi xu ly phan thay doi), nen dau
+            ra cu khong bi doi ten tam thoi truoc khi chay.
+    """
+
+    def __init__(self, name, script, args=(), code=(), inputs=(), outputs=(),
+                 cache=True, adopt=False, stale_args=(), incremental=False):
+        self.name = name
+        self.script = script
+        self.args = list(args)
+        self.code = list(code)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cache = cache
+        self.adopt = adopt
+        self.stale_args = list(stale_args)
+        self.incremental = incremental
+
+
+STAGES = [
+    Stage(
+        'export', 'prepare_data.py', args=['--direct'],
+        code=['prepare_data.py', 'rainfall.py', 'direct_export.py'],
+        outputs=[RAW_EXPORT_DIR],
+        cache=False, adopt=True, stale_args=['--fresh'], incremental=True,
+    ),
+    Stage(
+        'combine', 'combine_data.py',
+        code=['combine_data.py', 'dataset.py'],
+        inputs=[RAW_EXPORT_DIR],
+        outputs=[DATASET_DIR, MANIFEST_PATH],
+        cache=False, incremental=True,
+    ),
+    Stage(
+        'tune', 'train_model.py', args=['--stage', 'tune'],
+        code=['tuning.py', 'dataset.py',
+              ('train_model.py', TRAIN_DATA_CODE + ['N_TRIALS', 'WARM_START_TRIALS', 'run_tuning'])],
+        inputs=[DATASET_DIR],
+        outputs=[BEST_PARAMS_PATH],
+    ),
+    Stage(
+        'train', 'train_model.py', args=['--stage', 'train'],
+        code=['dataset.py', 'model_bundle.py', 'tree_inference.py',
+              ('train_model.py', TRAIN_DATA_CODE + ['load_best_params', 'fit_final_model',
+                                                    'evaluate_and_save', 'save_report'])],
+        inputs=[DATASET_DIR, BEST_PARAMS_PATH],
+        outputs=[BUNDLE_DIR, REPORT_PATH],
+    ),
+    Stage(
+        'shap', 'train_model.py', args=['--stage', 'shap'],
+        code=['dataset.py', 'model_bundle.py', 'explain.py',
+              ('train_model.py', TRAIN_DATA_CODE + ['SHAP_SAMPLES', 'explain_model', 'plot_shap_summary'])],
+        inputs=[DATASET_DIR, BUNDLE_DIR],
+        outputs=[SHAP_PLOT_PATH],
+    ),
+]
+
+
+# =============================================================================
+# BAM NOI DUNG
+# =============================================================================
+class Hasher:
+    """sha256 cua file / thu muc; nho theo (kich thuoc, mtime) de khong doc lai file lon.
+
+    Cac file trong `ignore` (trong thu muc duoc bam) bi bo qua.
+    """
+
+    def __init__(self, known=None, ignore=()):
+        self.known = known or {}
+        self.ignore = {os.path.abspath(path) for path in ignore}
+
+    def file(self, path):
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        cached = self.known.get(path)
+        if cached and cached['stamp'] == stamp:
+            return cached['sha256']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.known[path] = {'stamp': stamp, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def path(self, path):
+        """Noi dung file, hoac moi file trong thu muc (theo duong dan tuong doi). None neu khong co."""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                if os.path.abspath(full) in self.ignore:
+                    continue
+                rel = os.path.relpath(full, path).replace(os.sep, '/')
+                digest.update(f"{rel}\0{self.file(full)}\n".encode())
+        return digest.hexdigest()
+
+
+def definition_sources(path, names):
+    """Ma nguon cua cac ham / lop / hang so cap module `names` trong file `path`."""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    found = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            targets = [node.name]
+        elif isinstance(node, ast.Assign):
+            targets = [t.id for t in node.targets if isinstance(t, ast.Name)]
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            targets = [node.target.id]
+        else:
+            continue
+        for name in targets:
+            if name in names:
+                found[name] = ast.get_source_segment(source, node)
+    missing = sorted(set(names) - set(found))
+    if missing:
+        raise ValueError(f"Khong tim thay {', '.join(missing)} trong {path}")
+    return [found[name] for name in names]
+
+
+def code_digest(code):
+    digest = hashlib.sha256()
+    for entry in code:
+        if isinstance(entry, str):
+            with open(os.path.join(SRC_DIR, entry), 'rb') as f:
+                digest.update(entry.encode() + b'\0' + f.read())
+        else:
+            filename, names = entry
+            for name, segment in zip(names, definition_sources(os.path.join(SRC_DIR, filename), names)):
+                digest.update(f"{filename}:{name}\0{segment}\n".encode())
+    return digest.hexdigest()
+
+
+def stage_key(stage, hasher):
+    """Khoa cua buoc, hoac None neu co dau vao chua ton tai."""
+    inputs = {}
+    for path in stage.inputs:
+        inputs[os.path.relpath(path, ROOT_DIR)] = hasher.path(path)
+        if inputs[os.path.relpath(path, ROOT_DIR)] is None:
+            return None
+    payload = {
+        'key_version': KEY_VERSION,
+        'stage': stage.name,
+        'script': stage.script,
+        'args': stage.args,
+        'code': code_digest(stage.code),
+        'inputs': inputs,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def outputs_digest(stage, hasher):
+    """Noi dung dau ra hien tai (None neu thieu dau ra nao)."""
+    digests = [hasher.path(path) for path in stage.outputs]
+    if any(d is None for d in digests):
+        return None
+    return hashlib.sha256('\n'.join(digests).encode()).hexdigest()
+
+
+# =============================================================================
+# TRANG THAI VA CACHE DAU RA
+# =============================================================================
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return {'stages': {}, 'files': {}}
+    with open(STATE_PATH, encoding='utf-8') as f:
+        state = json.load(f)
+    state.setdefault('stages', {})
+    state.setdefault('files', {})
+    return state
+
+
+def save_state(state):
+    os.makedirs(PIPELINE_CACHE_DIR, exist_ok=True)
+    tmp_path = STATE_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def _object_dir(stage, key):
+    return os.path.join(OBJECTS_DIR, stage.name, key)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _copy(src, dst):
+    _remove(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def store_outputs(stage, key):
+    """Sao luu dau ra vao data/cache/pipeline/objects/<buoc>/<khoa>/<i>."""
+    obj_dir = _object_dir(stage, key)
+    tmp_dir = obj_dir + '.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    for i, path in enumerate(stage.outputs):
+        _copy(path, os.path.join(tmp_dir, str(i)))
+    if os.path.isdir(obj_dir):
+        shutil.rmtree(obj_dir)
+    os.replace(tmp_dir, obj_dir)
+
+
+def restore_outputs(stage, key):
+    """Chep lai dau ra da luu theo khoa. Tra ve False neu chua co."""
+    obj_dir = _object_dir(stage, key)
+    if not stage.cache or not os.path.isdir(obj_dir):
+        return False
+    for i, path in enumerate(stage.outputs):
+        _copy(os.path.join(obj_dir, str(i)), path)
+    return True
+
+
+# =============================================================================
+# CHAY PIPELINE
+# =============================================================================
+def stages_for(targets):
+    """Cac buoc can thiet de co `targets` (kem moi buoc phia truoc), theo thu tu."""
+    if not targets:
+        return list(STAGES)
+    last = max(i for i, stage in enumerate(STAGES) if stage.name in targets)
+    return STAGES[:last + 1]
+
+
+def run_stage(stage, extra_args):
+    """Chay lenh cua buoc; that bai neu ma thoat khac 0 hoac thieu dau ra.
+
+    Dau ra cu (buoc khong incremental) duoc doi ten truoc khi chay, de dau ra cu
+    khong bi ghi nhan nham la ket qua moi; lenh that bai thi dau ra cu duoc tra lai.
+    """
+    aside = [] if stage.incremental else [path for path in stage.outputs if os.path.exists(path)]
+    for path in aside:
+        _remove(path + PREVIOUS_SUFFIX)
+        os.replace(path, path + PREVIOUS_SUFFIX)
+
+    cmd = [sys.executable, stage.script] + stage.args + extra_args
+    print(f"\n>>> [{stage.name}] {' '.join(cmd[1:])}")
+    try:
+        subprocess.run(cmd, cwd=SRC_DIR, check=True)
+        missing = [path for path in stage.outputs if not os.path.exists(path)]
+        if missing:
+            raise RuntimeError(f"[{stage.name}] Chay xong nhung thieu dau ra: {missing}")
+    except BaseException:
+        for path in aside:
+            _remove(path)
+            os.replace(path + PREVIOUS_SUFFIX, path)
+        raise
+    for path in aside:
+        _remove(path + PREVIOUS_SUFFIX)
+
+
+def run_pipeline(targets=None, force=(), dry_run=False):
+    """Chay cac buoc da cu. Tra ve dict ten buoc -> ket qua."""
+    state = load_state()
+    hasher = Hasher(state['files'], ignore=VOLATILE_PATHS)
+    results = {}
+    changed = set()  # dau ra se thay doi (chi dung khi dry_run)
+
+    for stage in stages_for(targets):
+        key = stage_key(stage, hasher)
+        record = state['stages'].get(stage.name)
+        current = outputs_digest(stage, hasher)
+
+        if dry_run and any(path in changed for path in stage.inputs):
+            # Chua biet noi dung dau ra moi cua buoc truoc -> khong tinh duoc khoa
+            results[stage.name] = 'CHO BUOC TRUOC'
+            changed.update(stage.outputs)
+            continue
+        if key is None:
+            raise RuntimeError(f"[{stage.name}] Thieu dau vao: {stage.inputs}")
+
+        up_to_date = (
+            stage.name not in force
+            and record is not None and record['key'] == key
+            and current is not None and record['outputs'] == current
+        )
+        if up_to_date:
+            results[stage.name] = 'DA MOI NHAT'
+            continue
+        if stage.name not in force and record is None and stage.adopt and current is not None:
+            # Dau ra co san tu truoc khi dung pipeline -> nhan, khong goi lai GEE
+            results[stage.name] = 'NHAN DAU RA CO SAN'
+        elif stage.name not in force and stage.cache and os.path.isdir(_object_dir(stage, key)):
+            results[stage.name] = 'LAY TU CACHE'
+            if not dry_run:
+                restore_outputs(stage, key)
+        else:
+            results[stage.name] = 'CHAY'
+            if not dry_run:
+                extra = stage.stale_args if record is not None and record['key'] != key else []
+                run_stage(stage, extra)
+
+        if dry_run:
+            if results[stage.name] != 'NHAN DAU RA CO SAN':
+                changed.update(stage.outputs)
+            continue
+
+        current = outputs_digest(stage, hasher)
+        if current is None:
+            raise RuntimeError(f"[{stage.name}] Chay xong nhung thieu dau ra: {stage.outputs}")
+        if stage.cache and results[stage.name] == 'CHAY':
+            store_outputs(stage, key)
+        state['stages'][stage.name] = {
+            'key': key,
+            'outputs': current,
+            'updated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        save_state(state)
+
+    if not dry_run:
+        # Bo nho dem bam cua file da bi xoa
+        state['files'] = {path: entry for path, entry in hasher.known.items() if os.path.exists(path)}
+        save_state(state)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chay pipeline du lieu -> mo hinh, bo qua buoc khong thay doi.")
+    names = [stage.name for stage in STAGES]
+    parser.add_argument('targets', nargs='*', metavar='STAGE',
+                        help=f"Buoc can co ket qua ({', '.join(names)}; mac dinh: tat ca)")
+    parser.add_argument('--force', nargs='+', choices=names, default=[],
+                        help="Chay lai cac buoc nay du khoa khong doi")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Chi in buoc nao se chay / lay tu cache")
+    args = parser.parse_args()
+    unknown = sorted(set(args.targets) - set(names))
+    if unknown:
+        parser.error(f"Buoc khong ton tai: {', '.join(unknown)}")
+    return args
+
+
+def main():
+    args = parse_args()
+    try:
+        results = run_pipeline(args.targets, force=set(args.force), dry_run=args.dry_run)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"\nLoi: {e}")
+        sys.exit(1)
+
+    print(f"\n==================================================================")
+    print(f"{'DU KIEN' if args.dry_run else 'HOAN TAT'} PIPELINE:")
+    for name, result in results.items():
+        print(f"- {name}: {result}")
+    print(f"==================================================================")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""Ban do nguy co ngap (xac suat) tren luoi dac trung local, tinh theo tung o.
+
+outputs/risk_raster/
+├── raster.json       : georeference, kich thuoc o, ngay tham chieu, model, overviews
+│                       (chi ghi khi ban do da xong -> API khong doc raster dang tinh do)
+├── run.json          : tham so lan chay dang do, dung de tiep tuc
+├── risk.npy          : raster uint8 do phan giai goc, thu tu hang (memmap, moi o ghi doc lap)
+├── tiles_done.npy    : co hoan thanh tung o -> chay lai chi tinh cac o con thieu
+└── overview_2.npy, overview_4.npy, ... : cac muc thu nho 2x (trung binh pixel hop le)
+
+Moi worker mo model (memory-mapped) va luoi dac trung 1 lan, tinh 1 o,
+ghi thang vao risk.npy roi bao ve; tien trinh chinh danh dau o da xong.
+Bo nho toi da ~ so worker x 1 o, khong phu thuoc kich thuoc ban do.
+
+risk.npy giu thu tu hang (khong chia khoi tren dia): overviews va GeoTIFF
+doc theo dai hang, API cat o bang chi so numpy. Ban chia khoi that (GeoTIFF
+tiled 256x256 + overviews) xuat bang --geotiff.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from model_bundle import load_model_bundle
+from feature_provider import FEATURES_ORDER, LocalRasterFeatureProvider, StaleGridError
+
+# =============================================================================
+# ĐỊNH NGHĨA ĐƯỜNG DẪN VÀ THAM SỐ
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models'))
+BUNDLE_DIR = os.path.join(MODEL_DIR, 'flood_model_bundle')
+GRID_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'feature_grids'))
+OUTPUT_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'outputs', 'risk_raster'))
+
+# Kich thuoc o (pixel): 512x512 x 14 dac trung float64 ~ 29 MB moi worker
+TILE_SIZE = 512
+# Xac suat luu dang uint8: gia tri = round(p * 254), 255 = khong co du lieu
+PROBABILITY_SCALE = 254
+NODATA = 255
+
+
+# =============================================================================
+# WORKER
+# =============================================================================
+_worker = {}
+
+
+def _init_worker(grid_dir, bundle_dir, reference_date, raster_path, offset, engine):
+    _worker['provider'] = LocalRasterFeatureProvider(grid_dir, reference_date=reference_date)
+    bundle = load_model_bundle(bundle_dir, expected_features=FEATURES_ORDER, verify=False)
+    if engine == 'xgboost':
+        # Moi worker 1 luong: song song hoa da nam o muc tien trinh
+        bundle.booster.set_param({'nthread': 1})
+        _worker['predict'] = bundle.predict_proba_booster
+    else:
+        _worker['predict'] = bundle.inference_model.predict_proba
+    _worker['raster'] = np.load(raster_path, mmap_mode='r+')
+    # Goc (row, col) cua raster ket qua tren luoi dac trung (bbox co the nho hon luoi)
+    _worker['offset'] = offset
+
+
+def score_window(provider, predict, row_start, row_stop, col_start, col_stop):
+    """Tinh raster xac suat uint8 cho 1 cua so cua luoi dac trung.
+
+    `predict` nhan ma tran dac trung GOC (n, 14) va tra ve xac suat lop 1.
+    """
+    features = provider.features_in_window(row_start, row_stop, col_start, col_stop)
+    shape = features['elevation'].shape
+    X = np.stack([features[name].ravel() for name in FEATURES_ORDER], axis=1)
+
+    # Pixel khong co du lieu tinh (ngoai bien, tren bien) -> NODATA
+    valid = np.isfinite(X[:, :5]).all(axis=1)
+    out = np.full(len(X), NODATA, dtype=np.uint8)
+    if valid.any():
+        X_valid = np.nan_to_num(X[valid], nan=0.0)
+        probabilities = predict(X_valid)
+        out[valid] = np.round(probabilities * PROBABILITY_SCALE).astype(np.uint8)
+    return out.reshape(shape)
+
+
+def _run_tile(tile):
+    tile_row, tile_col, row_start, row_stop, col_start, col_stop = tile
+    window = score_window(
+        _worker['provider'], _worker['predict'], row_start, row_stop, col_start, col_stop
+    )
+    raster = _worker['raster']
+    row_offset, col_offset = _worker['offset']
+    raster[row_start - row_offset:row_stop - row_offset,
+           col_start - col_offset:col_stop - col_offset] = window
+    raster.flush()
+    return tile_row, tile_col
+
+
+# =============================================================================
+# CHIA O VA KHOI PHUC
+# =============================================================================
+def window_for_bbox(provider, bbox):
+    """Chuyen bbox (lon_min, lat_min, lon_max, lat_max) thanh cua so pixel cua luoi."""
+    if bbox is None:
+        return 0, provider.height, 0, provider.width
+    lon_min, lat_min, lon_max, lat_max = bbox
+    row_start = max(int(np.floor((provider.lat_max - lat_max) / provider.resolution)), 0)
+    row_stop = min(int(np.ceil((provider.lat_max - lat_min) / provider.resolution)), provider.height)
+    col_start = max(int(np.floor((lon_min - provider.lon_min) / provider.resolution)), 0)
+    col_stop = min(int(np.ceil((lon_max - provider.lon_min) / provider.resolution)), provider.width)
+    if row_start >= row_stop or col_start >= col_stop:
+        raise ValueError(f"bbox {bbox} nam ngoai luoi dac trung")
+    return row_start, row_stop, col_start, col_stop
+
+
+def list_tiles(window, tile_size):
+    """Danh sach o (tile_row, tile_col, row_start, row_stop, col_start, col_stop) tren luoi goc."""
+    row_start, row_stop, col_start, col_stop = window
+    tiles = []
+    for i, r in enumerate(range(row_start, row_stop, tile_size)):
+        for j, c in enumerate(range(col_start, col_stop, tile_size)):
+            tiles.append((i, j, r, min(r + tile_size, row_stop), c, min(c + tile_size, col_stop)))
+    return tiles
+
+
+def grid_fingerprint(grid_dir):
+    """Dau van tay noi dung luoi: grid.json + kich thuoc / mtime cua tung lop .npy.
+
+    Ghi lai luoi (cung thu muc) -> dau van tay doi -> khong tiep tuc raster cu.
+    """
+    digest = hashlib.sha256()
+    with open(os.path.join(grid_dir, 'grid.json'), 'rb') as f:
+        digest.update(f.read())
+    for name in sorted(os.listdir(grid_dir)):
+        if name.endswith('.npy'):
+            stat = os.stat(os.path.join(grid_dir, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def prepare_output(output_dir, meta):
+    """Tao (hoac mo lai) raster va bang o da xong.
+
+    Neu run.json cu co cung tham so chay (luoi, cua so, ngay, model, kich thuoc o)
+    thi giu lai tien do; nguoc lai go raster.json (API thoi phuc vu ban do cu)
+    va bat dau lai tu dau.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    run_path = os.path.join(output_dir, 'run.json')
+    raster_path = os.path.join(output_dir, 'risk.npy')
+    done_path = os.path.join(output_dir, 'tiles_done.npy')
+
+    resume = False
+    if os.path.exists(run_path) and os.path.exists(raster_path) and os.path.exists(done_path):
+        with open(run_path, encoding='utf-8') as f:
+            old = json.load(f)
+        resume = old.get('run_signature') == meta['run_signature']
+
+    if not resume:
+        unpublish(output_dir)
+        # Xoa file cu truoc khi tao lai: tien trinh dang memmap file cu (API)
+        # van doc duoc noi dung cu thay vi file bi cat ngan
+        for path in (raster_path, done_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raster = np.lib.format.open_memmap(
+            raster_path, mode='w+', dtype=np.uint8, shape=(meta['height'], meta['width'])
+        )
+        raster[:] = NODATA
+        raster.flush()
+        del raster
+        done = np.lib.format.open_memmap(
+            done_path, mode='w+', dtype=np.uint8, shape=(meta['n_tile_rows'], meta['n_tile_cols'])
+        )
+        done[:] = 0
+        done.flush()
+        del done
+        write_json(run_path, meta)
+
+    return raster_path, np.load(done_path, mmap_mode='r+'), resume
+
+
+def write_json(path, data):
+    """Ghi JSON qua file tam + doi ten: nguoi doc khong bao gio thay file ghi do."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def unpublish(output_dir):
+    """Go raster.json: tu luc nay raster khong con duoc coi la hoan chinh."""
+    meta_path = os.path.join(output_dir, 'raster.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+
+# =============================================================================
+# OVERVIEWS
+# =============================================================================
+def downsample(raster):
+    """Thu nho 2x: trung binh cac pixel hop le trong moi khoi 2x2 (NODATA neu khong co)."""
+    h, w = raster.shape
+    padded = np.full((h + h % 2, w + w % 2), NODATA, dtype=np.uint8)
+    padded[:h, :w] = raster
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = blocks != NODATA
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.uint32)
+    means = (sums + counts // 2) // np.maximum(counts, 1)
+    return np.where(counts > 0, means, NODATA).astype(np.uint8)
+
+
+def build_overviews(output_dir, tile_size):
+    """Tao cac muc overview 2x, 4x, ... cho den khi raster vua 1 o. Xu ly theo dai hang."""
+    source = np.load(os.path.join(output_dir, 'risk.npy'), mmap_mode='r')
+    levels = []
+    factor = 1
+    while max(source.shape) > tile_size:
+        factor *= 2
+        path = os.path.join(output_dir, f'overview_{factor}.npy')
+        if os.path.exists(path):
+            os.remove(path)
+        shape = ((source.shape[0] + 1) // 2, (source.shape[1] + 1) // 2)
+        target = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        # Doc theo dai 2*tile_size hang de gioi han bo nho
+        step = 2 * tile_size
+        for r in range(0, source.shape[0], step):
+            target[r // 2:(min(r + step, source.shape[0]) + 1) // 2] = downsample(
+                np.asarray(source[r:r + step])
+            )
+        target.flush()
+        levels.append({'factor': factor, 'file': os.path.basename(path),
+                       'height': shape[0], 'width': shape[1]})
+        source = np.load(path, mmap_mode='r')
+    return levels
+
+
+def export_geotiff(output_dir, geotiff_path):
+    """Xuat raster.json + risk.npy thanh GeoTIFF chia o kem overviews (can rasterio)."""
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_origin
+
+    with open(os.path.join(output_dir, 'raster.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    raster = np.load(os.path.join(output_dir, 'risk.npy'), mmap_mode='r')
+    profile = {
+        'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'nodata': NODATA,
+        'height': meta['height'], 'width': meta['width'], 'crs': 'EPSG:4326',
+        'transform': from_origin(meta['lon_min'], meta['lat_max'], meta['resolution'], meta['resolution']),
+        'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'deflate',
+    }
+    with rasterio.open(geotiff_path, 'w', **profile) as dst:
+        for r in range(0, meta['height'], meta['tile_size']):
+            block = np.asarray(raster[r:r + meta['tile_size']])
+            dst.write(block, 1, window=((r, r + block.shape[0]), (0, meta['width'])))
+        dst.build_overviews([level['factor'] for level in meta['overviews']], Resampling.average)
+    print(f"Da xuat GeoTIFF: {geotiff_path}")
+
+
+# =============================================================================
+# HÀM CHẠY CHÍNH
+# =============================================================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tao ban do nguy co ngap tu luoi dac trung local.")
+    parser.add_argument('--grid-dir', default=GRID_DIR, help="Thu muc luoi dac trung (grid.json + .npy)")
+    parser.add_argument('--bundle-dir', default=BUNDLE_DIR, help="Thu muc goi model")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Thu muc ket qua")
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'),
+                        help="Chi tinh trong bbox (mac dinh: toan bo luoi)")
+    parser.add_argument('--date', type=datetime.date.fromisoformat,
+                        help="Ngay tham chieu YYYY-MM-DD cho cua so mua (mac dinh: hom nay UTC)")
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--engine', choices=['xgboost', 'compiled'], default='xgboost',
+                        help="xgboost: booster goc (nhanh voi lo lon); compiled: khong can xgboost")
+    parser.add_argument('--geotiff', help="Xuat them GeoTIFF (can rasterio)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    reference_date = args.date or datetime.datetime.now(datetime.timezone.utc).date()
+
+    provider = LocalRasterFeatureProvider(args.grid_dir, reference_date=reference_date)
+    try:
+        provider.check_coverage()
+    except StaleGridError as e:
+        raise SystemExit(f"LOI: {e}")
+    bundle = load_model_bundle(args.bundle_dir, expected_features=FEATURES_ORDER)
+    window = window_for_bbox(provider, args.bbox)
+    tiles = list_tiles(window, args.tile_size)
+    row_start, row_stop, col_start, col_stop = window
+
+    meta = {
+        'lon_min': provider.lon_min + col_start * provider.resolution,
+        'lat_max': provider.lat_max - row_start * provider.resolution,
+        'resolution': provider.resolution,
+        'height': row_stop - row_start,
+        'width': col_stop - col_start,
+        'tile_size': args.tile_size,
+        'n_tile_rows': tiles[-1][0] + 1,
+        'n_tile_cols': tiles[-1][1] + 1,
+        'nodata': NODATA,
+        'probability_scale': PROBABILITY_SCALE,
+        'reference_date': reference_date.isoformat(),
+        'model_created_at': bundle.created_at,
+        'overviews': [],
+    }
+    meta['run_signature'] = json.dumps({
+        'grid': grid_fingerprint(args.grid_dir),
+        'window': list(window),
+        'tile_size': args.tile_size,
+        'reference_date': meta['reference_date'],
+        'model': bundle.manifest.get('files', {}),
+    }, sort_keys=True)
+
+    raster_path, done, resumed = prepare_output(args.output_dir, meta)
+    pending = [t for t in tiles if not done[t[0], t[1]]]
+    print(f"Luoi {meta['height']}x{meta['width']} pixel, {len(tiles)} o "
+          f"({len(tiles) - len(pending)} da xong{', tiep tuc lan chay truoc' if resumed else ''}).")
+
+    start_time = time.time()
+    if pending:
+        unpublish(args.output_dir)
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(args.grid_dir, args.bundle_dir, reference_date, raster_path,
+                      (row_start, col_start), args.engine),
+        ) as pool:
+            futures = [pool.submit(_run_tile, tile) for tile in pending]
+            for n, future in enumerate(as_completed(futures), 1):
+                tile_row, tile_col = future.result()
+                done[tile_row, tile_col] = 1
+                done.flush()
+                if n % 10 == 0 or n == len(pending):
+                    print(f"- {n}/{len(pending)} o ({time.time() - start_time:.1f}s)")
+
+    if pending or not os.path.exists(os.path.join(args.output_dir, 'raster.json')):
+        print("Dang tao overviews...")
+        meta['overviews'] = build_overviews(args.output_dir, args.tile_size)
+        # raster.json chi xuat hien khi risk.npy va overviews da day du
+        write_json(os.path.join(args.output_dir, 'raster.json'), meta)
+    else:
+        print("Ban do da hoan tat tu lan chay truoc.")
+
+    if args.geotiff:
+        export_geotiff(args.output_dir, args.geotiff)
+
+    print(f"HOAN TAT sau {time.time() - start_time:.1f}s. Ket qua: {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
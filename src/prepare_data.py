@@ -1,8 +1,17 @@
 import ee
-import time
+import os
+import argparse
+import datetime
 import traceback
 import sys
 
+from export_scheduler import ExportScheduler, EarthEngineTaskBackend, COMPLETED
+from rainfall import precipitation_windows, antecedent_windows, MAX_ANTECEDENT_DAYS
+from direct_export import (
+    EarthEngineFeaturePager, export_collection, EXPORT_FORMATS,
+    DEFAULT_PAGE_SIZE, DEFAULT_WORKERS
+)
+
 # =============================================================================
 # KHỞI TẠO VÀ CẤU HÌNH GEE
 # Phần mày phải đăng kí 1 tài khoản GEE và xác thực trước khi chạy.
@@ -84,6 +93,18 @@ FLOOD_EVENTS = [
     }
 ]
 
+# =============================================================================
+# LAP LICH TASK XUAT DU LIEU
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Tien do cac task (de chay lai tiep tuc tu cho da dung)
+EXPORT_STATE_PATH = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'export_state.json'))
+MAX_CONCURRENT_TASKS = 10     # so task chay dong thoi (<= gioi han hang doi EE cua tai khoan)
+MAX_TASK_ATTEMPTS = 3         # so lan thu toi da moi su kien
+TASK_POLL_INTERVAL = 30       # giay giua 2 lan hoi trang thai
+# Che do --direct: ghi thang vao thu muc du lieu tho (khong qua Google Drive)
+RAW_EXPORT_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'raw_exports'))
+
 # =============================================================================
 # ĐỊNH NGHĨA VÙNG QUAN TÂM (AOI)
 # =============================================================================
@@ -97,8 +118,8 @@ AOI = ee.FeatureCollection("FAO/GAUL/2015/level0").filter(ee.Filter.eq('ADM0_NAM
     
     Các tham số truyền vào hàm bao gồm:
     1. aoi (vùng quan tâm): Geometry của vùng cần phân tích (Việt Nam)
-    2. dem (Digital Elevation Model): Đã giải thích trong hàm create_export_task
-    3. slope (độ dốc): tính từ DEM, Đã giải thích trong hàm create_export_task
+    2. dem (Digital Elevation Model): Đã giải thích trong hàm build_static_layers
+    3. slope (độ dốc): tính từ DEM, Đã giải thích trong hàm build_static_layers
     
     Các đặc trưng tĩnh bao gồm:
     
@@ -165,27 +186,17 @@ def get_static_features(aoi, dem, slope):
 # =============================================================================
 def get_dynamic_features(start_date, end_date):
     """Dinh nghia cac dac trung dong (Giu nguyen logic da sua)"""
-    gpm = ee.ImageCollection("NASA/GPM_L3/IMERG_V07") \
-            .filterDate(start_date, end_date)
-    total_precipitation = gpm.select('precipitation').sum().rename('precip_total')
-
-    # 14-day antecedent
-    pre_start_date_14 = ee.Date(start_date).advance(-14, 'day')
-    pre_gpm_14 = ee.ImageCollection("NASA/GPM_L3/IMERG_V07")
-    precip_14_day = pre_gpm_14.filterDate(pre_start_date_14, start_date) \
-                              .select('precipitation').sum().rename('precip_14_day')
-
-    # 7-day antecedent
-    pre_start_date_7 = ee.Date(start_date).advance(-7, 'day')
-    pre_gpm_7 = ee.ImageCollection("NASA/GPM_L3/IMERG_V07")
-    precip_7_day = pre_gpm_7.filterDate(pre_start_date_7, start_date) \
-                             .select('precipitation').sum().rename('precip_7_day')
-    
-    # 3-day antecedent
-    pre_start_date_3 = ee.Date(start_date).advance(-3, 'day')
-    pre_gpm_3 = ee.ImageCollection("NASA/GPM_L3/IMERG_V07")
-    precip_3_day = pre_gpm_3.filterDate(pre_start_date_3, start_date) \
-                             .select('precipitation').sum().rename('precip_3_day')
+    # Mua: 1 chuoi tong theo ngay tu (start - 14 ngay) den end, moi cua so
+    # (tong su kien, 14/7/3 ngay truoc) la hieu 2 tong tich luy
+    n_event_days = (datetime.date.fromisoformat(end_date)
+                    - datetime.date.fromisoformat(start_date)).days
+    windows = antecedent_windows(MAX_ANTECEDENT_DAYS)
+    windows['precip_total'] = (MAX_ANTECEDENT_DAYS, MAX_ANTECEDENT_DAYS + n_event_days)
+    precipitation = precipitation_windows(
+        ee.Date(start_date).advance(-MAX_ANTECEDENT_DAYS, 'day'),
+        MAX_ANTECEDENT_DAYS + n_event_days,
+        windows,
+    )
 
     # Soil Moisture (Voi logic If/else chong loi)
     pre_start_date_3_sm = ee.Date(start_date).advance(-3, 'day')
@@ -205,12 +216,9 @@ def get_dynamic_features(start_date, end_date):
         )
     )
 
-    dynamic_features = total_precipitation.addBands([
-        precip_14_day,
-        precip_7_day,
-        precip_3_day,
-        soil_moisture_mean
-    ])
+    dynamic_features = precipitation.select([
+        'precip_total', 'precip_14_day', 'precip_7_day', 'precip_3_day'
+    ]).addBands(soil_moisture_mean)
     
     return dynamic_features
 
@@ -252,10 +260,58 @@ def get_non_flood_data(s1_baseline, s1_during, slope, features_to_add):
     
     return non_flood_points.addBands(features_to_add)
 
+# =============================================================================
+# CAC THANH PHAN DUNG CHUNG CHO MOI SU KIEN (TAO 1 LAN MOI LAN CHAY)
+# =============================================================================
+def build_static_layers(aoi):
+    """DEM, slope va anh dac trung tinh: khong phu thuoc su kien nen chi tao 1 lan.
+
+    Dung chung 1 do thi cho tat ca su kien giup EE tai su dung ket qua trung gian.
+    """
+    # dem (Digital Elevation Model): Cao độ mặt đất so với mực nước biển, đơn vị là mét.
+    dem = ee.Image("USGS/SRTMGL1_003").clip(aoi)
+
+    # slope (độ dốc): Độ nghiêng của bề mặt đất, tính từ DEM.
+    # Đơn vị là độ (0-90).
+    # ee.Terrain.slope() sẽ trả về độ dốc theo đơn vị độ.
+    slope = ee.Terrain.slope(dem).rename('slope')
+
+    return {
+        'dem': dem,
+        'slope': slope,
+        'static_features': get_static_features(aoi, dem, slope),
+    }
+
+
+def s1_vh_collection(aoi):
+    """Anh Sentinel-1 co bang VH tren AOI; moi su kien chi loc them theo ngay."""
+    return ee.ImageCollection('COPERNICUS/S1_GRD') \
+             .filterBounds(aoi) \
+             .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))
+
+
+def get_s1_availability(s1_collection, events):
+    """So anh S1 trong thoi gian lu cua TAT CA su kien, trong 1 lan getInfo().
+
+    Returns:
+        dict: event_id -> so anh S1 (0 = khong the phat hien lu)
+    """
+    sizes = ee.List([
+        s1_collection.filterDate(event['start'], event['end']).size()
+        for event in events
+    ]).getInfo()
+    return {event['id']: size for event, size in zip(events, sizes)}
+
 # =============================================================================
 # HÀM TẠO TASK XUẤT DỮ LIỆU (DA CAP NHAT LOGIC)
 # =============================================================================
-def create_export_task(aoi, event_dict, num_points=3000, scale=90):
+def build_training_samples(aoi, event_dict, num_points=3000, scale=90,
+                           static_layers=None, s1_collection=None, s1_count=None):
+    """
+    Dinh nghia FeatureCollection mau huan luyen cho 1 su kien (None neu bo qua).
+    static_layers / s1_collection / s1_count: tinh san 1 lan cho ca lan chay
+    (build_static_layers, s1_vh_collection, get_s1_availability); None = tu tinh.
+    """
     event_id = event_dict['id']
     start_date = ee.Date(event_dict['start'])
     end_date = ee.Date(event_dict['end'])
@@ -264,35 +320,35 @@ def create_export_task(aoi, event_dict, num_points=3000, scale=90):
     
     try:
         # === PHAN 1: TINH TOAN CAC DAC TRUNG CHUNG ===
+        if s1_collection is None:
+            s1_collection = s1_vh_collection(aoi)
+
+        # Kiem tra nhanh xem co du lieu khong (an toan)
+        # .size() se bi loi neu collection rong, nen chung ta phai kiem tra s1_during
+        if s1_count is None:
+            s1_count = s1_collection.filterDate(start_date, end_date).size().getInfo()
+        if s1_count == 0:
+            print(f"!!! Bo qua su kien {event_id} do thieu S1.")
+            return None
         
         # 1.1. Tinh S1 Baseline (3 thang truoc lu)
         pre_end_date = start_date.advance(-1, 'day')
         pre_start_date = pre_end_date.advance(-3, 'month')
         
-        s1_baseline = ee.ImageCollection('COPERNICUS/S1_GRD') \
-                          .filterBounds(aoi) \
-                          .filterDate(pre_start_date, pre_end_date) \
-                          .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-                          .select('VH').median().clip(aoi)
+        s1_baseline = s1_collection.filterDate(pre_start_date, pre_end_date) \
+                                   .select('VH').median().clip(aoi)
 
         # 1.2. Tinh S1 During (Trong khi lu)
-        s1_during = ee.ImageCollection('COPERNICUS/S1_GRD') \
-                        .filterBounds(aoi) \
-                        .filterDate(start_date, end_date) \
-                        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-                        .select('VH').mean().clip(aoi)
+        s1_during = s1_collection.filterDate(start_date, end_date) \
+                                 .select('VH').mean().clip(aoi)
         
-        # 1.3. Tinh DEM va Slope (chi 1 lan)
-        # dem (Digital Elevation Model): Cao độ mặt đất so với mực nước biển, đơn vị là mét.
-        dem = ee.Image("USGS/SRTMGL1_003").clip(aoi)
-        
-        # slope (độ dốc): Độ nghiêng của bề mặt đất, tính từ DEM.
-        # Đơn vị là độ (0-90).
-        # ee.Terrain.slope() sẽ trả về độ dốc theo đơn vị độ.
-        slope = ee.Terrain.slope(dem).rename('slope')
+        # 1.3. DEM, Slope va dac trung tinh (dung chung cho moi su kien)
+        if static_layers is None:
+            static_layers = build_static_layers(aoi)
+        slope = static_layers['slope']
 
         # 1.4. Goi cac ham dac trung
-        static_features = get_static_features(aoi, dem, slope)
+        static_features = static_layers['static_features']
         dynamic_features = get_dynamic_features(event_dict['start'], event_dict['end'])
         
         all_features = static_features.addBands(dynamic_features)
@@ -305,18 +361,6 @@ def create_export_task(aoi, event_dict, num_points=3000, scale=90):
         # 2.2. Dinh nghia vung Không Lũ (flood=0)
         non_flood_data = get_non_flood_data(s1_baseline, s1_during, slope, all_features)
 
-        # Kiem tra nhanh xem co du lieu khong (an toan)
-        # .size() se bi loi neu collection rong, nen chung ta phai kiem tra s1_during
-        s1_during_size = ee.ImageCollection('COPERNICUS/S1_GRD') \
-                           .filterBounds(aoi) \
-                           .filterDate(start_date, end_date) \
-                           .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-                           .size()
-
-        if s1_during_size.getInfo() == 0:
-            print(f"!!! Bo qua su kien {event_id} do thieu S1.")
-            return None
-
         # Mau ngap (Positive = 1)
         flood_samples = flood_data.sample(
             region=aoi, 
@@ -345,16 +389,7 @@ def create_export_task(aoi, event_dict, num_points=3000, scale=90):
             'detail': event_dict['detail']
         }))
         
-        # Dinh nghia Task
-        task_description = f'export_flood_data_{event_id}'
-        task = ee.batch.Export.table.toDrive(
-            collection=training_data,
-            description=task_description,
-            folder='GEE_Flood_Exports', 
-            fileNamePrefix=event_id,
-            fileFormat='CSV'
-        )
-        return task
+        return training_data
         
     except ee.ee_exception.EEException as e:
         # Bat loi .getInfo()
@@ -366,44 +401,149 @@ def create_export_task(aoi, event_dict, num_points=3000, scale=90):
         traceback.print_exc() 
         return None
 
+
+def create_export_task(aoi, event_dict, **kwargs):
+    """Task xuat mau huan luyen cua 1 su kien len Google Drive (None neu bo qua)."""
+    training_data = build_training_samples(aoi, event_dict, **kwargs)
+    if training_data is None:
+        return None
+
+    # Dinh nghia Task
+    event_id = event_dict['id']
+    task_description = f'export_flood_data_{event_id}'
+    task = ee.batch.Export.table.toDrive(
+        collection=training_data,
+        description=task_description,
+        folder='GEE_Flood_Exports', 
+        fileNamePrefix=event_id,
+        fileFormat='CSV'
+    )
+    return task
+
 # =============================================================================
 # HÀM CHẠY CHÍNH (Da cap nhat)
 # =============================================================================
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tao va theo doi cac task xuat du lieu huan luyen tren GEE.")
+    parser.add_argument('--max-tasks', type=int, default=MAX_CONCURRENT_TASKS,
+                        help="So task chay dong thoi toi da")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Bo qua tien do da luu, tao lai task cho tat ca su kien")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Thu lai cac task da THAT BAI trong tien do da luu")
+    parser.add_argument('--retry-skipped', action='store_true',
+                        help="Thu lai cac su kien da bi BO QUA (vd. luc truoc chua co anh Sentinel-1)")
+    parser.add_argument('--direct', action='store_true',
+                        help=f"Tai truc tiep mau ve {RAW_EXPORT_DIR} qua EE API (khong qua Drive)")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv',
+                        help="Dinh dang file khi dung --direct")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help="So feature moi trang khi dung --direct")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="So trang tai dong thoi khi dung --direct")
+    return parser.parse_args()
+
+
+def run_direct_export(args, sample_kwargs):
+    """Che do --direct: tai mau tung su kien ve may, bo qua su kien da co file.
+
+    Returns:
+        int: so su kien bi loi.
+    """
+    results = {}
+    n_failed = 0
+    for event in FLOOD_EVENTS:
+        event_id = event['id']
+        out_path = os.path.join(RAW_EXPORT_DIR, f"{event_id}.{args.format}")
+        if os.path.exists(out_path) and not args.fresh:
+            print(f"Da co {out_path}, bo qua (dung --fresh de tai lai).")
+            results[event_id] = 'EXISTS'
+            continue
+        training_data = build_training_samples(aoi=AOI, event_dict=event, **sample_kwargs(event_id))
+        if training_data is None:
+            results[event_id] = 'SKIPPED'
+            continue
+        try:
+            rows = export_collection(
+                EarthEngineFeaturePager(training_data), out_path, fmt=args.format,
+                page_size=args.page_size, max_workers=args.workers,
+            )
+            results[event_id] = f"{rows} dong"
+        except Exception as e:
+            traceback.print_exc()
+            results[event_id] = f"LOI ({e})"
+            n_failed += 1
+
+    print(f"\n==================================================================")
+    print(f"HOAN TAT! Du lieu tho luu tai: {RAW_EXPORT_DIR}")
+    for event_id, result in results.items():
+        print(f"- {event_id}: {result}")
+    print(f"BUOC TIEP THEO: Chay script 'python src/combine_data.py' de tong hop du lieu.")
+    print(f"==================================================================")
+    return n_failed
+
+
 def main():
+    args = parse_args()
     print("Bat dau qua trinh CHUAN BI TASK XUAT DU LIEU (Phuong phap Change Detection)...")
-    
-    tasks_started = 0
-    
-    for event in FLOOD_EVENTS:
-        task = create_export_task(
-            aoi=AOI,
-            event_dict=event,
+
+    events_by_id = {event['id']: event for event in FLOOD_EVENTS}
+
+    # Phan dung chung cho moi su kien: dac trung tinh + bo loc S1 (tao 1 lan)
+    static_layers = build_static_layers(AOI)
+    s1_collection = s1_vh_collection(AOI)
+    # So anh S1 cua tat ca su kien trong 1 lan goi server (thay vi 1 getInfo / su kien)
+    print("Dang kiem tra anh S1 cho tat ca su kien...")
+    s1_counts = get_s1_availability(s1_collection, FLOOD_EVENTS)
+
+    def sample_kwargs(event_id):
+        return dict(
             num_points=3000,
-            scale=90          # Giu 90m de giam tai
+            scale=90,         # Giu 90m de giam tai
+            static_layers=static_layers,
+            s1_collection=s1_collection,
+            s1_count=s1_counts[event_id],
         )
-        
-        if task:
-            try:
-                task.start()
-                tasks_started += 1
-                print(f"==> DA KHOI TAO TASK: {task.config['description']}")
-                time.sleep(1) # Nghi 1 giay giua cac lan khoi tao task
-            except ee.ee_exception.EEException as e:
-                print(f"!!! KHONG THE KHOI TAO TASK cho {event['id']}: {e}")
-        
-        time.sleep(60) # Nghi 1 phút giua cac su kien
 
+    if args.direct:
+        if run_direct_export(args, sample_kwargs):
+            sys.exit(1)
+        return
+
+    if args.fresh and os.path.exists(EXPORT_STATE_PATH):
+        os.remove(EXPORT_STATE_PATH)
+
+    backend = EarthEngineTaskBackend(
+        lambda event_id: create_export_task(
+            aoi=AOI, event_dict=events_by_id[event_id], **sample_kwargs(event_id)
+        )
+    )
+    scheduler = ExportScheduler(
+        backend,
+        state_path=EXPORT_STATE_PATH,
+        max_in_flight=args.max_tasks,
+        max_attempts=MAX_TASK_ATTEMPTS,
+        poll_interval=TASK_POLL_INTERVAL,
+        retry_failed=args.retry_failed,
+        retry_skipped=args.retry_skipped,
+    )
+    results = scheduler.run(list(events_by_id))
+
+    n_completed = sum(1 for state in results.values() if state == COMPLETED)
     print(f"\n==================================================================")
-    print(f"HOAN TAT! Da khoi tao thanh cong {tasks_started} / {len(FLOOD_EVENTS)} tac vu (tasks).")
+    print(f"HOAN TAT! {n_completed} / {len(FLOOD_EVENTS)} task xuat du lieu da hoan thanh.")
+    for event_id, state in results.items():
+        if state != COMPLETED:
+            print(f"- {event_id}: {state} ({scheduler.jobs[event_id].get('error')})")
+    print(f"Tien do luu tai: {EXPORT_STATE_PATH} (chay lai de thu tiep cac task chua xong, "
+          f"them --retry-failed / --retry-skipped de thu lai task THAT BAI / BI BO QUA)")
     print(f"BUOC TIEP THEO:")
-    print(f"1. Mo GEE Code Editor, vao tab 'Tasks' va nhan 'Run' cho tat ca cac task moi.")
-    print(f"2. Sau khi cac task hoan thanh, tai thu muc 'GEE_Flood_Exports' tu Google Drive.")
-    print(f"3. Dat cac file CSV vao thu muc '../data/raw_exports/'.")
-    print(f"4. Chay script 'python src/combine_data.py' de tong hop du lieu.")
+    print(f"1. Tai thu muc 'GEE_Flood_Exports' tu Google Drive.")
+    print(f"2. Dat cac file CSV vao thu muc '../data/raw_exports/'.")
+    print(f"3. Chay script 'python src/combine_data.py' de tong hop du lieu.")
     print(f"==================================================================")
 
 
 if __name__ == "__main__":
     main()
-
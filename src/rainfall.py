@@ -0,0 +1,70 @@
+"""Luong mua tich luy tu GPM IMERG (1 lan quet, tong tien to).
+
+Du lieu IMERG (nua gio) chi duoc loc 1 lan va gom thanh anh tong theo ngay
+tren toan bo khoang thoi gian dai nhat can dung. Tu chuoi ngay do tinh tong
+tich luy (prefix sum) phia server; moi cua so [a, b) chi con la 1 phep tru
+cum[b] - cum[a], nen them cua so moi khong phai quet lai collection.
+"""
+
+# =============================================================================
+# LUONG MUA TICH LUY TU GPM IMERG (1 LAN QUET, TONG TIEN TO)
+# =============================================================================
+IMERG_COLLECTION = "NASA/GPM_L3/IMERG_V07"
+
+# Cua so mua tien ky: ten band -> so ngay truoc moc thoi gian
+ANTECEDENT_WINDOWS = {
+    'precip_14_day': 14,
+    'precip_7_day': 7,
+    'precip_3_day': 3,
+}
+MAX_ANTECEDENT_DAYS = max(ANTECEDENT_WINDOWS.values())
+
+
+def daily_precipitation(start_date, n_days):
+    """List `n_days` anh tong mua theo ngay (band 'precipitation'), ngay i = [start+i, start+i+1)."""
+    import ee
+    start_date = ee.Date(start_date)
+    gpm = ee.ImageCollection(IMERG_COLLECTION) \
+            .filterDate(start_date, start_date.advance(n_days, 'day')) \
+            .select('precipitation')
+    # Ngay khong co anh -> 0 (sum() cua collection rong khong co band nao)
+    zero = ee.ImageCollection([ee.Image.constant(0).float().rename('precipitation')])
+
+    def day_sum(i):
+        day = start_date.advance(i, 'day')
+        return gpm.filterDate(day, day.advance(1, 'day')).merge(zero).sum().unmask(0)
+
+    return ee.List.sequence(0, n_days - 1).map(day_sum)
+
+
+def cumulative_precipitation(start_date, n_days):
+    """Anh mang [n_days + 1, 1]: phan tu i = tong mua cua i ngay dau (phan tu 0 = 0)."""
+    import ee
+    zero = ee.Image.constant(0).float().rename('precipitation')
+    days = ee.List([zero]).cat(daily_precipitation(start_date, n_days))
+    return ee.ImageCollection.fromImages(days).toArray().arrayAccum(0, ee.Reducer.sum())
+
+
+def precipitation_windows(start_date, n_days, windows):
+    """Tong mua cua nhieu cua so tu 1 lan quet IMERG.
+
+    Args:
+        start_date: ngay dau cua chuoi ngay.
+        n_days: so ngay cua chuoi (phai bao tat ca cua so).
+        windows: dict ten band -> (a, b), cua so nua mo [a, b) tinh bang ngay tu start_date.
+
+    Returns:
+        ee.Image, moi cua so 1 band theo thu tu cua `windows`.
+    """
+    import ee
+    cumsum = cumulative_precipitation(start_date, n_days)
+    bands = [
+        cumsum.arrayGet([b, 0]).subtract(cumsum.arrayGet([a, 0])).rename(name)
+        for name, (a, b) in windows.items()
+    ]
+    return ee.Image.cat(bands)
+
+
+def antecedent_windows(offset):
+    """Cua so mua tien ky ket thuc tai ngay `offset` cua chuoi ngay: ten -> (a, b)."""
+    return {name: (offset - days, offset) for name, days in ANTECEDENT_WINDOWS.items()}
@@ -1,19 +1,21 @@
-import pandas as pd
-import joblib
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import xgboost as xgb
-import optuna
-import shap
-import matplotlib.pyplot as plt
 import os
+import sys
+import json
+import argparse
 from sklearn.utils.class_weight import compute_sample_weight
 from sklearn.preprocessing import StandardScaler
 
+from model_bundle import save_model_bundle, load_model_bundle
+from tuning import tune_hyperparameters
+from explain import compute_shap_values, SHAP_SAMPLE_SIZE
+from dataset import DATASET_DIR, load_dataset
+
 # =============================================================================
 # ĐỊNH NGHĨA ĐƯỜNG DẪN
 # =============================================================================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'processed'))
 MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models'))
 OUTPUT_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'outputs'))
 
@@ -22,11 +24,65 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # Dinh nghia cac file
-DATA_PATH = os.path.join(DATA_DIR, 'combined_data_raw.csv') 
-MODEL_PATH = os.path.join(MODEL_DIR, 'flood_model.xgb')
-SCALER_PATH = os.path.join(MODEL_DIR, 'scaler.joblib') 
+# Goi model (booster + scaler + cay bien dich + manifest), API doc truc tiep
+BUNDLE_DIR = os.path.join(MODEL_DIR, 'flood_model_bundle')
 REPORT_PATH = os.path.join(OUTPUT_DIR, 'model_evaluation_report.txt')
 SHAP_PLOT_PATH = os.path.join(OUTPUT_DIR, 'shap_summary_plot.png')
+# Gia tri SHAP cua mau da giai thich (dung lai khi model + du lieu khong doi)
+SHAP_DIR = os.path.join(OUTPUT_DIR, 'shap')
+# Ket qua tim kiem sieu tham so (dau vao cua buoc huan luyen cuoi cung)
+BEST_PARAMS_PATH = os.path.join(OUTPUT_DIR, 'best_params.json')
+
+# Tim kiem sieu tham so (Optuna)
+N_TRIALS = 50
+TUNING_WORKERS = None  # None = so CPU
+# Study luu tren dia: chay lai thi tiep tuc; du lieu moi khoi dong tu study truoc
+OPTUNA_STORAGE_PATH = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'cache', 'optuna_studies.db'))
+WARM_START_TRIALS = 20
+
+# Giai thich mo hinh (SHAP): so dong toi da cua mau phan tang, so tien trinh
+SHAP_SAMPLES = SHAP_SAMPLE_SIZE
+SHAP_WORKERS = None  # None = so CPU
+
+# =============================================================================
+# ĐẶC TRƯNG
+# =============================================================================
+# Định nghĩa các nhóm đặc trưng
+STATIC_FEATURES = [
+    'elevation', 'slope', 'aspect',          # Địa hình
+    'land_cover', 'soil_type',               # Lớp phủ và đất
+    'is_flood_prone', 'is_permanent_water',  # Flags từ land_cover
+    'is_urban', 'is_agriculture'             # Flags từ land_cover
+]
+
+DYNAMIC_FEATURES = [
+    'precip_total', 'precip_14_day',        # Lượng mưa
+    'precip_7_day', 'precip_3_day',
+    'soil_moisture'                          # Độ ẩm đất
+]
+
+# Loại bỏ các cột không phải đặc trưng
+EXCLUDED_COLUMNS = [
+    'flood',            # nhãn
+    'event_id',         # metadata
+    'purpose',          # phân chia tập
+    'apex_date',        # thời gian
+    'detail',          # mô tả
+    's1_diff',         # đặc trưng thô
+    '.geo',            # geometry
+    'system:index',    # index
+    'coordinates',     # đã xử lý từ .geo
+    'latitude',        # đã xử lý từ .geo
+    'longitude',       # đã xử lý từ .geo
+    'land_cover_name'  # tên tiếng Việt
+]
+
+# Kết hợp tất cả đặc trưng
+FEATURES = STATIC_FEATURES + DYNAMIC_FEATURES
+TARGET = 'flood'
+
+# Cac buoc co the chay rieng (src/pipeline.py chi chay lai buoc co dau vao thay doi)
+STAGES = ['all', 'tune', 'train', 'shap']
 
 # =============================================================================
 # CÁC HÀM TIỆN ÍCH
@@ -39,73 +95,40 @@ def save_report(content):
     print(f"\nDa luu bao cao danh gia chi tiet vao: {REPORT_PATH}")
 
 def plot_shap_summary(shap_values, features, feature_names):
-    """Ve va luu do thi SHAP summary."""
-    try:
-        plt.figure()
-        shap.summary_plot(shap_values, features, feature_names=feature_names, show=False)
-        plt.savefig(SHAP_PLOT_PATH, bbox_inches='tight')
-        plt.close()
-        print(f"Da luu do thi SHAP summary vao: {SHAP_PLOT_PATH}")
-    except Exception as e:
-        print(f"Loi khi ve SHAP plot: {e}. Co the do X_train bi rong.")
+    """Ve va luu do thi SHAP summary (loi duoc nem ra cho ham goi xu ly)."""
+    import shap
+    import matplotlib.pyplot as plt
+    plt.figure()
+    shap.summary_plot(shap_values, features, feature_names=feature_names, show=False)
+    plt.savefig(SHAP_PLOT_PATH, bbox_inches='tight')
+    plt.close()
+    print(f"Da luu do thi SHAP summary vao: {SHAP_PLOT_PATH}")
 
 
 # =============================================================================
-# HÀM HUẤN LUYỆN CHÍNH
+# CÁC BƯỚC HUẤN LUYỆN
 # =============================================================================
 
-def main():
-    print("Bat dau qua trinh huan luyen mo hinh...")
-    
-    # --- BUOC 1: DOC VA PHAN CHIA DU LIEU ---
+def load_splits(features=FEATURES, target=TARGET):
+    """BUOC 1: Doc va phan chia du lieu. Tra ve (train_df, val_df, test_df) hoac None."""
+    if not features:
+        print("Loi: Khong tim thay dac trung nao de huan luyen.")
+        return None
+
+    print(f"Su dung {len(features)} dac trung de huan luyen: {features}")
+
+    # Chi doc cac cot can thiet va 3 tap du lieu (bo qua cot/phan vung khac)
     try:
-        df = pd.read_csv(DATA_PATH)
+        df = load_dataset(
+            columns=features + [target, 'purpose'],
+            purposes=['training', 'validation', 'testing']
+        )
     except FileNotFoundError:
-        print(f"Loi: Khong tim thay file du lieu tai: {DATA_PATH}")
+        print(f"Loi: Khong tim thay du lieu tai: {DATASET_DIR}")
         print("Vui long chay 'combine_data.py' truoc.")
-        return
+        return None
 
-    print(f"Da doc thanh cong {len(df)} dong du lieu tu {DATA_PATH}")
-
-    # Định nghĩa các nhóm đặc trưng
-    static_features = [
-        'elevation', 'slope', 'aspect',          # Địa hình
-        'land_cover', 'soil_type',               # Lớp phủ và đất
-        'is_flood_prone', 'is_permanent_water',  # Flags từ land_cover
-        'is_urban', 'is_agriculture'             # Flags từ land_cover
-    ]
-    
-    dynamic_features = [
-        'precip_total', 'precip_14_day',        # Lượng mưa
-        'precip_7_day', 'precip_3_day',
-        'soil_moisture'                          # Độ ẩm đất
-    ]
-    
-    # Loại bỏ các cột không phải đặc trưng
-    excluded_columns = [
-        'flood',            # nhãn
-        'event_id',         # metadata
-        'purpose',          # phân chia tập
-        'apex_date',        # thời gian
-        'detail',          # mô tả
-        's1_diff',         # đặc trưng thô
-        '.geo',            # geometry
-        'system:index',    # index
-        'coordinates',     # đã xử lý từ .geo
-        'latitude',        # đã xử lý từ .geo
-        'longitude',       # đã xử lý từ .geo
-        'land_cover_name'  # tên tiếng Việt
-    ]
-    
-    # Kết hợp tất cả đặc trưng
-    features = static_features + dynamic_features
-    
-    if not features:
-        print("Loi: Khong tim thay dac trung nao de huan luyen.")
-        return
-        
-    print(f"Su dung {len(features)} dac trung de huan luyen: {features}")
-    target = 'flood'
+    print(f"Da doc thanh cong {len(df)} dong du lieu tu {DATASET_DIR}")
 
     try:
         train_df = df[df['purpose'] == 'training'].copy()
@@ -113,173 +136,248 @@ def main():
         test_df = df[df['purpose'] == 'testing'].copy()
     except Exception as e:
         print(f"Loi khi phan chia du lieu: {e}")
-        print("Vui long kiem tra lai cot 'purpose' trong file CSV.")
-        return
+        print("Vui long kiem tra lai cot 'purpose' trong bo du lieu.")
+        return None
 
     if train_df.empty or val_df.empty or test_df.empty:
         print("Loi: Mot trong cac tap (training, validation, testing) bi rong.")
         print(f"Training: {len(train_df)}, Validation: {len(val_df)}, Testing: {len(test_df)}")
         print("Vui long kiem tra lai file 'FLOOD_EVENTS' trong 'prepare_data.py'.")
-        return
-        
+        return None
+
     print(f"Phan chia du lieu thanh cong:")
     print(f"- Tap Training: {len(train_df)} diem")
     print(f"- Tap Validation: {len(val_df)} diem")
     print(f"- Tap Testing: {len(test_df)} diem")
+    return train_df, val_df, test_df
+
 
-    # --- BUOC 2: CHUAN HOA DU LIEU (SCALING) ---
+def scale_splits(train_df, val_df, test_df, features=FEATURES, target=TARGET):
+    """BUOC 2 + 3: Chuan hoa du lieu va tinh sample_weight cho tap training."""
     print("\nBat dau chuan hoa du lieu (StandardScaler)...")
     scaler = StandardScaler()
-    
-    X_train = scaler.fit_transform(train_df[features])
-    y_train = train_df[target]
-    
-    X_val = scaler.transform(val_df[features])
-    y_val = val_df[target]
-    
-    X_test = scaler.transform(test_df[features])
-    y_test = test_df[target]
-    
+
+    data = {
+        'scaler': scaler,
+        'X_train': scaler.fit_transform(train_df[features]),
+        'y_train': train_df[target],
+        'X_val': scaler.transform(val_df[features]),
+        'y_val': val_df[target],
+        'X_test': scaler.transform(test_df[features]),
+        'y_test': test_df[target],
+    }
+
     print("Chuan hoa du lieu thanh cong.")
-    joblib.dump(scaler, SCALER_PATH)
-    print(f"Da luu scaler (da fit) vao: {SCALER_PATH}")
 
-    # --- BUOC 3: XU LY MAT CAN BANG DU LIEU (CHO TAP TRAINING) ---
     print("\nXu ly mat can bang du lieu (tinh toan 'sample_weight')...")
-    sample_weights = compute_sample_weight(
+    data['sample_weights'] = compute_sample_weight(
         class_weight='balanced',
-        y=y_train
+        y=data['y_train']
     )
-    print(f"Phan bo nhan 'flood' tap training:\n{y_train.value_counts()}")
+    print(f"Phan bo nhan 'flood' tap training:\n{data['y_train'].value_counts()}")
+    return data
 
-    # --- BUOC 4: TIM KIEM SIEU THAM SO (OPTUNA) ---
+
+def run_tuning(data, features=FEATURES, strict=False):
+    """BUOC 4: Tim kiem sieu tham so; luu ket qua vao BEST_PARAMS_PATH.
+
+    Loi: strict=True thi nem ra (chay rieng buoc 'tune'), nguoc lai dung tham so
+    mac dinh va KHONG ghi BEST_PARAMS_PATH.
+    """
     print("\nBat dau tim kiem sieu tham so voi Optuna...")
-    
-    def objective(trial):
-        # === SUA LOI O DAY ===
-        params = {
-            'objective': 'binary:logistic',
-            'eval_metric': 'logloss', 
-            'n_estimators': 1000, 
-            'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3),
-            'max_depth': trial.suggest_int('max_depth', 3, 10),
-            'subsample': trial.suggest_float('subsample', 0.5, 1.0),
-            'colsample_bytree': trial.suggest_float('colsample_bytree', 0.5, 1.0),
-            'gamma': trial.suggest_float('gamma', 0, 5),
-            'reg_alpha': trial.suggest_float('reg_alpha', 0, 5),
-            'reg_lambda': trial.suggest_float('reg_lambda', 0, 5),
-            'random_state': 42,
-            'n_jobs': -1,
-            'early_stopping_rounds': 50 # early_stopping_rounds PHAI dat o day
-        }
-        # === KET THUC SUA ===
-        
-        model = xgb.XGBClassifier(**params)
-        
-        model.fit(
-            X_train, y_train,
-            eval_set=[(X_val, y_val)], # Tham so nay PHAI co mat
-            # early_stopping_rounds va eval_metric KHONG dat o day
-            verbose=False,
-            sample_weight=sample_weights 
-        )
-        
-        report_dict = classification_report(y_val, model.predict(X_val), output_dict=True)
-        f1_score_class_1 = report_dict.get('1', {}).get('f1-score', 0)
-        return f1_score_class_1
 
-    study = optuna.create_study(direction='maximize')
+    # Trial song song tren nhieu tien trinh, ma tran train/val tao 1 lan va dung chung
     try:
-        study.optimize(objective, n_trials=50) 
-        print(f"Tim kiem hoan tat. Best F1-score (class 1, tren tap validation): {study.best_value:.4f}")
-        print(f"Tham so tot nhat: {study.best_params}")
-        best_params = study.best_params
+        best_params, best_value = tune_hyperparameters(
+            data['X_train'], data['y_train'], data['sample_weights'],
+            data['X_val'], data['y_val'], features,
+            n_trials=N_TRIALS, n_workers=TUNING_WORKERS,
+            storage_path=OPTUNA_STORAGE_PATH, warm_start_trials=WARM_START_TRIALS
+        )
+        print(f"Tim kiem hoan tat. Best F1-score (class 1, tren tap validation): {best_value:.4f}")
+        print(f"Tham so tot nhat: {best_params}")
     except Exception as e:
         print(f"Loi trong qua trinh Optuna: {e}")
+        if strict:
+            raise
         print("Su dung tham so mac dinh de tiep tuc.")
-        best_params = {} 
+        return {}
 
-    # --- BUOC 5: HUAN LUYEN MO HINH CUOI CUNG ---
+    with open(BEST_PARAMS_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'best_params': best_params, 'best_value': best_value}, f, indent=2)
+    return best_params
+
+
+def load_best_params():
+    """Doc tham so da tim o buoc 'tune' (None neu chua chay)."""
+    if not os.path.exists(BEST_PARAMS_PATH):
+        return None
+    with open(BEST_PARAMS_PATH, encoding='utf-8') as f:
+        return json.load(f)['best_params']
+
+
+def fit_final_model(data, best_params):
+    """BUOC 5: Huan luyen mo hinh cuoi cung voi tham so tot nhat."""
     print("\nHuan luyen mo hinh cuoi cung voi tham so tot nhat...")
-    
+
     # === SUA LOI O DAY ===
     # Them cac tham so co dinh vao best_params
+    best_params = dict(best_params)
     best_params['objective'] = 'binary:logistic'
-    best_params['eval_metric'] = 'logloss' 
-    best_params['n_estimators'] = 1000 
+    best_params['eval_metric'] = 'logloss'
+    best_params['n_estimators'] = 1000
     best_params['random_state'] = 42
     best_params['n_jobs'] = -1
     best_params['early_stopping_rounds'] = 50 # early_stopping_rounds PHAI dat o day
     # === KET THUC SUA ===
 
     final_model = xgb.XGBClassifier(**best_params)
-    
+
     final_model.fit(
-        X_train, y_train,
-        eval_set=[(X_val, y_val)], # Tham so nay PHAI co mat
+        data['X_train'], data['y_train'],
+        eval_set=[(data['X_val'], data['y_val'])], # Tham so nay PHAI co mat
         # early_stopping_rounds va eval_metric KHONG dat o day
         verbose=False,
-        sample_weight=sample_weights
+        sample_weight=data['sample_weights']
     )
-    
-    joblib.dump(final_model, MODEL_PATH)
-    print(f"Da luu mo hinh vao: {MODEL_PATH}")
+    return final_model, best_params
 
-    # --- BUOC 6: DANH GIA MO HINH TREN TAP TEST ---
+
+def evaluate_and_save(final_model, best_params, data, n_train, n_val, n_test, features=FEATURES):
+    """BUOC 6: Danh gia tren tap TEST, luu bao cao va goi model."""
     print("\nBat dau danh gia mo hinh tren tap TEST (du lieu chua tung thay)...")
-    
+
+    X_test, y_test = data['X_test'], data['y_test']
     y_pred = final_model.predict(X_test)
-    y_pred_proba = final_model.predict_proba(X_test)[:, 1] 
+    y_pred_proba = final_model.predict_proba(X_test)[:, 1]
 
     accuracy = accuracy_score(y_test, y_pred)
     report = classification_report(y_test, y_pred, target_names=['0_KhongNgap', '1_Ngap'])
     cm = confusion_matrix(y_test, y_pred)
-    
+
     report_content = f"""
     ==================================================================
     BAO CAO DANH GIA MO HINH (TREN TAP TEST)
     ==================================================================
-    
+
     Tong quan:
     - So diem tap Test: {len(y_test)}
     - Phan bo nhan tap Test:
     {y_test.value_counts().to_string()}
-    
+
     Do chinh xac tong a (Accuracy): {accuracy:.4f}
-    
+
     Ma tran nham lan (Confusion Matrix):
     {cm}
-    
+
     Chi tiet (Precision, Recall, F1-Score):
     {report}
-    
+
     Cac tham so da su dung:
     {best_params}
-    
+
     ==================================================================
     """
-    
+
     print(report_content)
     save_report(report_content)
 
-    # --- BUOC 7: GIAI THICH MO HINH (SHAP) ---
-    print("\nBat dau tinh toan gia tri SHAP (co the mat vai phut)...")
+    # Luu goi model kem scaler da fit va ket qua danh gia
+    save_model_bundle(
+        BUNDLE_DIR, final_model, data['scaler'], features,
+        metadata={
+            'params': best_params,
+            'test_accuracy': float(accuracy),
+            'n_train': n_train,
+            'n_val': n_val,
+            'n_test': n_test,
+            'data_path': DATASET_DIR,
+        }
+    )
+    print(f"Da luu goi model (model + scaler) vao: {BUNDLE_DIR}")
+
+
+def explain_model(model, X_train, y_train, features=FEATURES, strict=False):
+    """BUOC 7: Giai thich mo hinh (SHAP) tren 1 mau phan tang cua tap training.
+
+    `model`: XGBClassifier hoac xgb.Booster. Gia tri SHAP luu tai SHAP_DIR (kem chi
+    so dong cua `y_train`) va duoc dung lai neu model + du lieu khong doi; do thi
+    ve tu gia tri da luu. Loi: strict=True thi nem ra, nguoc lai chi in ra.
+    """
+    print("\nBat dau tinh toan gia tri SHAP...")
     try:
-        explainer = shap.TreeExplainer(final_model)
-        shap_values = explainer.shap_values(X_train)
-        
-        plot_shap_summary(shap_values, X_train, features)
+        result = compute_shap_values(
+            model, X_train, y_train, features, SHAP_DIR,
+            row_ids=y_train.index.to_numpy(), sample_size=SHAP_SAMPLES, n_workers=SHAP_WORKERS
+        )
+        plot_shap_summary(result['values'], result['data'], features)
     except Exception as e:
         print(f"Loi khi tinh toan hoac ve SHAP: {e}")
-    
+        if strict:
+            raise
+
+
+# =============================================================================
+# HÀM HUẤN LUYỆN CHÍNH
+# =============================================================================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Huan luyen mo hinh du bao ngap.")
+    parser.add_argument('--stage', choices=STAGES, default='all',
+                        help="all: tat ca; tune: chi tim sieu tham so; train: huan luyen + danh gia "
+                             "voi tham so da tim; shap: chi giai thich goi model da luu")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print("Bat dau qua trinh huan luyen mo hinh...")
+
+    # --- BUOC 1: DOC VA PHAN CHIA DU LIEU ---
+    splits = load_splits()
+    if splits is None:
+        sys.exit(1)
+    train_df, val_df, test_df = splits
+
+    # --- BUOC 2 + 3: CHUAN HOA DU LIEU VA XU LY MAT CAN BANG ---
+    data = scale_splits(train_df, val_df, test_df)
+
+    if args.stage == 'shap':
+        # Giai thich goi model da luu (khong huan luyen lai)
+        bundle = load_model_bundle(BUNDLE_DIR, expected_features=FEATURES)
+        explain_model(bundle.booster, data['X_train'], data['y_train'], strict=True)
+        print(f"File SHAP plot: {SHAP_PLOT_PATH}")
+        return
+
+    # --- BUOC 4: TIM KIEM SIEU THAM SO (OPTUNA) ---
+    if args.stage == 'train':
+        best_params = load_best_params()
+        if best_params is None:
+            print(f"Loi: Chua co {BEST_PARAMS_PATH}. Chay '--stage tune' truoc.")
+            sys.exit(1)
+    else:
+        # Chay rieng buoc 'tune': loi phai lam lenh that bai (pipeline khong ghi nhan)
+        best_params = run_tuning(data, strict=args.stage == 'tune')
+        if args.stage == 'tune':
+            print(f"Da luu tham so tot nhat vao: {BEST_PARAMS_PATH}")
+            return
+
+    # --- BUOC 5: HUAN LUYEN MO HINH CUOI CUNG ---
+    final_model, best_params = fit_final_model(data, best_params)
+
+    # --- BUOC 6: DANH GIA MO HINH TREN TAP TEST ---
+    evaluate_and_save(final_model, best_params, data, len(train_df), len(val_df), len(test_df))
+
+    # --- BUOC 7: GIAI THICH MO HINH (SHAP) ---
+    if args.stage == 'all':
+        explain_model(final_model, data['X_train'], data['y_train'])
+
     print(f"\n==================================================================")
     print(f"HOAN TAT! Da huan luyen, danh gia va luu mo hinh.")
-    print(f"File mo hinh: {MODEL_PATH}")
-    print(f"File scaler: {SCALER_PATH}")
+    print(f"Goi mo hinh: {BUNDLE_DIR}")
     print(f"File bao cao: {REPORT_PATH}")
     print(f"File SHAP plot: {SHAP_PLOT_PATH}")
     print(f"==================================================================")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,298 @@
+"""Bo suy luan cay (numpy) cho model XGBoost, gop san StandardScaler vao nguong.
+
+Phuc vu 1 diem qua pandas -> StandardScaler.transform -> XGBClassifier.predict_proba
+ton nhieu thoi gian cho chi phi goi ham hon la duyet cay.
+
+CompiledTreeModel "trai phang" toan bo cay cua booster thanh cac mang numpy
+lien tuc (feature, threshold, left, right, default_left, leaf_value) va
+duyet TAT CA cay cung luc, moi buoc la 1 phep toan vector tren (so dong x so cay).
+
+StandardScaler don dieu tang theo tung dac trung (scale > 0):
+    (x - mean) / scale < t   <=>   x < t * scale + mean
+nen nguong cua cay duoc doi ve khong gian du lieu GOC. Khi du doan khong
+can chuan hoa, khong can pandas hay sklearn.
+
+XGBoost ep du lieu da chuan hoa ve float32 roi moi so sanh voi nguong t
+(cung la float32, thuong trung dung 1 gia tri du lieu). Dieu kien
+f32(v) < t tuong duong v < trung diem cua t va so float32 lien truoc t,
+nen nguong goc duoc tinh la mean + scale * trung_diem (float64) de re
+nhanh giong het XGBoost. Chay `python src/tree_inference.py` de kiem tra
+do lech so voi model hien tai va do toc do.
+"""
+import os
+import sys
+import json
+import glob
+import time
+
+import numpy as np
+
+# =============================================================================
+# BO SUY LUAN CAY (NUMPY) - GOP SAN STANDARDSCALER VAO NGUONG
+# =============================================================================
+# So phan tu (dong x cay) xu ly moi lan: du nho de nam trong cache CPU
+CHUNK_ELEMENTS = 2 ** 14
+
+
+def _parse_base_score(value):
+    """base_score trong JSON cua XGBoost co the la '5E-1' hoac '[5E-1]'."""
+    return float(str(value).strip('[]'))
+
+
+class CompiledTreeModel:
+    """Ensemble cay nhi phan (binary:logistic) luu duoi dang mang numpy."""
+
+    # Cac mang duoc luu ra dia (save/load), moi mang 1 file .npy
+    ARRAY_NAMES = ['feature', 'threshold', 'left', 'right', 'default_left',
+                   'children', 'leaf_value', 'roots']
+
+    def __init__(self, feature, threshold, left, right, default_left,
+                 leaf_value, roots, base_margin, max_depth, n_features, children=None):
+        self.feature = np.ascontiguousarray(feature, dtype=np.int32)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.int32)
+        self.right = np.ascontiguousarray(right, dtype=np.int32)
+        self.default_left = np.ascontiguousarray(default_left, dtype=bool)
+        # children[2*i] = nhanh phai, children[2*i + 1] = nhanh trai (1 lan gather moi buoc)
+        if children is None:
+            children = np.stack([self.right, self.left], axis=1).ravel()
+        self.children = np.ascontiguousarray(children, dtype=np.int32)
+        self.leaf_value = np.ascontiguousarray(leaf_value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.int32)
+        self.base_margin = float(base_margin)
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_booster_json(cls, model_json, mean=None, scale=None, n_trees=None):
+        """Bien dich tu JSON cua booster (booster.save_raw('json')).
+
+        Args:
+            model_json: dict JSON cua model XGBoost.
+            mean, scale: tham so StandardScaler de gop vao nguong (None = khong chuan hoa).
+            n_trees: chi dung n_trees cay dau (vd. best_iteration + 1).
+        """
+        learner = model_json['learner']
+        objective = learner['objective']['name']
+        if objective != 'binary:logistic':
+            raise ValueError(f"Chi ho tro 'binary:logistic', model dung '{objective}'")
+
+        trees = learner['gradient_booster']['model']['trees']
+        if n_trees is not None:
+            trees = trees[:n_trees]
+        n_features = int(learner['learner_model_param']['num_feature'])
+
+        mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+        scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+        if np.any(scale <= 0):
+            raise ValueError("scale cua StandardScaler phai > 0 de gop vao nguong")
+
+        features, thresholds, lefts, rights, defaults, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree in trees:
+            if any(split_type != 0 for split_type in tree['split_type']):
+                raise ValueError("Khong ho tro split dang categorical")
+
+            left = np.asarray(tree['left_children'], dtype=np.int64)
+            right = np.asarray(tree['right_children'], dtype=np.int64)
+            feat = np.asarray(tree['split_indices'], dtype=np.int64)
+            cond32 = np.asarray(tree['split_conditions'], dtype=np.float32)
+            cond = cond32.astype(np.float64)
+            is_leaf = left == -1
+            node_ids = np.arange(len(left))
+
+            # Bien cua phep lam tron float32: f32(v) < t  <=>  v < (prev_f32(t) + t) / 2
+            boundary = (np.nextafter(cond32, np.float32(-np.inf)).astype(np.float64) + cond) / 2
+
+            # La tu tro ve chinh no -> duyet dung max_depth buoc cho moi cay
+            features.append(np.where(is_leaf, 0, feat))
+            thresholds.append(np.where(is_leaf, 0.0, boundary * scale[feat] + mean[feat]))
+            lefts.append(np.where(is_leaf, node_ids, left) + offset)
+            rights.append(np.where(is_leaf, node_ids, right) + offset)
+            defaults.append(np.asarray(tree['default_left'], dtype=bool))
+            values.append(np.where(is_leaf, cond, 0.0))
+            roots.append(offset)
+
+            depth = np.zeros(len(left), dtype=np.int64)
+            for node in node_ids:
+                if not is_leaf[node]:
+                    depth[left[node]] = depth[node] + 1
+                    depth[right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+            offset += len(left)
+
+        base_score = _parse_base_score(learner['learner_model_param']['base_score'])
+        base_margin = np.log(base_score / (1.0 - base_score))
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            default_left=np.concatenate(defaults),
+            leaf_value=np.concatenate(values),
+            roots=np.asarray(roots),
+            base_margin=base_margin,
+            max_depth=max_depth,
+            n_features=n_features,
+        )
+
+    @classmethod
+    def from_xgb_model(cls, model, scaler=None):
+        """Bien dich tu XGBClassifier (+ StandardScaler da fit), dung best_iteration neu co."""
+        booster = model.get_booster()
+        n_trees = None
+        best_iteration = getattr(model, 'best_iteration', None)
+        if best_iteration is not None:
+            n_trees = int(best_iteration) + 1
+        mean = getattr(scaler, 'mean_', None) if scaler is not None else None
+        scale = getattr(scaler, 'scale_', None) if scaler is not None else None
+        model_json = json.loads(booster.save_raw('json'))
+        return cls.from_booster_json(model_json, mean=mean, scale=scale, n_trees=n_trees)
+
+    def save(self, directory):
+        """Luu cac mang ra `directory` (moi mang 1 file .npy) kem compiled.json."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAY_NAMES:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        meta = {
+            'base_margin': self.base_margin,
+            'max_depth': self.max_depth,
+            'n_features': self.n_features,
+            'n_trees': self.n_trees,
+        }
+        with open(os.path.join(directory, 'compiled.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Doc lai model da luu; mmap_mode='r' de cac worker dung chung trang bo nho."""
+        with open(os.path.join(directory, 'compiled.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in cls.ARRAY_NAMES
+        }
+        return cls(
+            base_margin=meta['base_margin'],
+            max_depth=meta['max_depth'],
+            n_features=meta['n_features'],
+            **arrays
+        )
+
+    def predict_margin(self, X):
+        """Tong gia tri la + base_margin cho ma tran X (dac trung GOC, chua chuan hoa)."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Can {self.n_features} dac trung, nhan {X.shape[1]}")
+
+        margins = np.empty(len(X), dtype=np.float64)
+        chunk_rows = max(1, CHUNK_ELEMENTS // max(self.n_trees, 1))
+        for start in range(0, len(X), chunk_rows):
+            X_chunk = np.ascontiguousarray(X[start:start + chunk_rows])
+            X_flat = X_chunk.ravel()
+            row_offsets = (np.arange(len(X_chunk), dtype=np.int32) * self.n_features)[:, None]
+            has_nan = np.isnan(X_flat).any()
+            nodes = np.broadcast_to(self.roots, (len(X_chunk), self.n_trees))
+            for _ in range(self.max_depth):
+                x = np.take(X_flat, row_offsets + np.take(self.feature, nodes))
+                go_left = x < np.take(self.threshold, nodes)
+                if has_nan:
+                    go_left |= np.isnan(x) & np.take(self.default_left, nodes)
+                nodes = np.take(self.children, 2 * nodes + go_left)
+            margins[start:start + len(X_chunk)] = np.take(self.leaf_value, nodes).sum(axis=1)
+        return margins + self.base_margin
+
+    def predict_proba(self, X):
+        """Xac suat lop 1 (ngap) cho tung dong cua X."""
+        return 1.0 / (1.0 + np.exp(-self.predict_margin(X)))
+
+
+# =============================================================================
+# KIEM TRA DO KHOP VA DO TOC DO (chay: python src/tree_inference.py)
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'raw_exports'))
+
+# Do lech xac suat toi da chap nhan duoc so voi XGBoost (sai so float32)
+PARITY_TOLERANCE = 1e-5
+# Kich thuoc lo dung de do toc do
+BENCHMARK_BATCH_SIZES = [1, 10, 100, 1000, 10000, 65536]
+
+
+def _time_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    import pandas as pd
+    from model_bundle import BUNDLE_DIR, BOOSTER_MIN_ROWS, load_model_bundle
+
+    print(f"Tai goi model: {BUNDLE_DIR}")
+    bundle = load_model_bundle(BUNDLE_DIR)
+    n_trees = bundle.manifest['n_trees']
+    scaler = bundle.scaler_params
+
+    # Bien dich lai tu booster goc (kiem tra bo bien dich, khong chi file compiled/ da luu)
+    start = time.perf_counter()
+    engine = CompiledTreeModel.from_booster_json(
+        json.loads(bundle.booster.save_raw('json')),
+        mean=scaler['mean'], scale=scaler['scale'], n_trees=n_trees,
+    )
+    print(f"Bien dich {engine.n_trees} cay ({len(engine.feature)} nut, do sau {engine.max_depth}) "
+          f"trong {time.perf_counter() - start:.2f}s")
+
+    raw_files = sorted(glob.glob(os.path.join(RAW_DATA_DIR, '*.csv'))
+                       + glob.glob(os.path.join(RAW_DATA_DIR, '*.parquet')))
+    df = pd.concat(
+        [pd.read_parquet(f) if f.endswith('.parquet') else pd.read_csv(f) for f in raw_files],
+        ignore_index=True
+    )
+    X = df[bundle.features].dropna().to_numpy(dtype=np.float64)
+    print(f"Du lieu kiem tra: {len(X)} dong tu {len(raw_files)} file")
+
+    # --- 1. Do khop (parity) so voi booster XGBoost cua goi ---
+    expected = bundle.predict_proba_booster(X)
+    failed = []
+    for name, actual in [('bien dich lai', engine.predict_proba(X)),
+                         ('compiled/ cua goi', bundle.inference_model.predict_proba(X))]:
+        diff = np.abs(expected - actual)
+        n_mismatch = int(np.sum(diff > PARITY_TOLERANCE))
+        same_label = np.mean((expected >= 0.5) == (actual >= 0.5)) * 100
+        print(f"\n[{name}] Do lech xac suat: max={diff.max():.2e}, mean={diff.mean():.2e}, "
+              f"so dong lech > {PARITY_TOLERANCE:g}: {n_mismatch}/{len(X)}, "
+              f"trung nhan (nguong 0.5): {same_label:.3f}%")
+        if n_mismatch:
+            print("LOI: Co dong lech vuot nguong, kiem tra lai goi model.")
+            failed.append(name)
+
+    # --- 2. Do toc do theo kich thuoc lo ---
+    print(f"\n{'So dong':>8} | {'Compiled':>12} | {'XGBoost':>12} | "
+          f"{'predict_proba':>13} (XGBoost tu {BOOSTER_MIN_ROWS} dong)")
+    for n_rows in BENCHMARK_BATCH_SIZES:
+        # Lap lai du lieu neu lo lon hon tap kiem tra (vd. 1 tile 256x256)
+        batch = np.resize(X, (n_rows, X.shape[1]))
+        repeat = max(3, min(200, 20000 // n_rows))
+        t_compiled = _time_call(lambda: bundle.inference_model.predict_proba(batch), repeat)
+        t_booster = _time_call(lambda: bundle.predict_proba_booster(batch), repeat)
+        t_routed = _time_call(lambda: bundle.predict_proba(batch), repeat)
+        print(f"{n_rows:>8} | {t_compiled * 1e3:>9.3f} ms | {t_booster * 1e3:>9.3f} ms | "
+              f"{t_routed * 1e3:>10.3f} ms")
+
+    if failed:
+        print(f"\nTHAT BAI: do lech vuot {PARITY_TOLERANCE:g} ({', '.join(failed)}).")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Tim kiem sieu tham so song song (Optuna + XGBoost).
+
+- Ma tran train / validation duoc ghi 1 lan thanh file .npy; moi tien trinh
+  con mo chung bang memory-map (khong sao chep) va tao QuantileDMatrix 1 lan
+  cho tat ca trial cua no (khong chuyen doi lai moi trial).
+- Cac tien trinh dung chung 1 study qua storage SQLite; so trial con thieu
+  duoc chia truoc cho tung tien trinh, nen tong so trial (hoan thanh + bi
+  cat) dung bang `n_trials`.
+- Trial xep san (WAITING: khoi dong tu study truoc, chay lai trial bi ngat)
+  chay truoc trong 1 tien trinh: SQLite khong khoa dong khi doc, nhieu tien
+  trinh co the lay cung 1 trial WAITING (mat trial, UpdateFinishedTrialError).
+- Moi trial dang chay gui heartbeat; trial cua lan chay bi ngat (mat
+  heartbeat) duoc danh dau FAIL va xep chay lai voi cung tham so.
+- Study luu lai tren dia, ten theo fingerprint cua du lieu + dac trung:
+  chay lai thi tiep tuc, du lieu moi thi khoi dong tu study truoc.
+- Moi `REPORT_EVERY` vong, F1 (lop 1) tren tap validation duoc bao cho
+  Optuna; MedianPruner dung som cac trial kem.
+"""
+import os
+import json
+import shutil
+import hashlib
+import datetime
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import optuna
+import xgboost as xgb
+
+# =============================================================================
+# TIM KIEM SIEU THAM SO SONG SONG (OPTUNA + XGBOOST)
+# =============================================================================
+N_ESTIMATORS = 1000
+EARLY_STOPPING_ROUNDS = 50
+RANDOM_STATE = 42
+REPORT_EVERY = 25             # so vong giua 2 lan bao F1 trung gian
+PRUNER_STARTUP_TRIALS = 5     # khong cat trial nao truoc khi co du so trial nay
+PRUNER_WARMUP_STEPS = 50      # khong cat truoc vong nay
+# Tang khi doi suggest_params(): tham so cua study cu khong con dung de khoi dong
+SEARCH_SPACE_VERSION = 1
+HEARTBEAT_INTERVAL = 10       # giay giua 2 heartbeat cua trial dang chay
+HEARTBEAT_GRACE_PERIOD = 30   # giay khong co heartbeat -> trial bi coi la da chet
+MAX_TRIAL_RETRIES = 2         # so lan chay lai toi da 1 trial bi ngat
+
+
+def suggest_params(trial):
+    """Khong gian tim kiem; ten tham so theo XGBClassifier (dung lai cho mo hinh cuoi cung)."""
+    return {
+        'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3),
+        'max_depth': trial.suggest_int('max_depth', 3, 10),
+        'subsample': trial.suggest_float('subsample', 0.5, 1.0),
+        'colsample_bytree': trial.suggest_float('colsample_bytree', 0.5, 1.0),
+        'gamma': trial.suggest_float('gamma', 0, 5),
+        'reg_alpha': trial.suggest_float('reg_alpha', 0, 5),
+        'reg_lambda': trial.suggest_float('reg_lambda', 0, 5),
+    }
+
+
+def f1_positive(y_true, y_pred):
+    """F1 cua lop 1 (giong classification_report(...)['1']['f1-score'])."""
+    tp = np.count_nonzero((y_pred == 1) & (y_true == 1))
+    fp = np.count_nonzero((y_pred == 1) & (y_true == 0))
+    fn = np.count_nonzero((y_pred == 0) & (y_true == 1))
+    return 2 * tp / (2 * tp + fp + fn) if tp else 0.0
+
+
+class F1PruningCallback(xgb.callback.TrainingCallback):
+    """Bao F1 validation cho Optuna moi `every` vong; raise TrialPruned neu trial kem."""
+
+    def __init__(self, trial, dval, y_val, every=REPORT_EVERY):
+        self.trial = trial
+        self.dval = dval
+        self.y_val = y_val
+        self.every = every
+
+    def after_iteration(self, model, epoch, evals_log):
+        if (epoch + 1) % self.every:
+            return False
+        proba = model.predict(self.dval, iteration_range=(0, epoch + 1))
+        self.trial.report(f1_positive(self.y_val, (proba > 0.5).astype(np.int8)), epoch + 1)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned()
+        return False
+
+
+# -----------------------------------------------------------------------------
+# Tien trinh con
+# -----------------------------------------------------------------------------
+_worker = {}
+
+
+def _load_worker_data(data_dir, nthread):
+    arrays = {
+        name: np.load(os.path.join(data_dir, f"{name}.npy"), mmap_mode='r')
+        for name in ('X_train', 'y_train', 'w_train', 'X_val', 'y_val')
+    }
+    dtrain = xgb.QuantileDMatrix(arrays['X_train'], label=arrays['y_train'],
+                                 weight=arrays['w_train'], nthread=nthread)
+    # Validation dung chung cac diem cat (quantile) cua tap train
+    dval = xgb.QuantileDMatrix(arrays['X_val'], label=arrays['y_val'], ref=dtrain,
+                               nthread=nthread)
+    _worker.update(dtrain=dtrain, dval=dval, y_val=np.asarray(arrays['y_val']), nthread=nthread)
+
+
+def objective(trial):
+    params = {
+        'objective': 'binary:logistic',
+        'eval_metric': 'logloss',
+        'seed': RANDOM_STATE,
+        'nthread': _worker['nthread'],
+        **suggest_params(trial),
+    }
+    booster = xgb.train(
+        params, _worker['dtrain'],
+        num_boost_round=N_ESTIMATORS,
+        evals=[(_worker['dval'], 'validation')],
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS,
+        callbacks=[F1PruningCallback(trial, _worker['dval'], _worker['y_val'])],
+        verbose_eval=False,
+    )
+    # Giong XGBClassifier.predict: dung so cay tot nhat cua early stopping
+    proba = booster.predict(_worker['dval'], iteration_range=(0, booster.best_iteration + 1))
+    trial.set_user_attr('best_iteration', int(booster.best_iteration))
+    return f1_positive(_worker['y_val'], (proba > 0.5).astype(np.int8))
+
+
+def _run_worker(data_dir, storage_url, study_name, n_trials, nthread):
+    """Chay dung `n_trials` trial (phan da chia cho tien trinh nay)."""
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    _load_worker_data(data_dir, nthread)
+    # Khong xep lai trial bi ngat o day (chi tien trinh chinh lam, xem make_storage)
+    study = optuna.load_study(study_name=study_name, storage=make_storage(storage_url, retry=False),
+                              pruner=make_pruner())
+    study.optimize(objective, n_trials=n_trials)
+
+
+def make_storage(storage_url, retry=True):
+    """Storage SQLite co heartbeat: trial mat heartbeat -> FAIL (retry=True: xep chay lai)."""
+    callback = optuna.storages.RetryHeartbeatStaleTrialCallback(max_retry=MAX_TRIAL_RETRIES) if retry else None
+    return optuna.storages.RDBStorage(
+        storage_url,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        grace_period=HEARTBEAT_GRACE_PERIOD,
+        heartbeat_stale_trial_callback=callback,
+    )
+
+
+def make_pruner():
+    return optuna.pruners.MedianPruner(
+        n_startup_trials=PRUNER_STARTUP_TRIALS, n_warmup_steps=PRUNER_WARMUP_STEPS
+    )
+
+
+# -----------------------------------------------------------------------------
+# Ham chinh
+# -----------------------------------------------------------------------------
+def prepare_arrays(X_train, y_train, w_train, X_val, y_val):
+    """Ep kieu ma tran (float32 / int8) truoc khi ghi va tinh fingerprint."""
+    return {
+        'X_train': np.ascontiguousarray(X_train, dtype=np.float32),
+        'y_train': np.asarray(y_train, dtype=np.int8),
+        'w_train': np.asarray(w_train, dtype=np.float32),
+        'X_val': np.ascontiguousarray(X_val, dtype=np.float32),
+        'y_val': np.asarray(y_val, dtype=np.int8),
+    }
+
+
+def write_shared_matrices(data_dir, arrays):
+    """Ghi ma tran ra .npy de cac tien trinh memory-map."""
+    os.makedirs(data_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(data_dir, f"{name}.npy"), array)
+
+
+def study_fingerprint(arrays, features):
+    """Ma cua (du lieu train/val, bo dac trung, khong gian tim kiem): cung ma -> cung study."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'features': list(features),
+        'search_space_version': SEARCH_SPACE_VERSION,
+    }, sort_keys=True).encode())
+    for name in sorted(arrays):
+        array = arrays[name]
+        digest.update(f"{name}:{array.dtype}:{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _recover_interrupted(study):
+    """Trial cua lan chay bi ngat (qua HEARTBEAT_GRACE_PERIOD khong co heartbeat) -> FAIL,
+    RetryHeartbeatStaleTrialCallback xep chay lai voi cung tham so.
+
+    Trial chua qua thoi gian cho thi tien trinh con danh dau FAIL sau (khong xep lai);
+    so trial can chay chi tinh trial hoan thanh / bi cat nen ngan sach khong doi.
+    """
+    running = (optuna.trial.TrialState.RUNNING,)
+    before = len(study.get_trials(deepcopy=False, states=running))
+    optuna.storages.fail_stale_trials(study)
+    recovered = before - len(study.get_trials(deepcopy=False, states=running))
+    if recovered:
+        print(f"{recovered} trial bi ngat o lan chay truoc, se chay lai.")
+
+
+def _previous_best_params(storage, study_name, top_k):
+    """Tham so cua `top_k` trial tot nhat trong study gan nhat khac (cung khong gian tim kiem)."""
+    candidates = []
+    for summary in optuna.get_all_study_summaries(storage=storage):
+        attrs = summary.user_attrs
+        if (summary.study_name == study_name or summary.best_trial is None
+                or attrs.get('search_space_version') != SEARCH_SPACE_VERSION):
+            continue
+        candidates.append((attrs.get('created_at', ''), summary.study_name))
+    if not candidates:
+        return None, []
+    _, previous_name = max(candidates)
+    previous = optuna.load_study(study_name=previous_name, storage=storage)
+    completed = previous.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,))
+    best = sorted(completed, key=lambda trial: trial.value, reverse=True)[:top_k]
+    return previous_name, [trial.params for trial in best]
+
+
+def tune_hyperparameters(X_train, y_train, w_train, X_val, y_val, features, n_trials=50,
+                         n_workers=None, storage_path=None, warm_start_trials=None,
+                         warm_start_top_k=5):
+    """Tim sieu tham so XGBoost toi da F1 (lop 1) tren tap validation.
+
+    Study duoc luu trong SQLite `storage_path`, ten theo study_fingerprint():
+    chay lai voi cung du lieu se tiep tuc study cu (chi chay so trial con
+    thieu). Study moi duoc khoi dong bang `warm_start_top_k` tham so tot nhat
+    cua study gan nhat va chi chay `warm_start_trials` trial.
+
+    Args:
+        X_train, y_train, w_train: tap train va sample_weight.
+        X_val, y_val: tap validation (early stopping + diem danh gia).
+        features: ten dac trung (thuoc fingerprint).
+        n_trials: tong so trial (hoan thanh + bi cat) cua study moi khong co study truoc.
+        n_workers: so tien trinh (mac dinh: so CPU, toi da n_trials).
+        storage_path: file SQLite luu study (None = thu muc tam, khong luu lai).
+        warm_start_trials: so trial cua study khoi dong tu study truoc (None = n_trials).
+        warm_start_top_k: so tham so tot nhat duoc xep chay truoc.
+
+    Returns:
+        (best_params, best_value): tham so tot nhat va F1 tuong ung.
+    """
+    arrays = prepare_arrays(X_train, y_train, w_train, X_val, y_val)
+    fingerprint = study_fingerprint(arrays, features)
+    study_name = f"flood_xgboost_{fingerprint}"
+
+    work_dir = tempfile.mkdtemp(prefix='flood_tuning_')
+    try:
+        if storage_path is None:
+            storage_path = os.path.join(work_dir, 'study.db')
+        os.makedirs(os.path.dirname(os.path.abspath(storage_path)), exist_ok=True)
+        storage_url = f"sqlite:///{os.path.abspath(storage_path)}"
+
+        storage = make_storage(storage_url)
+        existing = {s.study_name for s in optuna.get_all_study_summaries(storage=storage)}
+        study = optuna.create_study(
+            study_name=study_name, storage=storage, direction='maximize',
+            pruner=make_pruner(), load_if_exists=True,
+        )
+        if study_name in existing:
+            _recover_interrupted(study)
+            budget = study.user_attrs.get('n_trials', n_trials)
+            print(f"Tiep tuc study {study_name} ({len(study.trials)} trial da co, muc tieu {budget}).")
+        else:
+            previous_name, warm_params = _previous_best_params(storage_url, study_name, warm_start_top_k)
+            for params in warm_params:
+                study.enqueue_trial(params, skip_if_exists=True)
+            budget = max(warm_start_trials or n_trials, len(warm_params)) if warm_params else n_trials
+            study.set_user_attr('fingerprint', fingerprint)
+            study.set_user_attr('features', list(features))
+            study.set_user_attr('search_space_version', SEARCH_SPACE_VERSION)
+            study.set_user_attr('created_at', datetime.datetime.now(datetime.timezone.utc).isoformat())
+            study.set_user_attr('n_trials', budget)
+            study.set_user_attr('warm_start_from', previous_name)
+            if warm_params:
+                print(f"Study moi {study_name}: khoi dong tu {len(warm_params)} tham so tot nhat "
+                      f"cua {previous_name}, {budget} trial.")
+            else:
+                print(f"Study moi {study_name}: {budget} trial.")
+
+        finished = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+        remaining = budget - len(study.get_trials(deepcopy=False, states=finished))
+        data_dir = os.path.join(work_dir, 'matrices')
+        if remaining > 0:
+            write_shared_matrices(data_dir, arrays)
+
+        # Trial xep san chay tuan tu trong 1 tien trinh (dung het CPU cho xgboost)
+        n_queued = min(remaining, len(study.get_trials(
+            deepcopy=False, states=(optuna.trial.TrialState.WAITING,))))
+        if n_queued:
+            print(f"Chay {n_queued} trial xep san trong 1 tien trinh...")
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                pool.submit(_run_worker, data_dir, storage_url, study_name, n_queued,
+                            os.cpu_count() or 1).result()
+            remaining -= n_queued
+
+        if remaining > 0:
+            n_workers = max(1, min(n_workers or os.cpu_count() or 1, remaining))
+            # Chia deu CPU cho cac tien trinh (moi xgboost dung nthread luong)
+            nthread = max(1, (os.cpu_count() or 1) // n_workers)
+
+            print(f"Chay {remaining} trial tren {n_workers} tien trinh ({nthread} luong / tien trinh)...")
+            # Moi tien trinh nhan truoc phan trial cua minh -> tong dung bang `remaining`
+            shares = [remaining // n_workers + (i < remaining % n_workers) for i in range(n_workers)]
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [
+                    pool.submit(_run_worker, data_dir, storage_url, study_name, share, nthread)
+                    for share in shares
+                ]
+                for future in futures:
+                    future.result()
+
+        states = [trial.state for trial in study.trials]
+        print(f"Trial hoan thanh: {states.count(optuna.trial.TrialState.COMPLETE)}, "
+              f"bi cat som: {states.count(optuna.trial.TrialState.PRUNED)}, "
+              f"loi: {states.count(optuna.trial.TrialState.FAIL)}")
+        return study.best_params, study.best_value
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,5 +1,10 @@
+import os
+import hashlib
+import numpy as np
 import pandas as pd
 
+from dataset import PROCESSED_DATA_DIR, load_dataset, dataset_version
+
 # Mapping cho land_cover
 LAND_COVER_MAPPING = {
     0: "Không có dữ liệu",
@@ -32,6 +37,32 @@ FLOOD_RISK_MAPPING = {
     100: "thấp"
 }
 
+# Bang tra 256 phan tu, chi so = ma land_cover (0-255) -> ma category (-1 = khong co)
+def _lookup_categories(mapping):
+    categories = list(dict.fromkeys(mapping.values()))
+    lookup = np.full(256, -1, dtype=np.int16)
+    for code, label in mapping.items():
+        lookup[code] = categories.index(label)
+    return categories, lookup
+
+LAND_COVER_CATEGORIES, LAND_COVER_LOOKUP = _lookup_categories(LAND_COVER_MAPPING)
+FLOOD_RISK_CATEGORIES, FLOOD_RISK_LOOKUP = _lookup_categories(FLOOD_RISK_MAPPING)
+
+def _lookup_labels(codes, categories, lookup):
+    """Tra bang 256 phan tu cho mang ma -> pandas.Categorical (ma la / NaN -> NaN)."""
+    codes = np.asarray(codes, dtype=np.float64)
+    valid = np.isfinite(codes) & (codes >= 0) & (codes <= 255) & (codes == np.floor(codes))
+    index = np.where(valid, codes, 0).astype(np.intp)
+    return pd.Categorical.from_codes(np.where(valid, lookup[index], -1), categories=categories)
+
+def landcover_names(codes):
+    """Tên lớp phủ tiếng Việt (Categorical) cho mảng mã land_cover."""
+    return _lookup_labels(codes, LAND_COVER_CATEGORIES, LAND_COVER_LOOKUP)
+
+def flood_risk_labels(codes):
+    """Mức độ rủi ro ngập (Categorical) cho mảng mã land_cover."""
+    return _lookup_labels(codes, FLOOD_RISK_CATEGORIES, FLOOD_RISK_LOOKUP)
+
 def add_landcover_labels(df):
     """Thêm cột tên lớp phủ và mức độ rủi ro ngập vào DataFrame.
     
@@ -39,26 +70,59 @@ def add_landcover_labels(df):
         df (pandas.DataFrame): DataFrame có cột 'land_cover'
     
     Returns:
-        pandas.DataFrame: DataFrame với thêm 2 cột mới:
+        pandas.DataFrame: bản sao của DataFrame (không sửa DataFrame gốc) với thêm 2 cột
+        dạng category:
             - land_cover_name: tên lớp phủ tiếng Việt
             - flood_risk: mức độ rủi ro ngập
     """
     if 'land_cover' not in df.columns:
         raise ValueError("DataFrame phải có cột 'land_cover'")
     
-    # Thêm tên lớp phủ tiếng Việt
-    df['land_cover_name'] = df['land_cover'].map(LAND_COVER_MAPPING)
-    
-    # Thêm mức độ rủi ro ngập
-    df['flood_risk'] = df['land_cover'].map(FLOOD_RISK_MAPPING)
-    
-    return df
+    codes = df['land_cover'].to_numpy()
+    return df.assign(
+        land_cover_name=pd.Series(landcover_names(codes), index=df.index),
+        flood_risk=pd.Series(flood_risk_labels(codes), index=df.index),
+    )
+
+def summarize_groupings(df, groupings):
+    """Tính số mẫu, số mẫu ngập và tỷ lệ ngập cho nhiều cách nhóm trong 1 lần groupby.
+
+    Nhóm 1 lần theo hợp của tất cả các cột, sau đó mỗi cách nhóm chỉ là cộng
+    dồn trên bảng kết quả (rất nhỏ) thay vì quét lại toàn bộ dữ liệu.
+
+    Args:
+        df (pandas.DataFrame): DataFrame có cột 'flood' và các cột dùng để nhóm
+        groupings (list): danh sách các cách nhóm, vd. [['land_cover'], ['event_id', 'purpose']]
+
+    Returns:
+        dict: tuple(cột) -> DataFrame (index theo các cột nhóm) với các cột
+            total_samples, flood_samples, flood_ratio (%)
+    """
+    groupings = [tuple(g) for g in groupings]
+    columns = list(dict.fromkeys(col for g in groupings for col in g))
+    missing = set(columns + ['flood']) - set(df.columns)
+    if missing:
+        raise ValueError(f"DataFrame thiếu các cột: {sorted(missing)}")
+
+    base = df.groupby(columns, observed=True, dropna=False)['flood'].agg(
+        total_samples='size', flood_samples='sum'
+    )
 
-def summarize_landcover(df):
+    summaries = {}
+    for grouping in groupings:
+        table = base.groupby(level=list(grouping), observed=True).sum()
+        table['flood_samples'] = table['flood_samples'].astype(np.int64)
+        table['flood_ratio'] = (table['flood_samples'] / table['total_samples'] * 100).round(2)
+        summaries[grouping] = table
+    return summaries
+
+def summarize_landcover(df, summary=None):
     """Tạo bảng tổng kết về phân bố lớp phủ và tỷ lệ ngập.
     
     Args:
         df (pandas.DataFrame): DataFrame có các cột: 'land_cover', 'flood'
+        summary (pandas.DataFrame): bảng theo 'land_cover' đã tính sẵn bởi
+            summarize_groupings (nếu có thì không quét lại df)
     
     Returns:
         pandas.DataFrame: Bảng tổng kết với các cột:
@@ -67,22 +131,52 @@ def summarize_landcover(df):
             - flood_samples: số mẫu bị ngập
             - flood_ratio: tỷ lệ ngập (%)
     """
-    if not {'land_cover', 'flood'}.issubset(df.columns):
-        raise ValueError("DataFrame phải có cả 2 cột 'land_cover' và 'flood'")
-    
-    # Thêm tên lớp phủ
-    df = add_landcover_labels(df)
-    
-    # Tạo bảng tổng kết
-    summary = df.groupby('land_cover_name').agg({
-        'land_cover': 'count',
-        'flood': 'sum'
-    }).rename(columns={
-        'land_cover': 'total_samples',
-        'flood': 'flood_samples'
-    })
-    
-    # Tính tỷ lệ ngập
-    summary['flood_ratio'] = (summary['flood_samples'] / summary['total_samples'] * 100).round(2)
+    if summary is None:
+        if not {'land_cover', 'flood'}.issubset(df.columns):
+            raise ValueError("DataFrame phải có cả 2 cột 'land_cover' và 'flood'")
+        summary = summarize_groupings(df, [['land_cover']])[('land_cover',)]
+
+    # Gắn tên lớp phủ cho bảng nhỏ (mã không có tên bị bỏ qua)
+    names = pd.Series(landcover_names(summary.index.to_numpy()), index=summary.index)
+    summary = summary[names.notna().to_numpy()]
+    summary.index = pd.Index(names.dropna().astype(str).to_numpy(), name='land_cover_name')
     
-    return summary.sort_values('total_samples', ascending=False)
\ No newline at end of file
+    return summary.sort_values('total_samples', ascending=False)
+
+# Bang tong ket da tinh, luu theo phien ban bo du lieu
+SUMMARY_CACHE_DIR = os.path.join(PROCESSED_DATA_DIR, 'summary_cache')
+_summary_cache = {}
+
+def load_summaries(groupings):
+    """Bảng tổng kết cho nhiều cách nhóm trên toàn bộ dữ liệu đã xử lý, có cache.
+
+    Cache (trong bộ nhớ và trên đĩa) theo phiên bản bộ dữ liệu: chỉ tính lại
+    khi combine_data.py thay đổi dữ liệu; chỉ đọc các cột cần thiết.
+
+    Args:
+        groupings (list): như summarize_groupings, vd. [['land_cover'], ['event_id', 'purpose']]
+
+    Returns:
+        dict: tuple(cột) -> DataFrame tổng kết
+    """
+    groupings = tuple(tuple(g) for g in groupings)
+    version = dataset_version()
+    key = (version, groupings)
+    if version is not None and key in _summary_cache:
+        return _summary_cache[key]
+
+    cache_path = None
+    if version is not None:
+        digest = hashlib.sha1(repr(groupings).encode('utf-8')).hexdigest()[:12]
+        cache_path = os.path.join(SUMMARY_CACHE_DIR, f"{version}_{digest}.pkl")
+        if os.path.exists(cache_path):
+            _summary_cache[key] = pd.read_pickle(cache_path)
+            return _summary_cache[key]
+
+    columns = list(dict.fromkeys(col for g in groupings for col in g)) + ['flood']
+    summaries = summarize_groupings(load_dataset(columns=columns), groupings)
+    if cache_path is not None:
+        os.makedirs(SUMMARY_CACHE_DIR, exist_ok=True)
+        pd.to_pickle(summaries, cache_path)
+        _summary_cache[key] = summaries
+    return summaries
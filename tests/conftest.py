@@ -0,0 +1,60 @@
+import os
+import sys
+import datetime
+
+import numpy as np
+import pytest
+
+# Cac module trong src/ va app/ import lan nhau theo ten (giong khi chay script)
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for path in (os.path.join(ROOT_DIR, 'src'), os.path.join(ROOT_DIR, 'app')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Luoi dac trung tong hop: 6 x 8 pixel 0.01 do, goc tren-trai (lat 21.0, lon 105.0)
+GRID_SHAPE = (6, 8)
+GRID_ORIGIN = (105.0, 21.0)
+GRID_RESOLUTION = 0.01
+
+
+def make_grid_layers(n_days, seed=0):
+    """Cac lop ngau nhien (seed co dinh) cho save_local_grid."""
+    rng = np.random.RandomState(seed)
+    height, width = GRID_SHAPE
+    layers = {
+        'elevation': rng.uniform(0, 50, GRID_SHAPE),
+        'slope': rng.uniform(0, 10, GRID_SHAPE),
+        'aspect': rng.uniform(0, 360, GRID_SHAPE),
+        'land_cover': rng.choice([10, 40, 50, 80, 90], GRID_SHAPE),
+        'soil_type': rng.randint(1, 12, GRID_SHAPE),
+        'precipitation': rng.gamma(0.5, 20.0, (n_days, height, width)),
+        'soil_moisture': rng.uniform(0.1, 0.5, (n_days, height, width)),
+    }
+    # SMAP khong co du lieu moi ngay
+    layers['soil_moisture'][rng.rand(n_days, height, width) < 0.3] = np.nan
+    return layers
+
+
+@pytest.fixture
+def synthetic_grid(tmp_path):
+    """Tao luoi cuc bo tong hop; tra ve (grid_dir, layers)."""
+    from feature_provider import save_local_grid
+
+    def build(start_date, n_days, seed=0, name='grid'):
+        layers = make_grid_layers(n_days, seed)
+        grid_dir = str(tmp_path / name)
+        save_local_grid(grid_dir, GRID_ORIGIN[0], GRID_ORIGIN[1], GRID_RESOLUTION,
+                        start_date.isoformat(), layers)
+        return grid_dir, layers
+
+    return build
+
+
+def pixel_center(row, col):
+    """(lat, lon) tam pixel (row, col) cua luoi tong hop."""
+    return (GRID_ORIGIN[1] - (row + 0.5) * GRID_RESOLUTION,
+            GRID_ORIGIN[0] + (col + 0.5) * GRID_RESOLUTION)
+
+
+def today_utc():
+    return datetime.datetime.now(datetime.timezone.utc).date()
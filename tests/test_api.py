@@ -0,0 +1,94 @@
+import os
+import sys
+import datetime
+import subprocess
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from conftest import ROOT_DIR, pixel_center, today_utc
+from feature_provider import FEATURES_ORDER, LocalRasterFeatureProvider
+
+N_DAYS = 60
+
+
+@pytest.fixture
+def client(synthetic_grid, monkeypatch):
+    """API voi nguon dac trung local tren luoi tong hop phu ngay hom nay."""
+    grid_dir, _ = synthetic_grid(today_utc() - datetime.timedelta(days=N_DAYS - 10), N_DAYS)
+    monkeypatch.setattr(api, 'feature_provider', LocalRasterFeatureProvider(grid_dir))
+    return TestClient(api.app)
+
+
+@pytest.fixture
+def stale_client(synthetic_grid, monkeypatch):
+    """Luoi tong hop da cu: ngay cuoi cua luoi truoc cua so mua hien tai."""
+    grid_dir, _ = synthetic_grid(today_utc() - datetime.timedelta(days=N_DAYS + 30), N_DAYS)
+    monkeypatch.setattr(api, 'feature_provider', LocalRasterFeatureProvider(grid_dir))
+    return TestClient(api.app)
+
+
+def test_predict_uses_local_grid(client):
+    lat, lon = pixel_center(2, 3)
+    response = client.post('/predict', json={'lat': lat, 'lon': lon})
+    assert response.status_code == 200
+    body = response.json()
+    assert 0.0 <= body['probability'] <= 1.0
+    expected = api.feature_provider.get_features(lat, lon)
+    for name in FEATURES_ORDER:
+        assert body['features'][name] == pytest.approx(expected[name])
+
+
+def test_batch_matches_single_predictions(client):
+    points = [pixel_center(r, c) for r, c in [(0, 0), (3, 5), (5, 7)]]
+    response = client.post('/predict/batch', json={'points': [{'lat': la, 'lon': lo} for la, lo in points]})
+    assert response.status_code == 200
+    batch = [p['probability'] for p in response.json()['predictions']]
+    single = [client.post('/predict', json={'lat': la, 'lon': lo}).json()['probability'] for la, lo in points]
+    np.testing.assert_allclose(batch, single, atol=1e-5)
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/predict', {'lat': 20.975, 'lon': 105.035}),
+    ('/predict/full', {'lat': 20.975, 'lon': 105.035}),
+    ('/predict/batch', {'points': [{'lat': 20.975, 'lon': 105.035}]}),
+])
+def test_stale_grid_returns_503(stale_client, path, payload):
+    response = stale_client.post(path, json=payload)
+    assert response.status_code == 503
+    assert 'cu' in response.json()['detail']
+
+
+@pytest.mark.parametrize('path', ['/predict', '/predict/full', '/forecast'])
+def test_point_without_data_returns_422(client, path):
+    response = client.post(path, json={'lat': 0.0, 'lon': 0.0})
+    assert response.status_code == 422
+    assert response.json()['detail'] == api.NO_FEATURE_DATA
+
+
+def test_batch_marks_points_without_data(client):
+    inside = pixel_center(1, 1)
+    response = client.post('/predict/batch', json={'points': [
+        {'lat': 0.0, 'lon': 0.0}, {'lat': inside[0], 'lon': inside[1]},
+    ]})
+    assert response.status_code == 200
+    outside_row, inside_row = response.json()['predictions']
+    assert outside_row['probability'] is None
+    assert outside_row['features'] is None
+    assert outside_row['error'] == api.NO_FEATURE_DATA
+    assert 0.0 <= inside_row['probability'] <= 1.0
+    assert 'error' not in inside_row
+
+
+def test_batch_with_only_points_without_data(client):
+    response = client.post('/predict/batch', json={'points': [{'lat': 0.0, 'lon': 0.0}]})
+    assert response.status_code == 200
+    assert response.json()['predictions'][0]['probability'] is None
+
+
+def test_app_imports_as_package_from_repo_root():
+    # Nhu `uvicorn app.api:app`: chi co thu muc goc tren sys.path, khong co src/ hay app/
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+    subprocess.run([sys.executable, '-c', 'import app.api'], cwd=ROOT_DIR, env=env, check=True)
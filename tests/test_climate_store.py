@@ -0,0 +1,165 @@
+import os
+import datetime
+
+import numpy as np
+import pytest
+
+from climate_store import SERIES, SOIL_MOISTURE_WINDOW_DAYS, ClimateCube, ingest
+from conftest import GRID_ORIGIN, GRID_RESOLUTION, GRID_SHAPE, make_grid_layers
+from rainfall import ANTECEDENT_WINDOWS
+
+START_DATE = datetime.date(2026, 7, 1)
+N_DAYS = 23
+CHUNK_DAYS = 5     # nho de moi cua so cat qua nhieu ranh gioi khoi
+BBOX = (GRID_ORIGIN[0], GRID_ORIGIN[1] - GRID_SHAPE[0] * GRID_RESOLUTION,
+        GRID_ORIGIN[0] + GRID_SHAPE[1] * GRID_RESOLUTION, GRID_ORIGIN[1])
+
+
+def day(i):
+    return START_DATE + datetime.timedelta(days=i)
+
+
+def build_cube(cube_dir, layers, n_days=N_DAYS):
+    cube = ClimateCube.create(cube_dir, START_DATE, bbox=BBOX, resolution=GRID_RESOLUTION,
+                              chunk_days=CHUNK_DAYS)
+    for i in range(n_days):
+        cube.append_day(day(i), layers['precipitation'][i], layers['soil_moisture'][i])
+    return cube
+
+
+def all_pixels():
+    rows, cols = np.indices(GRID_SHAPE)
+    return rows.ravel(), cols.ravel()
+
+
+@pytest.fixture
+def layers():
+    return make_grid_layers(N_DAYS, seed=1)
+
+
+@pytest.fixture
+def cube(tmp_path, layers):
+    return build_cube(str(tmp_path / 'cube'), layers)
+
+
+def test_cube_geometry_matches_grid(cube):
+    assert (cube.height, cube.width) == GRID_SHAPE
+    assert cube.n_days == N_DAYS
+    assert cube.end_date == day(N_DAYS)
+    rows, cols, valid = cube.pixel_index([GRID_ORIGIN[1] - 0.005, 0.0], [GRID_ORIGIN[0] + 0.015, 0.0])
+    assert (rows[0], cols[0], valid[0]) == (0, 1, True)
+    assert not valid[1]
+
+
+def test_window_sum_matches_brute_force_across_chunks(cube, layers):
+    rows, cols = all_pixels()
+    precipitation = layers['precipitation'][:, rows, cols]
+    sm = layers['soil_moisture'][:, rows, cols]
+    # Moi cua so [a, b) co the, ke ca cua so rong va cua so cat qua 1-4 ranh gioi khoi
+    for a in range(N_DAYS + 1):
+        for b in range(a, N_DAYS + 1):
+            np.testing.assert_allclose(
+                cube.window_sum('precipitation', rows, cols, day(a), day(b)),
+                precipitation[a:b].sum(axis=0), rtol=1e-10, atol=1e-9)
+            np.testing.assert_allclose(
+                cube.window_sum('soil_moisture_count', rows, cols, day(a), day(b)),
+                np.isfinite(sm[a:b]).sum(axis=0), atol=1e-9)
+            np.testing.assert_allclose(
+                cube.window_sum('soil_moisture', rows, cols, day(a), day(b)),
+                np.nansum(sm[a:b], axis=0), rtol=1e-10, atol=1e-9)
+
+
+def test_covers_and_window_sum_outside_cube(cube):
+    rows, cols = all_pixels()
+    assert cube.covers(day(0), day(N_DAYS))
+    assert not cube.covers(day(-1), day(3))
+    assert not cube.covers(day(3), day(N_DAYS + 1))
+    with pytest.raises(KeyError):
+        cube.window_sum('precipitation', rows, cols, day(N_DAYS - 3), day(N_DAYS + 1))
+
+
+def test_dynamic_features_match_numpy(cube, layers):
+    rows, cols = all_pixels()
+    end = N_DAYS - 2
+    features = cube.dynamic_features(rows, cols, day(end))
+
+    for name, days in ANTECEDENT_WINDOWS.items():
+        expected = layers['precipitation'][end - days:end, rows, cols].sum(axis=0)
+        np.testing.assert_allclose(features[name], expected, rtol=1e-10)
+
+    sm = layers['soil_moisture'][end - SOIL_MOISTURE_WINDOW_DAYS:end, rows, cols]
+    has_sm = np.isfinite(sm).any(axis=0)
+    expected_sm = np.where(has_sm, np.nanmean(np.where(has_sm, sm, 0.0), axis=0), 0.0)
+    np.testing.assert_allclose(features['soil_moisture'], expected_sm, rtol=1e-10)
+    np.testing.assert_array_equal(features['precip_total'], 0.0)
+
+
+def test_dynamic_features_without_smap_are_zero(tmp_path, layers):
+    layers['soil_moisture'][:] = np.nan
+    cube = build_cube(str(tmp_path / 'cube'), layers, n_days=SOIL_MOISTURE_WINDOW_DAYS + 14)
+    rows, cols = all_pixels()
+    features = cube.dynamic_features(rows, cols, cube.end_date)
+    np.testing.assert_array_equal(features['soil_moisture'], 0.0)
+
+
+def test_append_day_rejects_gaps_and_wrong_shape(cube, layers):
+    with pytest.raises(ValueError):
+        cube.append_day(day(N_DAYS + 1), layers['precipitation'][0], layers['soil_moisture'][0])
+    with pytest.raises(ValueError):
+        cube.append_day(day(N_DAYS), layers['precipitation'][0][:, :-1], layers['soil_moisture'][0])
+    assert cube.n_days == N_DAYS
+
+
+def test_reopened_cube_reads_same_sums(cube, layers):
+    rows, cols = all_pixels()
+    reopened = ClimateCube(cube.cube_dir)
+    assert (reopened.start_date, reopened.n_days) == (cube.start_date, cube.n_days)
+    np.testing.assert_allclose(
+        reopened.window_sum('precipitation', rows, cols, day(2), day(21)),
+        layers['precipitation'][2:21, rows, cols].sum(axis=0), rtol=1e-10)
+
+
+def test_trim_drops_whole_chunks_and_keeps_sums(cube, layers):
+    rows, cols = all_pixels()
+    retain = 12
+    removed = cube.trim(retain)
+
+    # 23 ngay, khoi 5 ngay: xoa 2 khoi -> con 13 ngay (>= 12, xoa them 1 khoi thi < 12)
+    assert removed == 2
+    assert cube.start_date == day(10)
+    assert cube.n_days == 13
+    for series in SERIES:
+        assert not os.path.exists(cube._chunk_path(series, -1))
+        assert not os.path.exists(os.path.join(cube.cube_dir, f"{series}_{day(0).isoformat()}.npy"))
+    assert not cube.covers(day(9), day(N_DAYS))
+
+    for store in (cube, ClimateCube(cube.cube_dir)):
+        for a, b in [(10, 23), (11, 17), (14, 16), (20, 23)]:
+            np.testing.assert_allclose(
+                store.window_sum('precipitation', rows, cols, day(a), day(b)),
+                layers['precipitation'][a:b, rows, cols].sum(axis=0), rtol=1e-10, atol=1e-9)
+    assert cube.trim(retain) == 0
+
+
+def test_ingest_stops_at_missing_day_and_resumes(tmp_path, layers):
+    available = {'n': 9}
+
+    def fetch_day(date):
+        i = (date - START_DATE).days
+        if i >= available['n']:
+            return None
+        return layers['precipitation'][i], layers['soil_moisture'][i]
+
+    cube = ClimateCube.create(str(tmp_path / 'cube'), START_DATE, bbox=BBOX,
+                              resolution=GRID_RESOLUTION, chunk_days=CHUNK_DAYS)
+    assert ingest(cube, fetch_day, day(N_DAYS), retain_days=100) == 9
+    assert cube.end_date == day(9)
+
+    available['n'] = N_DAYS
+    assert ingest(ClimateCube(cube.cube_dir), fetch_day, day(N_DAYS), retain_days=100) == N_DAYS - 9
+
+    rows, cols = all_pixels()
+    resumed = ClimateCube(cube.cube_dir)
+    np.testing.assert_allclose(
+        resumed.window_sum('precipitation', rows, cols, day(0), day(N_DAYS)),
+        layers['precipitation'][:, rows, cols].sum(axis=0), rtol=1e-10)
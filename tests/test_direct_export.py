@@ -0,0 +1,109 @@
+import os
+
+import pandas as pd
+import pytest
+
+from direct_export import FeaturePager, export_collection
+
+
+def make_features(n, sparse_from=None):
+    """Feature GeoJSON nhu getInfo(); thuoc tinh 'sparse' chi co tu dong `sparse_from`."""
+    features = []
+    for i in range(n):
+        properties = {'label': i % 2, 'elevation': float(i), 'name': f"p{i}"}
+        if sparse_from is not None and i >= sparse_from:
+            properties['sparse'] = i * 10.0
+        features.append({
+            'id': f"{i:05d}",
+            'properties': properties,
+            'geometry': {'type': 'Point', 'coordinates': [105.0 + i * 1e-3, 21.0]},
+        })
+    return features
+
+
+class FakePager(FeaturePager):
+    """Server gia lap: tra trang tu list trong bo nho, co the loi o 1 offset."""
+
+    def __init__(self, features, columns=None, fail_at=None):
+        self.features = features
+        self._columns = columns
+        self.fail_at = fail_at
+        self.requests = []
+
+    def count(self):
+        return len(self.features)
+
+    def page(self, offset, limit):
+        self.requests.append((offset, limit))
+        if offset == self.fail_at:
+            raise RuntimeError("server loi")
+        return self.features[offset:offset + limit]
+
+    def columns(self):
+        return self._columns
+
+
+def read(path, fmt):
+    return pd.read_csv(path) if fmt == 'csv' else pd.read_parquet(path)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+@pytest.mark.parametrize('page_size, workers', [(7, 1), (7, 3), (100, 4), (1, 2)])
+def test_pages_are_written_in_order(tmp_path, fmt, page_size, workers):
+    features = make_features(23)
+    pager = FakePager(features)
+    out_path = str(tmp_path / f"event.{fmt}")
+
+    rows = export_collection(pager, out_path, fmt=fmt, page_size=page_size, max_workers=workers)
+
+    assert rows == 23
+    assert sorted(pager.requests) == [(o, page_size) for o in range(0, 23, page_size)]
+    df = read(out_path, fmt)
+    assert list(df.columns) == ['system:index', 'elevation', 'label', 'name', '.geo']
+    assert df['elevation'].tolist() == [float(i) for i in range(23)]
+    assert not os.path.exists(out_path + '.tmp')
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_sparse_column_from_schema_is_kept(tmp_path, fmt):
+    features = make_features(20, sparse_from=15)
+    pager = FakePager(features, columns=['elevation', 'label', 'name', 'sparse'])
+    out_path = str(tmp_path / f"event.{fmt}")
+
+    export_collection(pager, out_path, fmt=fmt, page_size=5, max_workers=2)
+
+    df = read(out_path, fmt)
+    assert df['sparse'].isna().sum() == 15
+    assert df['sparse'].iloc[15:].tolist() == [i * 10.0 for i in range(15, 20)]
+
+
+def test_column_missing_from_schema_is_rejected(tmp_path):
+    pager = FakePager(make_features(20, sparse_from=15), columns=None)
+    out_path = str(tmp_path / 'event.csv')
+
+    with pytest.raises(ValueError, match='sparse'):
+        export_collection(pager, out_path, page_size=5, max_workers=2)
+    assert not os.path.exists(out_path)
+    assert not os.path.exists(out_path + '.tmp')
+
+
+def test_failed_export_leaves_no_file_and_rerun_completes(tmp_path):
+    out_path = str(tmp_path / 'event.parquet')
+    failing = FakePager(make_features(30), fail_at=20)
+    with pytest.raises(RuntimeError):
+        export_collection(failing, out_path, fmt='parquet', page_size=10, max_workers=1)
+    assert not os.path.exists(out_path)
+    assert not os.path.exists(out_path + '.tmp')
+
+    # File tam con sot lai (vd. tien trinh bi kill) bi ghi de, khong bi noi them
+    with open(out_path + '.tmp', 'w') as f:
+        f.write('rac')
+    rows = export_collection(FakePager(make_features(30)), out_path, fmt='parquet', page_size=10)
+    assert rows == 30
+    assert len(read(out_path, 'parquet')) == 30
+
+
+def test_empty_collection_creates_empty_file(tmp_path):
+    out_path = str(tmp_path / 'event.csv')
+    assert export_collection(FakePager([]), out_path) == 0
+    assert os.path.getsize(out_path) == 0
@@ -0,0 +1,187 @@
+import json
+
+import pytest
+
+from export_scheduler import (
+    COMPLETED, FAILED, PENDING, SKIPPED, SUBMITTED, ExportScheduler, SkipJob, TaskBackend,
+)
+
+
+class FakeClock:
+    """Dong ho gia: sleep() chi tang thoi gian, khong cho that."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        assert seconds != float('inf'), "scheduler ngu mai mai"
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeBackend(TaskBackend):
+    """Backend gia: moi job co kich ban cac ket qua theo tung lan khoi tao.
+
+    Moi phan tu kich ban la 1 trong:
+        'COMPLETED' / 'FAILED'  -> task chay `polls` lan hoi roi ve trang thai do
+        'UNKNOWN'               -> EE khong bao gio biet task_id nay
+        'SKIP'                  -> start() raise SkipJob
+        'QUEUE_FULL'            -> start() raise loi (hang doi EE day)
+    """
+
+    def __init__(self, scripts, polls=1):
+        self.scripts = {job_id: list(script) for job_id, script in scripts.items()}
+        self.polls = polls
+        self.started = []
+        self.tasks = {}
+        self.max_running = 0
+
+    def start(self, job_id):
+        outcome = self.scripts[job_id].pop(0)
+        self.started.append(job_id)
+        if outcome == 'SKIP':
+            raise SkipJob(f"khong co anh cho {job_id}")
+        if outcome == 'QUEUE_FULL':
+            raise RuntimeError("Too many tasks already in the queue")
+        task_id = f"T{len(self.started)}"
+        self.tasks[task_id] = [outcome, self.polls]
+        return task_id
+
+    def status(self, task_ids):
+        running = [t for t in self.tasks.values() if t[1] > 0 and t[0] != 'UNKNOWN']
+        self.max_running = max(self.max_running, len(running))
+        result = {}
+        for task_id in task_ids:
+            outcome, remaining = self.tasks[task_id]
+            if outcome == 'UNKNOWN':
+                continue
+            if remaining > 0:
+                self.tasks[task_id][1] -= 1
+                result[task_id] = ('RUNNING', None)
+            else:
+                result[task_id] = (outcome, 'loi gia' if outcome == 'FAILED' else None)
+        return result
+
+
+def make_scheduler(backend, clock, state_path=None, **kwargs):
+    params = dict(max_in_flight=2, max_attempts=3, poll_interval=10.0,
+                  backoff_base=60.0, backoff_max=200.0, unknown_timeout=100.0)
+    params.update(kwargs)
+    return ExportScheduler(backend, state_path=state_path, clock=clock, sleep=clock.sleep, **params)
+
+
+def test_all_jobs_complete_within_concurrency_limit():
+    clock = FakeClock()
+    backend = FakeBackend({f"e{i}": ['COMPLETED'] for i in range(5)}, polls=2)
+    results = make_scheduler(backend, clock).run([f"e{i}" for i in range(5)])
+
+    assert results == {f"e{i}": COMPLETED for i in range(5)}
+    assert sorted(backend.started) == [f"e{i}" for i in range(5)]
+    assert backend.max_running <= 2
+
+
+def test_failed_task_is_retried_with_exponential_backoff():
+    clock = FakeClock()
+    backend = FakeBackend({'a': ['FAILED', 'QUEUE_FULL', 'FAILED']}, polls=0)
+    scheduler = make_scheduler(backend, clock)
+    retries = []
+    original_start = scheduler._start
+    scheduler._start = lambda job_id: retries.append(clock.now) or original_start(job_id)
+
+    results = scheduler.run(['a'])
+
+    assert results == {'a': FAILED}
+    assert backend.started == ['a', 'a', 'a']
+    assert scheduler.jobs['a']['attempts'] == 3
+    assert scheduler.jobs['a']['error'] == 'loi gia'
+    # Lan 1 bao FAILED o lan hoi dau tien (t=10) -> cho 60s; lan 2 loi ngay khi khoi tao -> cho 120s
+    assert retries == [0.0, 70.0, 190.0]
+
+
+def test_backoff_is_capped():
+    scheduler = make_scheduler(FakeBackend({}), FakeClock())
+    assert [scheduler._backoff(k) for k in (1, 2, 3, 4)] == [60.0, 120.0, 200.0, 200.0]
+
+
+def test_unknown_task_id_fails_after_timeout():
+    clock = FakeClock()
+    backend = FakeBackend({'a': ['UNKNOWN', 'COMPLETED']})
+    scheduler = make_scheduler(backend, clock)
+
+    results = scheduler.run(['a'])
+
+    assert results == {'a': COMPLETED}
+    assert backend.started == ['a', 'a']
+    # Lan 1: UNKNOWN tu t=0, bi coi la loi khi du 100s, roi cho backoff 60s
+    assert clock.now >= 100.0 + 60.0
+    assert scheduler.jobs['a']['attempts'] == 2
+
+
+def test_skipped_job_is_final_and_not_retried():
+    clock = FakeClock()
+    backend = FakeBackend({'a': ['SKIP'], 'b': ['COMPLETED']})
+    results = make_scheduler(backend, clock).run(['a', 'b'])
+
+    assert results == {'a': SKIPPED, 'b': COMPLETED}
+    assert backend.started.count('a') == 1
+
+
+def test_state_file_resume_does_not_restart_jobs(tmp_path):
+    state_path = str(tmp_path / 'export_state.json')
+    clock = FakeClock()
+    backend = FakeBackend({'a': ['COMPLETED'], 'b': ['COMPLETED'], 'c': ['COMPLETED']}, polls=5)
+
+    # Lan chay 1 bi ngat sau vai vong hoi trang thai
+    def interrupted_sleep(seconds):
+        clock.sleep(seconds)
+        if clock.now >= 20.0:
+            raise KeyboardInterrupt
+    scheduler = ExportScheduler(backend, state_path=state_path, max_in_flight=2,
+                                poll_interval=10.0, clock=clock, sleep=interrupted_sleep)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run(['a', 'b', 'c'])
+
+    with open(state_path, encoding='utf-8') as f:
+        saved = json.load(f)['jobs']
+    assert {job_id: job['state'] for job_id, job in saved.items()} == {
+        'a': SUBMITTED, 'b': SUBMITTED, 'c': PENDING,
+    }
+
+    # Lan chay 2 tiep tuc: a, b chi duoc hoi trang thai, chi c duoc khoi tao
+    resumed = make_scheduler(backend, clock, state_path=state_path)
+    assert resumed.run(['a', 'b', 'c']) == {'a': COMPLETED, 'b': COMPLETED, 'c': COMPLETED}
+    assert backend.started == ['a', 'b', 'c']
+
+    # Lan chay 3: moi job da xong -> khong khoi tao gi them
+    assert make_scheduler(backend, clock, state_path=state_path).run(['a', 'b', 'c']) == {
+        'a': COMPLETED, 'b': COMPLETED, 'c': COMPLETED,
+    }
+    assert backend.started == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('flag, retried', [
+    ({}, set()),
+    ({'retry_failed': True}, {'failed'}),
+    ({'retry_skipped': True}, {'skipped'}),
+    ({'retry_failed': True, 'retry_skipped': True}, {'failed', 'skipped'}),
+])
+def test_retry_flags_requeue_final_jobs(tmp_path, flag, retried):
+    state_path = str(tmp_path / 'export_state.json')
+    clock = FakeClock()
+    backend = FakeBackend({'failed': ['FAILED', 'COMPLETED'], 'skipped': ['SKIP', 'COMPLETED'],
+                           'done': ['COMPLETED']}, polls=0)
+    first = make_scheduler(backend, clock, state_path=state_path, max_attempts=1).run(
+        ['failed', 'skipped', 'done'])
+    assert first == {'failed': FAILED, 'skipped': SKIPPED, 'done': COMPLETED}
+
+    second = make_scheduler(backend, clock, state_path=state_path, **flag).run(
+        ['failed', 'skipped', 'done'])
+
+    assert second == {'failed': COMPLETED if 'failed' in retried else FAILED,
+                      'skipped': COMPLETED if 'skipped' in retried else SKIPPED,
+                      'done': COMPLETED}
+    assert backend.started[3:] == [j for j in ('failed', 'skipped') if j in retried]
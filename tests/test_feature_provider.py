@@ -0,0 +1,79 @@
+import sys
+import datetime
+import subprocess
+
+import numpy as np
+import pytest
+
+from conftest import GRID_SHAPE, ROOT_DIR, pixel_center
+from feature_provider import (
+    DYNAMIC_END_LAG_DAYS, FEATURES_ORDER, LocalRasterFeatureProvider, StaleGridError,
+)
+from rainfall import ANTECEDENT_WINDOWS
+from climate_store import SOIL_MOISTURE_WINDOW_DAYS
+
+START_DATE = datetime.date(2026, 8, 1)
+N_DAYS = 40
+
+
+def expected_dynamic(layers, reference_date, row, col):
+    """Dac trung dong tinh truc tiep bang numpy (khong qua provider)."""
+    end = (reference_date - START_DATE).days - DYNAMIC_END_LAG_DAYS
+    out = {name: layers['precipitation'][end - days:end, row, col].astype(np.float32).sum(dtype=np.float64)
+           for name, days in ANTECEDENT_WINDOWS.items()}
+    sm = layers['soil_moisture'][end - SOIL_MOISTURE_WINDOW_DAYS:end, row, col].astype(np.float32)
+    out['soil_moisture'] = float(np.nanmean(sm)) if np.isfinite(sm).any() else 0.0
+    return out
+
+
+def test_window_sums_match_numpy(synthetic_grid):
+    grid_dir, layers = synthetic_grid(START_DATE, N_DAYS)
+    reference_date = START_DATE + datetime.timedelta(days=30)
+    provider = LocalRasterFeatureProvider(grid_dir, reference_date=reference_date)
+    provider.check_coverage()
+
+    cells = [(r, c) for r in range(GRID_SHAPE[0]) for c in range(GRID_SHAPE[1])]
+    results = provider.get_features_batch([pixel_center(r, c) for r, c in cells])
+    for (r, c), result in zip(cells, results):
+        assert list(result) == FEATURES_ORDER
+        assert result['elevation'] == pytest.approx(np.float32(layers['elevation'][r, c]))
+        for name, value in expected_dynamic(layers, reference_date, r, c).items():
+            assert result[name] == pytest.approx(value, rel=1e-6)
+
+
+def test_points_outside_grid_are_null(synthetic_grid):
+    grid_dir, _ = synthetic_grid(START_DATE, N_DAYS)
+    provider = LocalRasterFeatureProvider(grid_dir, reference_date=START_DATE + datetime.timedelta(days=30))
+    result = provider.get_features(0.0, 0.0)
+    assert all(value is None for value in result.values())
+
+
+@pytest.mark.parametrize('days_after_start', [
+    N_DAYS + DYNAMIC_END_LAG_DAYS + 1,   # luoi cu: ngay cuoi cua cua so sau ngay cuoi cua luoi
+    DYNAMIC_END_LAG_DAYS + 5,            # luoi qua ngan: cua so 14 ngay bat dau truoc luoi
+])
+def test_stale_or_short_grid_raises(synthetic_grid, days_after_start):
+    grid_dir, _ = synthetic_grid(START_DATE, N_DAYS)
+    provider = LocalRasterFeatureProvider(
+        grid_dir, reference_date=START_DATE + datetime.timedelta(days=days_after_start)
+    )
+    with pytest.raises(StaleGridError):
+        provider.check_coverage()
+    with pytest.raises(StaleGridError):
+        provider.get_features(*pixel_center(0, 0))
+    with pytest.raises(StaleGridError):
+        provider.features_in_window(0, 2, 0, 2)
+
+
+def test_last_covered_day_is_accepted(synthetic_grid):
+    grid_dir, _ = synthetic_grid(START_DATE, N_DAYS)
+    provider = LocalRasterFeatureProvider(
+        grid_dir, reference_date=START_DATE + datetime.timedelta(days=N_DAYS + DYNAMIC_END_LAG_DAYS)
+    )
+    provider.check_coverage()
+
+
+def test_local_sources_import_without_earthengine():
+    code = ("import sys; sys.modules['ee'] = None; sys.path.insert(0, 'src'); "
+            "import feature_provider, climate_store")
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, check=True)
@@ -0,0 +1,63 @@
+import os
+import json
+import shutil
+
+import pytest
+
+import model_bundle
+from model_bundle import (
+    BUNDLE_DIR, MANIFEST_FILE, BundleError, library_mismatches, load_model_bundle,
+)
+
+
+@pytest.fixture
+def bundle_copy(tmp_path):
+    target = str(tmp_path / 'bundle')
+    shutil.copytree(BUNDLE_DIR, target)
+    return target
+
+
+def edit_manifest(bundle_dir, **changes):
+    path = os.path.join(bundle_dir, MANIFEST_FILE)
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest.update(changes)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def test_library_mismatches_compare_major_versions(monkeypatch):
+    installed = {'xgboost': '3.2.0', 'numpy': '2.4.6'}
+    monkeypatch.setattr(model_bundle.importlib_metadata, 'version', lambda name: installed[name])
+
+    same_major = {'libraries': {'xgboost': '3.0.5', 'numpy': '2.0.0', 'scikit-learn': '0.24'}}
+    assert library_mismatches(same_major) == []
+    other_major = {'libraries': {'xgboost': '2.1.4', 'numpy': '1.26.4'}}
+    assert library_mismatches(other_major) == [('xgboost', '2.1.4', '3.2.0'), ('numpy', '1.26.4', '2.4.6')]
+    assert library_mismatches({}) == []
+
+
+def test_load_warns_on_major_version_mismatch(bundle_copy, capsys):
+    edit_manifest(bundle_copy, libraries={'xgboost': '1.7.6', 'numpy': '1.26.4'})
+    load_model_bundle(bundle_copy, verify=False)
+    out = capsys.readouterr().out
+    assert 'CANH BAO' in out and 'xgboost 1.7.6' in out and 'numpy 1.26.4' in out
+
+
+def test_verify_false_skips_hashing_but_checks_files(bundle_copy, monkeypatch):
+    monkeypatch.setattr(model_bundle, '_sha256', lambda path: pytest.fail("khong duoc hash khi verify=False"))
+    bundle = load_model_bundle(bundle_copy, verify=False)
+    assert bundle.inference_model.n_trees == bundle.manifest['n_trees']
+
+    os.remove(os.path.join(bundle_copy, 'scaler.json'))
+    with pytest.raises(BundleError, match='scaler.json'):
+        load_model_bundle(bundle_copy, verify=False)
+
+
+def test_verify_detects_modified_file(bundle_copy):
+    load_model_bundle(bundle_copy)
+    with open(os.path.join(bundle_copy, 'scaler.json'), 'a', encoding='utf-8') as f:
+        f.write(' ')
+    load_model_bundle(bundle_copy, verify=False)
+    with pytest.raises(BundleError, match='sha256'):
+        load_model_bundle(bundle_copy)
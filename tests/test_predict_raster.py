@@ -0,0 +1,70 @@
+import os
+import json
+import datetime
+
+import numpy as np
+
+from feature_provider import FEATURES_ORDER, LocalRasterFeatureProvider
+from predict_raster import (
+    NODATA, PROBABILITY_SCALE, grid_fingerprint, list_tiles, prepare_output, score_window,
+)
+
+START_DATE = datetime.date(2026, 8, 1)
+N_DAYS = 30
+
+
+def make_meta(grid_dir, tile_size=4):
+    window = (0, 6, 0, 8)
+    tiles = list_tiles(window, tile_size)
+    meta = {'height': 6, 'width': 8, 'n_tile_rows': tiles[-1][0] + 1, 'n_tile_cols': tiles[-1][1] + 1}
+    meta['run_signature'] = json.dumps({'grid': grid_fingerprint(grid_dir), 'window': list(window),
+                                        'tile_size': tile_size}, sort_keys=True)
+    return meta
+
+
+def test_fingerprint_changes_when_grid_is_rewritten(synthetic_grid):
+    grid_dir, _ = synthetic_grid(START_DATE, N_DAYS)
+    first = grid_fingerprint(grid_dir)
+    assert grid_fingerprint(grid_dir) == first
+
+    # Cung thu muc, noi dung moi (vd. tai lai luoi ngay hom sau)
+    synthetic_grid(START_DATE + datetime.timedelta(days=1), N_DAYS, seed=1)
+    assert grid_fingerprint(grid_dir) != first
+
+
+def test_prepare_output_resumes_only_for_same_grid(synthetic_grid, tmp_path):
+    grid_dir, _ = synthetic_grid(START_DATE, N_DAYS)
+    output_dir = str(tmp_path / 'risk_raster')
+
+    _, done, resumed = prepare_output(output_dir, make_meta(grid_dir))
+    assert not resumed and done.shape == (2, 2)
+    done[0, 1] = 1
+    done.flush()
+    del done
+
+    _, done, resumed = prepare_output(output_dir, make_meta(grid_dir))
+    assert resumed and done[0, 1] == 1
+    del done
+
+    synthetic_grid(START_DATE, N_DAYS, seed=1)
+    raster_path, done, resumed = prepare_output(output_dir, make_meta(grid_dir))
+    assert not resumed and not done.any()
+    assert (np.load(raster_path) == NODATA).all()
+    assert not os.path.exists(os.path.join(output_dir, 'raster.json'))
+
+
+def test_score_window_scales_probabilities_and_marks_nodata(synthetic_grid):
+    grid_dir, layers = synthetic_grid(START_DATE, N_DAYS)
+    elevation = np.load(os.path.join(grid_dir, 'elevation.npy'))
+    elevation[0, 0] = np.nan
+    np.save(os.path.join(grid_dir, 'elevation.npy'), elevation)
+    provider = LocalRasterFeatureProvider(grid_dir, reference_date=START_DATE + datetime.timedelta(days=20))
+
+    # Xac suat gia = elevation / 50 (elevation la cot dau tien, trong [0, 50))
+    assert FEATURES_ORDER[0] == 'elevation'
+    window = score_window(provider, lambda X: X[:, 0] / 50.0, 0, 6, 0, 8)
+
+    assert window.dtype == np.uint8 and window.shape == (6, 8)
+    assert window[0, 0] == NODATA
+    expected = np.round(layers['elevation'].astype(np.float32) / 50.0 * PROBABILITY_SCALE)
+    np.testing.assert_array_equal(window.ravel()[1:], expected.ravel()[1:])
@@ -0,0 +1,85 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from model_bundle import BUNDLE_DIR, BOOSTER_MIN_ROWS, load_model_bundle
+from tree_inference import CompiledTreeModel, PARITY_TOLERANCE, RAW_DATA_DIR
+
+# Mau co dinh: 1 file du lieu tho + cac diem ngau nhien (seed co dinh) quanh gia tri trung binh
+SAMPLE_FILE = os.path.join(RAW_DATA_DIR, 'FL_TRN_2015_07.csv')
+N_RANDOM_ROWS = 2000
+
+
+@pytest.fixture(scope='module')
+def bundle():
+    return load_model_bundle(BUNDLE_DIR)
+
+
+@pytest.fixture(scope='module')
+def sample(bundle):
+    X_data = pd.read_csv(SAMPLE_FILE)[bundle.features].dropna().to_numpy(dtype=np.float64)
+    mean = np.asarray(bundle.scaler_params['mean'])
+    scale = np.asarray(bundle.scaler_params['scale'])
+    rng = np.random.RandomState(0)
+    X_random = mean + scale * rng.normal(0.0, 2.0, size=(N_RANDOM_ROWS, len(mean)))
+    return np.vstack([X_data, X_random])
+
+
+def test_compiled_matches_xgboost(bundle, sample):
+    expected = bundle.predict_proba_booster(sample)
+    actual = bundle.inference_model.predict_proba(sample)
+    assert np.max(np.abs(expected - actual)) < PARITY_TOLERANCE
+
+
+def test_recompiled_booster_matches_xgboost(bundle, sample):
+    scaler = bundle.scaler_params
+    engine = CompiledTreeModel.from_booster_json(
+        json.loads(bundle.booster.save_raw('json')),
+        mean=scaler['mean'], scale=scaler['scale'], n_trees=bundle.manifest['n_trees'],
+    )
+    expected = bundle.predict_proba_booster(sample)
+    assert np.max(np.abs(expected - engine.predict_proba(sample))) < PARITY_TOLERANCE
+
+
+def test_missing_values_follow_default_branch(bundle, sample):
+    X = sample[:500].copy()
+    X[::3, 0] = np.nan
+    X[1::3, -1] = np.nan
+    expected = bundle.predict_proba_booster(X)
+    actual = bundle.inference_model.predict_proba(X)
+    assert np.max(np.abs(expected - actual)) < PARITY_TOLERANCE
+
+
+@pytest.mark.parametrize('n_rows, engine', [
+    (1, 'compiled'),
+    (BOOSTER_MIN_ROWS - 1, 'compiled'),
+    (BOOSTER_MIN_ROWS, 'booster'),
+    (4096, 'booster'),
+])
+def test_predict_proba_routes_by_batch_size(bundle, sample, monkeypatch, n_rows, engine):
+    calls = []
+    compiled = bundle.inference_model
+    original_compiled = compiled.predict_proba
+    original_booster = bundle.predict_proba_booster
+    monkeypatch.setattr(compiled, 'predict_proba',
+                        lambda X: calls.append('compiled') or original_compiled(X))
+    monkeypatch.setattr(bundle, 'predict_proba_booster',
+                        lambda X: calls.append('booster') or original_booster(X))
+
+    X = np.resize(sample, (n_rows, sample.shape[1]))
+    result = bundle.predict_proba(X)
+
+    assert calls == [engine]
+    assert result.shape == (n_rows,)
+    assert np.max(np.abs(result - original_booster(X))) < PARITY_TOLERANCE
+
+
+def test_predict_proba_falls_back_without_xgboost(bundle, sample, monkeypatch):
+    monkeypatch.setattr(bundle, '_has_xgboost', False)
+    monkeypatch.setattr(bundle, 'predict_proba_booster',
+                        lambda X: pytest.fail("khong duoc goi booster khi thieu xgboost"))
+    X = np.resize(sample, (BOOSTER_MIN_ROWS * 4, sample.shape[1]))
+    assert bundle.predict_proba(X).shape == (len(X),)